@@ -0,0 +1,189 @@
+"""
+Local stand-ins of the OpenAI, Anthropic, SageMaker runtime and S3 APIs for load testing the LLM Gateway.
+
+Every call waits for the configured latency and returns a payload of the configured size, so the
+gateway can be benchmarked without calling, or paying for, the real providers.
+
+Usage:
+
+    python benchmarks/llm_gateway/fake_upstreams.py --port 9000 --latency-ms 50
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+
+LATENCY_SECONDS = float(os.environ.get("FAKE_UPSTREAM_LATENCY_MS", 50)) / 1000
+COMPLETION_WORDS = int(os.environ.get("FAKE_UPSTREAM_COMPLETION_WORDS", 100))
+EMBEDDING_DIMENSIONS = int(os.environ.get("FAKE_UPSTREAM_EMBEDDING_DIMENSIONS", 1536))
+IMAGE_BYTES = int(os.environ.get("FAKE_UPSTREAM_IMAGE_BYTES", 256 * 1024))
+
+app = FastAPI(title="Fake LLM upstreams")
+
+
+def _completion():
+    return " ".join(["token"] * COMPLETION_WORDS)
+
+
+def _embedding():
+    return np.random.default_rng().random(EMBEDDING_DIMENSIONS, dtype=np.float32)
+
+
+def _image():
+    # A JPEG signature followed by random bytes, so the gateway passes it through without re-encoding
+    return base64.b64encode(b"\xff\xd8\xff" + os.urandom(IMAGE_BYTES)).decode("utf-8")
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY_SECONDS)
+    return {
+        "id": "chatcmpl-{}".format(uuid.uuid4()),
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body["model"],
+        "choices": [
+            {"index": 0, "message": {"role": "assistant", "content": _completion()}, "finish_reason": "stop"}
+        ],
+        "usage": {"prompt_tokens": 10, "completion_tokens": COMPLETION_WORDS, "total_tokens": 10 + COMPLETION_WORDS}
+    }
+
+
+@app.post("/v1/embeddings")
+async def openai_embeddings(request: Request):
+    body = await request.json()
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    await asyncio.sleep(LATENCY_SECONDS)
+    embeddings = [_embedding() for _ in inputs]
+    # Returned as a JSONResponse to skip FastAPI's per-value encoding, which would dominate the latency
+    return JSONResponse({
+        "object": "list",
+        "model": body["model"],
+        "data": [
+            {
+                "object": "embedding",
+                "embedding": (
+                    base64.b64encode(_embedding.tobytes()).decode("utf-8")
+                    if body.get("encoding_format") == "base64" else _embedding.tolist()
+                ),
+                "index": _index
+            } for _index, _embedding in enumerate(embeddings)
+        ],
+        "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}
+    })
+
+
+@app.post("/v1/images/generations")
+async def openai_images(request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY_SECONDS)
+    if body.get("response_format") == "b64_json":
+        data = [{"b64_json": _image()} for _ in range(body.get("n", 1))]
+    else:
+        data = [{"url": "http://fake-upstreams/{}.jpeg".format(uuid.uuid4())} for _ in range(body.get("n", 1))]
+    return {"created": int(time.time()), "data": data}
+
+
+@app.post("/v1/messages")
+async def anthropic_messages(request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY_SECONDS)
+    return {
+        "id": "msg_{}".format(uuid.uuid4().hex),
+        "type": "message",
+        "role": "assistant",
+        "model": body["model"],
+        "content": [{"type": "text", "text": _completion()}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": 10, "output_tokens": COMPLETION_WORDS}
+    }
+
+
+def _sagemaker_response(body):
+    if isinstance(body, (list, str)):
+        inputs = body if isinstance(body, list) else [body]
+        return {"embedding": [_embedding().tolist() for _ in inputs]}
+    if "prompt" in body:
+        return {"generated_images": [_image() for _ in range(body.get("num_images_per_prompt", 1))]}
+    return [{"generation": {"role": "assistant", "content": _completion()}} for _ in body["inputs"]]
+
+
+@app.post("/endpoints/{endpoint_name}/invocations")
+async def sagemaker_invocations(endpoint_name: str, request: Request):
+    body = json.loads(await request.body())
+    await asyncio.sleep(LATENCY_SECONDS)
+    return JSONResponse(_sagemaker_response(body))
+
+
+@app.post("/endpoints/{endpoint_name}/async-invocations")
+async def sagemaker_async_invocations(endpoint_name: str, request: Request):
+    # The input is read from, and the output written to, the S3 stand-in below
+    bucket, _, input_key = request.headers["X-Amzn-SageMaker-InputLocation"][len("s3://"):].partition("/")
+    inference_id = str(uuid.uuid4())
+    output_key = "async-inference/outputs/{}.out".format(inference_id)
+
+    async def _infer():
+        await asyncio.sleep(LATENCY_SECONDS)
+        body = json.loads(S3_OBJECTS[(bucket, input_key)])
+        S3_OBJECTS[(bucket, output_key)] = json.dumps(_sagemaker_response(body)).encode("utf-8")
+
+    asyncio.ensure_future(_infer())
+    return JSONResponse({"InferenceId": inference_id}, status_code=202, headers={
+        "X-Amzn-SageMaker-OutputLocation": "s3://{}/{}".format(bucket, output_key),
+        "X-Amzn-SageMaker-FailureLocation": "s3://{}/async-inference/failures/{}.out".format(bucket, inference_id),
+    })
+
+
+S3_OBJECTS = {}
+
+
+@app.put("/{bucket}/{key:path}")
+async def s3_put_object(bucket: str, key: str, request: Request):
+    S3_OBJECTS[(bucket, key)] = await request.body()
+    return Response(status_code=200)
+
+
+@app.get("/{bucket}/{key:path}")
+async def s3_get_object(bucket: str, key: str):
+    content = S3_OBJECTS.get((bucket, key))
+    if content is None:
+        return Response(
+            "<Error><Code>NoSuchKey</Code><Message>The specified key does not exist.</Message></Error>",
+            status_code=404,
+            media_type="application/xml"
+        )
+    return Response(content, media_type="application/octet-stream")
+
+
+def main():
+    global LATENCY_SECONDS, COMPLETION_WORDS, EMBEDDING_DIMENSIONS, IMAGE_BYTES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_SECONDS * 1000)
+    parser.add_argument("--completion-words", type=int, default=COMPLETION_WORDS)
+    parser.add_argument("--embedding-dimensions", type=int, default=EMBEDDING_DIMENSIONS)
+    parser.add_argument("--image-bytes", type=int, default=IMAGE_BYTES)
+    args = parser.parse_args()
+
+    LATENCY_SECONDS = args.latency_ms / 1000
+    COMPLETION_WORDS = args.completion_words
+    EMBEDDING_DIMENSIONS = args.embedding_dimensions
+    IMAGE_BYTES = args.image_bytes
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Load test of the LLM Gateway against local fake providers.
+
+It starts the fake upstreams and the real gateway server, pointed at them, in separate processes.
+Then it sends chat, embeddings and image requests at several concurrency levels and reports the
+throughput and the p50, p95 and p99 latencies of every scenario as JSON.
+
+Usage:
+
+    python benchmarks/llm_gateway/run.py --concurrency 1 16 64 --requests 500 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+import sagify.llm_gateway
+
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+ENDPOINTS = {
+    "chat": "/v1/chat/completions",
+    "embeddings": "/v1/embeddings",
+    "images": "/v1/images/generations",
+}
+
+SUPPORTED_ENDPOINTS = {
+    "openai": ["chat", "embeddings", "images"],
+    "anthropic": ["chat"],
+    "sagemaker": ["chat", "embeddings", "images"],
+}
+
+
+def _payload(provider, endpoint, index, args):
+    # Every request is different so that the gateway caches don't serve it
+    if endpoint == "chat":
+        return {
+            "provider": provider,
+            "model": None,
+            "messages": [{"role": "user", "content": "Benchmark request {}".format(index)}],
+            "temperature": 0.7,
+            "max_tokens": 100,
+            "top_p": None,
+            "seed": None
+        }
+    if endpoint == "embeddings":
+        return {
+            "provider": provider,
+            "model": None,
+            "input": ["Benchmark request {} text {}".format(index, _i) for _i in range(args.embedding_inputs)],
+            "encoding_format": args.encoding_format
+        }
+    return {
+        "provider": provider,
+        "model": None,
+        "prompt": "Benchmark request {}".format(index),
+        "n": args.images,
+        "width": 512,
+        "height": 512,
+        "seed": None,
+        "response_format": "b64_json"
+    }
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(percentile / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def _run_scenario(client, provider, endpoint, concurrency, args):
+    requests = iter(range(args.requests))
+    latencies, errors = [], 0
+
+    async def _worker():
+        nonlocal errors
+        for _index in requests:
+            started_at = time.perf_counter()
+            try:
+                response = await client.post(ENDPOINTS[endpoint], json=_payload(provider, endpoint, _index, args))
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started_at)
+            except httpx.HTTPError:
+                errors += 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*[_worker() for _ in range(concurrency)])
+    duration = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "provider": provider,
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "errors": errors,
+        "duration_seconds": round(duration, 4),
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            "p50": round(_percentile(latencies, 50) * 1000, 2) if latencies else None,
+            "p95": round(_percentile(latencies, 95) * 1000, 2) if latencies else None,
+            "p99": round(_percentile(latencies, 99) * 1000, 2) if latencies else None,
+        }
+    }
+
+
+async def _run(args, gateway_url):
+    results = []
+    for _provider in args.providers:
+        for _endpoint in args.endpoints:
+            if _endpoint not in SUPPORTED_ENDPOINTS[_provider]:
+                continue
+            for _concurrency in args.concurrency:
+                limits = httpx.Limits(max_connections=_concurrency, max_keepalive_connections=_concurrency)
+                async with httpx.AsyncClient(base_url=gateway_url, limits=limits, timeout=300) as client:
+                    for _index in range(min(_concurrency, args.requests)):
+                        await client.post(ENDPOINTS[_endpoint], json=_payload(_provider, _endpoint, -_index - 1, args))
+                    result = await _run_scenario(client, _provider, _endpoint, _concurrency, args)
+                print(json.dumps(result), file=sys.stderr)
+                results.append(result)
+    return results
+
+
+def _free_port():
+    with socket.socket() as _socket:
+        _socket.bind(("127.0.0.1", 0))
+        return _socket.getsockname()[1]
+
+
+def _wait_until_listening(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Process exited with code {}".format(process.returncode))
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Nothing listening on port {} after {} seconds".format(port, timeout))
+
+
+def _gateway_env(args, upstream_url):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "fake",
+        "OPENAI_BASE_URL": "{}/v1".format(upstream_url),
+        "OPENAI_CHAT_COMPLETIONS_MODEL": "fake-chat",
+        "OPENAI_EMBEDDINGS_MODEL": "fake-embeddings",
+        "OPENAI_IMAGE_CREATION_MODEL": "fake-images",
+        "ANTHROPIC_API_KEY": "fake",
+        "ANTHROPIC_BASE_URL": upstream_url,
+        "ANTHROPIC_CHAT_COMPLETIONS_MODEL": "fake-chat",
+        "AWS_ACCESS_KEY_ID": "fake",
+        "AWS_SECRET_ACCESS_KEY": "fake",
+        "SM_RUNTIME_ENDPOINT_URL": upstream_url,
+        "SM_CHAT_COMPLETIONS_MODEL": "fake-chat",
+        "SM_EMBEDDINGS_MODEL": "fake-embeddings",
+        "SM_IMAGE_CREATION_MODEL": "fake-images",
+        "GATEWAY_WORKERS": str(args.workers),
+    })
+    if not args.keep_caches:
+        env.update({"CACHE_BACKEND": "none", "EMBEDDING_CACHE_MAX_SIZE_IN_MB": "0"})
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", nargs="+", default=["openai", "anthropic", "sagemaker"],
+                        choices=sorted(SUPPORTED_ENDPOINTS))
+    parser.add_argument("--endpoints", nargs="+", default=sorted(ENDPOINTS), choices=sorted(ENDPOINTS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32, 128])
+    parser.add_argument("--requests", type=int, default=500, help="Requests per scenario")
+    parser.add_argument("--workers", type=int, default=1, help="Gateway worker processes")
+    parser.add_argument("--upstream-latency-ms", type=float, default=50)
+    parser.add_argument("--completion-words", type=int, default=100)
+    parser.add_argument("--embedding-dimensions", type=int, default=1536)
+    parser.add_argument("--embedding-inputs", type=int, default=16, help="Texts per embeddings request")
+    parser.add_argument("--encoding-format", default="float", choices=["float", "base64"],
+                        help="Encoding of the embeddings in the gateway responses")
+    parser.add_argument("--image-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--images", type=int, default=1, help="Images per generation request")
+    parser.add_argument("--keep-caches", action="store_true", help="Don't disable the gateway caches")
+    parser.add_argument("--output", help="File to write the results to, instead of stdout")
+    args = parser.parse_args()
+
+    upstream_port, gateway_port = _free_port(), _free_port()
+    upstream_url = "http://127.0.0.1:{}".format(upstream_port)
+    processes = []
+    try:
+        upstream = subprocess.Popen([
+            sys.executable, os.path.join(BENCHMARK_DIR, "fake_upstreams.py"),
+            "--port", str(upstream_port),
+            "--latency-ms", str(args.upstream_latency_ms),
+            "--completion-words", str(args.completion_words),
+            "--embedding-dimensions", str(args.embedding_dimensions),
+            "--image-bytes", str(args.image_bytes),
+        ])
+        processes.append(upstream)
+        _wait_until_listening(upstream_port, upstream)
+
+        gateway = subprocess.Popen(
+            [sys.executable, "-m", "sagify.llm_gateway.main", str(gateway_port)],
+            env=_gateway_env(args, upstream_url)
+        )
+        processes.append(gateway)
+        _wait_until_listening(gateway_port, gateway)
+
+        results = asyncio.run(_run(args, "http://127.0.0.1:{}".format(gateway_port)))
+    finally:
+        for _process in processes:
+            _process.terminate()
+        for _process in processes:
+            _process.wait()
+
+    report = {
+        "gateway_version": sagify.llm_gateway.__version__,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            _key: _value for _key, _value in vars(args).items() if _key not in ("output", "providers", "endpoints")
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
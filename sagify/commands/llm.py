@@ -646,7 +646,48 @@ def stop(
     required=False,
     help="The platform to use for the docker build"
 )
-def gateway(image, start_local, platform):
+@click.option(
+    u"--workers",
+    required=False,
+    default=None,
+    help="Number of gateway worker processes, or auto for one per CPU core"
+)
+@click.option(
+    u"--loop",
+    type=click.Choice(['auto', 'asyncio', 'uvloop']),
+    required=False,
+    default=None,
+    help="Event loop implementation of the gateway"
+)
+@click.option(
+    u"--http",
+    type=click.Choice(['auto', 'h11', 'httptools']),
+    required=False,
+    default=None,
+    help="HTTP parser implementation of the gateway"
+)
+@click.option(
+    u"--backlog",
+    type=int,
+    required=False,
+    default=None,
+    help="Maximum number of connections waiting to be accepted"
+)
+@click.option(
+    u"--keep-alive",
+    type=int,
+    required=False,
+    default=None,
+    help="Seconds to keep idle connections open"
+)
+@click.option(
+    u"--limit-concurrency",
+    type=int,
+    required=False,
+    default=None,
+    help="Maximum number of concurrent connections per worker, beyond which requests are rejected with 503"
+)
+def gateway(image, start_local, platform, workers, loop, http, backlog, keep_alive, limit_concurrency):
     """
     Command to build gateway docker image and start the gateway locally
     """
@@ -665,6 +706,78 @@ def gateway(image, start_local, platform):
         'SM_CHAT_COMPLETIONS_MODEL': os.environ.get('SM_CHAT_COMPLETIONS_MODEL'),
         'SM_EMBEDDINGS_MODEL': os.environ.get('SM_EMBEDDINGS_MODEL'),
         'SM_IMAGE_CREATION_MODEL': os.environ.get('SM_IMAGE_CREATION_MODEL'),
+        'GATEWAY_WORKERS': workers or os.environ.get('GATEWAY_WORKERS'),
+        'GATEWAY_LOOP': loop or os.environ.get('GATEWAY_LOOP'),
+        'GATEWAY_HTTP': http or os.environ.get('GATEWAY_HTTP'),
+        'GATEWAY_BACKLOG': backlog or os.environ.get('GATEWAY_BACKLOG'),
+        'GATEWAY_KEEP_ALIVE_IN_SECONDS': keep_alive or os.environ.get('GATEWAY_KEEP_ALIVE_IN_SECONDS'),
+        'GATEWAY_LIMIT_CONCURRENCY': limit_concurrency or os.environ.get('GATEWAY_LIMIT_CONCURRENCY'),
+        'OPENAI_MAX_CONNECTIONS': os.environ.get('OPENAI_MAX_CONNECTIONS'),
+        'ANTHROPIC_MAX_CONNECTIONS': os.environ.get('ANTHROPIC_MAX_CONNECTIONS'),
+        'SM_MAX_CONNECTIONS': os.environ.get('SM_MAX_CONNECTIONS'),
+        'SM_MAX_WORKERS': os.environ.get('SM_MAX_WORKERS'),
+        'SM_RUNTIME_ENDPOINT_URL': os.environ.get('SM_RUNTIME_ENDPOINT_URL'),
+        'S3_ENDPOINT_URL': os.environ.get('S3_ENDPOINT_URL'),
+        'SM_EMBEDDINGS_BATCH_WINDOW_MS': os.environ.get('SM_EMBEDDINGS_BATCH_WINDOW_MS'),
+        'SM_EMBEDDINGS_MAX_BATCH_SIZE': os.environ.get('SM_EMBEDDINGS_MAX_BATCH_SIZE'),
+        'SM_CHAT_BATCH_WINDOW_MS': os.environ.get('SM_CHAT_BATCH_WINDOW_MS'),
+        'SM_CHAT_MAX_BATCH_SIZE': os.environ.get('SM_CHAT_MAX_BATCH_SIZE'),
+        'OPENAI_EMBEDDINGS_MAX_INPUTS': os.environ.get('OPENAI_EMBEDDINGS_MAX_INPUTS'),
+        'OPENAI_EMBEDDINGS_MAX_BYTES': os.environ.get('OPENAI_EMBEDDINGS_MAX_BYTES'),
+        'SM_EMBEDDINGS_MAX_INPUTS': os.environ.get('SM_EMBEDDINGS_MAX_INPUTS'),
+        'SM_EMBEDDINGS_MAX_BYTES': os.environ.get('SM_EMBEDDINGS_MAX_BYTES'),
+        'EMBEDDINGS_CHUNK_MAX_CONCURRENCY': os.environ.get('EMBEDDINGS_CHUNK_MAX_CONCURRENCY'),
+        'SM_ENDPOINT_POOLS': os.environ.get('SM_ENDPOINT_POOLS'),
+        'SM_ROUTING_STRATEGY': os.environ.get('SM_ROUTING_STRATEGY'),
+        'SM_ENDPOINT_FAILURE_THRESHOLD': os.environ.get('SM_ENDPOINT_FAILURE_THRESHOLD'),
+        'SM_ENDPOINT_EJECTION_SECONDS': os.environ.get('SM_ENDPOINT_EJECTION_SECONDS'),
+        'SM_HEALTH_CHECK_INTERVAL_SECONDS': os.environ.get('SM_HEALTH_CHECK_INTERVAL_SECONDS'),
+        'SM_HEALTH_CHECK_PING_PAYLOADS': os.environ.get('SM_HEALTH_CHECK_PING_PAYLOADS'),
+        'HEDGING_POLICIES': os.environ.get('HEDGING_POLICIES'),
+        'RESILIENCE_POLICIES': os.environ.get('RESILIENCE_POLICIES'),
+        'RATE_LIMITS': os.environ.get('RATE_LIMITS'),
+        'RATE_LIMIT_MAX_WAIT_MS': os.environ.get('RATE_LIMIT_MAX_WAIT_MS'),
+        'RATE_LIMIT_MAX_QUEUE': os.environ.get('RATE_LIMIT_MAX_QUEUE'),
+        'RATE_LIMIT_MAX_BUCKETS': os.environ.get('RATE_LIMIT_MAX_BUCKETS'),
+        'JOBS_DIR': os.environ.get('JOBS_DIR'),
+        'BATCH_MAX_CONCURRENCY': os.environ.get('BATCH_MAX_CONCURRENCY'),
+        'BATCH_MAX_RETRIES': os.environ.get('BATCH_MAX_RETRIES'),
+        'BATCH_RETRY_DELAY_MS': os.environ.get('BATCH_RETRY_DELAY_MS'),
+        'SEMANTIC_CACHE_EMBEDDINGS_PROVIDER': os.environ.get('SEMANTIC_CACHE_EMBEDDINGS_PROVIDER'),
+        'SEMANTIC_CACHE_EMBEDDINGS_MODEL': os.environ.get('SEMANTIC_CACHE_EMBEDDINGS_MODEL'),
+        'SEMANTIC_CACHE_THRESHOLD': os.environ.get('SEMANTIC_CACHE_THRESHOLD'),
+        'SEMANTIC_CACHE_MAX_ENTRIES': os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES'),
+        'SINGLE_FLIGHT_DISABLED_ENDPOINTS': os.environ.get('SINGLE_FLIGHT_DISABLED_ENDPOINTS'),
+        'SM_ASYNC_INFERENCE_MODELS': os.environ.get('SM_ASYNC_INFERENCE_MODELS'),
+        'SM_ASYNC_INFERENCE_POLL_INTERVAL_MS': os.environ.get('SM_ASYNC_INFERENCE_POLL_INTERVAL_MS'),
+        'SM_ASYNC_INFERENCE_TIMEOUT_SECONDS': os.environ.get('SM_ASYNC_INFERENCE_TIMEOUT_SECONDS'),
+        'IMAGE_JOB_MAX_CONCURRENCY': os.environ.get('IMAGE_JOB_MAX_CONCURRENCY'),
+        'IMAGE_JOB_WEBHOOK_HOSTS': os.environ.get('IMAGE_JOB_WEBHOOK_HOSTS'),
+        'IMAGE_JOB_WEBHOOK_RETRIES': os.environ.get('IMAGE_JOB_WEBHOOK_RETRIES'),
+        'COMPRESSION_ENCODINGS': os.environ.get('COMPRESSION_ENCODINGS'),
+        'COMPRESSION_MIN_SIZE': os.environ.get('COMPRESSION_MIN_SIZE'),
+        'COMPRESSION_GZIP_LEVEL': os.environ.get('COMPRESSION_GZIP_LEVEL'),
+        'COMPRESSION_ZSTD_LEVEL': os.environ.get('COMPRESSION_ZSTD_LEVEL'),
+        'COMPRESSION_EXECUTOR_MIN_SIZE': os.environ.get('COMPRESSION_EXECUTOR_MIN_SIZE'),
+        'AUDIT_LOG_DIR': os.environ.get('AUDIT_LOG_DIR'),
+        'AUDIT_LOG_SAMPLE_RATE': os.environ.get('AUDIT_LOG_SAMPLE_RATE'),
+        'AUDIT_LOG_PAYLOADS': os.environ.get('AUDIT_LOG_PAYLOADS'),
+        'AUDIT_LOG_MAX_PAYLOAD_BYTES': os.environ.get('AUDIT_LOG_MAX_PAYLOAD_BYTES'),
+        'AUDIT_LOG_FORMAT': os.environ.get('AUDIT_LOG_FORMAT'),
+        'AUDIT_LOG_MAX_QUEUE': os.environ.get('AUDIT_LOG_MAX_QUEUE'),
+        'AUDIT_LOG_BATCH_SIZE': os.environ.get('AUDIT_LOG_BATCH_SIZE'),
+        'AUDIT_LOG_FLUSH_INTERVAL_MS': os.environ.get('AUDIT_LOG_FLUSH_INTERVAL_MS'),
+        'AUDIT_LOG_MAX_FILE_MB': os.environ.get('AUDIT_LOG_MAX_FILE_MB'),
+        'METRICS_MODELS': os.environ.get('METRICS_MODELS'),
+        'METRICS_MAX_MODELS': os.environ.get('METRICS_MAX_MODELS'),
+        'CACHE_BACKEND': os.environ.get('CACHE_BACKEND'),
+        'CACHE_MAX_ENTRIES': os.environ.get('CACHE_MAX_ENTRIES'),
+        'CACHE_MAX_SIZE_IN_MB': os.environ.get('CACHE_MAX_SIZE_IN_MB'),
+        'CACHE_TTL_IN_SECONDS': os.environ.get('CACHE_TTL_IN_SECONDS'),
+        'CACHE_DISK_PATH': os.environ.get('CACHE_DISK_PATH'),
+        'CACHE_DISABLED_ENDPOINTS': os.environ.get('CACHE_DISABLED_ENDPOINTS'),
+        'EMBEDDING_CACHE_MAX_SIZE_IN_MB': os.environ.get('EMBEDDING_CACHE_MAX_SIZE_IN_MB'),
+        'EMBEDDING_CACHE_DISK_PATH': os.environ.get('EMBEDDING_CACHE_DISK_PATH'),
     }
     PORT = 8080
     client = docker.from_env()
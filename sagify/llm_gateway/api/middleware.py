@@ -0,0 +1,288 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import time
+import uuid
+
+from sagify.llm_gateway.core.audit import audit_log, audit_record
+from sagify.llm_gateway.core.metrics import (
+    COMPRESSED_RESPONSE_BYTES,
+    REQUEST_LATENCY,
+    REQUESTS_IN_FLIGHT,
+    model_labels,
+    request_labels
+)
+from sagify.llm_gateway.core.rate_limit import api_key
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that records the latency of every request, labeled by route, provider and model,
+    and the number of requests in flight
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        labels = {"provider": "", "model": ""}
+        token = request_labels.set(labels)
+        started_at = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            request_labels.reset(token)
+            # The router stores the matched route in the scope, its path template keeps the label
+            # cardinality bounded, as do the model labels
+            route = scope.get("route")
+            REQUEST_LATENCY.observe(
+                time.perf_counter() - started_at,
+                route.path if route is not None else "unmatched",
+                labels["provider"],
+                model_labels.label(labels["model"])
+            )
+
+
+class ApiKeyMiddleware:
+    """
+    ASGI middleware that makes the API key of every request, from its `Authorization: Bearer` or
+    `X-API-Key` header, available to the rate limits
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        key = None
+        for _name, _value in scope["headers"]:
+            if _name == b"authorization" and _value[:7].lower() == b"bearer ":
+                key = _value[7:].decode("latin-1").strip()
+            elif _name == b"x-api-key" and key is None:
+                key = _value.decode("latin-1").strip()
+
+        token = api_key.set(key)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            api_key.reset(token)
+
+
+class AuditLogMiddleware:
+    """
+    ASGI middleware that puts a record of every sampled request, with its latency, status, provider,
+    model, token usage and optionally its payloads, in the audit log. It must run inside the metrics and
+    API key middlewares, which fill in the provider, model and API key.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not audit_log.sampled():
+            await self.app(scope, receive, send)
+            return
+
+        record = {
+            "timestamp": time.time(),
+            "request_id": uuid.uuid4().hex,
+            "method": scope["method"],
+            "path": scope["path"],
+            "status_code": None,
+            "prompt_tokens": None,
+            "completion_tokens": None,
+        }
+        request_body, response_body = bytearray(), bytearray()
+
+        async def _receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                _append(request_body, message.get("body", b""), audit_log.max_payload_bytes)
+            return message
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                record["status_code"] = message["status"]
+            elif message["type"] == "http.response.body" and audit_log.log_payloads:
+                _append(response_body, message.get("body", b""), audit_log.max_payload_bytes)
+            await send(message)
+
+        token = audit_record.set(record)
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, _receive if audit_log.log_payloads else receive, _send)
+        finally:
+            audit_record.reset(token)
+            record["latency_seconds"] = time.perf_counter() - started_at
+            # Errors that escaped the app get a 500 response from the server
+            record["status_code"] = record["status_code"] or 500
+            labels = request_labels.get() or {}
+            record["provider"] = labels.get("provider") or None
+            record["model"] = labels.get("model") or None
+            key = api_key.get()
+            record["api_key_hash"] = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16] if key else None
+            if audit_log.log_payloads:
+                record["request_body"] = _payload(request_body)
+                record["response_body"] = _payload(response_body)
+            audit_log.log(record)
+
+
+def _append(buffer, body, max_bytes):
+    buffer.extend(body[:max(0, max_bytes - len(buffer))])
+
+
+def _payload(buffer):
+    """
+    :return: [Optional[Union[dict, list, str]]], body parsed as JSON, or as text if it isn't JSON or was truncated
+    """
+    if not buffer:
+        return None
+    try:
+        return json.loads(buffer)
+    except ValueError:
+        return buffer.decode("utf-8", errors="replace")
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware that compresses the responses with the encoding negotiated from the
+    `Accept-Encoding` header of the request. Streamed responses, e.g. server-sent events, and
+    responses smaller than the minimum size are sent as they are.
+    """
+    def __init__(
+            self,
+            app,
+            encodings=("zstd", "gzip"),
+            minimum_size=1024,
+            gzip_level=6,
+            zstd_level=3,
+            executor_minimum_size=256 * 1024
+    ):
+        """
+        :param app: ASGI app
+        :param encodings: [Iterable[str]], encodings to offer, in order of preference. zstd is only
+        offered if zstandard is installed.
+        :param minimum_size: [int], size of the responses below which they aren't compressed
+        :param gzip_level: [int], compression level of gzip, from 1 to 9
+        :param zstd_level: [int], compression level of zstd, from 1 to 22
+        :param executor_minimum_size: [int], size of the responses above which they are compressed
+        off the event loop
+        """
+        self.app = app
+        self.encodings = [_encoding for _encoding in encodings if _encoding != "zstd" or zstandard is not None]
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+        self.executor_minimum_size = executor_minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = ",".join(
+            _value.decode("latin-1") for _name, _value in scope["headers"] if _name == b"accept-encoding"
+        )
+        encoding = negotiate_encoding(accept_encoding, self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def _send(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                headers = {_name.lower(): _value for _name, _value in message.get("headers", [])}
+                passthrough = (
+                    b"content-encoding" in headers or headers.get(b"content-type", b"").startswith(b"text/event-stream")
+                )
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            if passthrough or message.get("more_body", False) or len(body) < self.minimum_size:
+                # Streamed responses are relayed chunk by chunk, without waiting for the whole body
+                if start_message is not None:
+                    await send(_with_vary(start_message))
+                    start_message = None
+                passthrough = True
+                await send(message)
+                return
+
+            compressed = await self._compress(encoding, body)
+            COMPRESSED_RESPONSE_BYTES.inc(encoding, "uncompressed", amount=len(body))
+            COMPRESSED_RESPONSE_BYTES.inc(encoding, "compressed", amount=len(compressed))
+            headers = [
+                (_name, _value) for _name, _value in start_message.get("headers", [])
+                if _name.lower() != b"content-length"
+            ]
+            headers += [(b"content-encoding", encoding.encode("latin-1")), (b"content-length", str(len(compressed)).encode("latin-1"))]
+            await send(_with_vary(dict(start_message, headers=headers)))
+            start_message = None
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, _send)
+
+    async def _compress(self, encoding, body):
+        if len(body) < self.executor_minimum_size:
+            return self._compress_body(encoding, body)
+        # zlib and zstd release the GIL, so large bodies are compressed in parallel with the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, self._compress_body, encoding, body)
+
+    def _compress_body(self, encoding, body):
+        if encoding == "zstd":
+            return zstandard.ZstdCompressor(level=self.zstd_level).compress(body)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+
+def negotiate_encoding(accept_encoding, encodings):
+    """
+    :param accept_encoding: [str], value of the Accept-Encoding header, e.g. "gzip;q=0.8, zstd"
+    :param encodings: [List[str]], encodings the server offers, in order of preference
+
+    :return: [Optional[str]], encoding with the highest quality for the client, the server preference
+    breaking ties, or None if the client accepts none of them
+    """
+    qualities = {}
+    for _part in accept_encoding.split(","):
+        name, _, params = _part.partition(";")
+        quality = 1.0
+        for _param in params.split(";"):
+            key, _, value = _param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip():
+            qualities[name.strip().lower()] = quality
+
+    candidates = [
+        (qualities.get(_encoding, qualities.get("*", 0.0)), -_index, _encoding)
+        for _index, _encoding in enumerate(encodings)
+    ]
+    candidates = [_candidate for _candidate in candidates if _candidate[0] > 0]
+    return max(candidates)[2] if candidates else None
+
+
+def _with_vary(start_message):
+    headers = list(start_message.get("headers", []))
+    headers.append((b"vary", b"Accept-Encoding"))
+    return dict(start_message, headers=headers)
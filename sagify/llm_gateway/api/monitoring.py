@@ -0,0 +1,27 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from sagify.llm_gateway.core.metrics import metrics
+from sagify.llm_gateway.core.resilience import resilience
+from sagify.llm_gateway.providers.registry import registry
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", tags=["monitoring"], response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/health", tags=["monitoring"])
+async def get_health():
+    # The gateway itself is up if it answers, unhealthy upstreams and open circuit breakers only degrade it
+    upstreams = registry.health()
+    breakers = resilience.health()
+    healthy = breakers["healthy"] and all(_upstream["healthy"] for _upstream in upstreams.values())
+    return {
+        "status": "ok" if healthy else "degraded",
+        "upstreams": upstreams,
+        "resilience": breakers["providers"],
+    }
@@ -0,0 +1,54 @@
+import os
+
+from fastapi import APIRouter, Request
+from fastapi.responses import FileResponse
+
+from sagify.llm_gateway.api.v1.exceptions import NotFoundError
+from sagify.llm_gateway.core.jobs import job_store
+from sagify.llm_gateway.schemas.batches import ResponseBatchDTO
+from sagify.llm_gateway.services.batches import batch_processor
+
+
+router = APIRouter()
+
+
+@router.post("", tags=["batches"], response_model=ResponseBatchDTO, status_code=202)
+async def create(request: Request, native: bool = False):
+    job = await batch_processor.submit(await request.body(), native=native)
+
+    return _to_response(job)
+
+
+@router.get("/{batch_id}", tags=["batches"], response_model=ResponseBatchDTO)
+async def retrieve(batch_id: str):
+    job = job_store.get(batch_id)
+    if job is None or job.kind != "batch":
+        raise NotFoundError(f"Batch {batch_id} not found")
+
+    job = await batch_processor.refresh(job)
+
+    return _to_response(job)
+
+
+@router.get("/{batch_id}/output", tags=["batches"])
+async def output(batch_id: str):
+    job = job_store.get(batch_id)
+    path = job_store.path(batch_id, ".jsonl") if job is not None else None
+    if job is None or job.kind != "batch" or not os.path.exists(path):
+        raise NotFoundError(f"Output of batch {batch_id} not found")
+
+    return FileResponse(path, media_type="application/jsonl")
+
+
+def _to_response(job):
+    return ResponseBatchDTO(
+        id=job.id,
+        object="batch",
+        status=job.status,
+        created_at=job.created_at,
+        completed_at=job.completed_at,
+        request_counts={"total": job.total, "completed": job.completed, "failed": job.failed},
+        output_url=f"/v1/batches/{job.id}/output",
+        provider_batch_id=job.metadata.get("provider_batch_id"),
+        error=job.error
+    )
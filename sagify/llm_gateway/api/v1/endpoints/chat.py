@@ -1,4 +1,8 @@
+import json
+
 from fastapi import APIRouter
+from fastapi.exceptions import HTTPException
+from fastapi.responses import StreamingResponse
 
 from sagify.llm_gateway.schemas.chat import CreateCompletionDTO, RoleItem, MessageItem, ResponseCompletionDTO
 from sagify.llm_gateway.services import chat
@@ -21,9 +25,32 @@ async def create(request: CreateCompletionDTO):
         temperature=request.temperature,
         max_tokens=request.max_tokens,
         top_p=request.top_p,
-        seed=request.seed
+        seed=request.seed,
+        stream=request.stream
     )
 
+    if parsed_message.stream:
+        chunks = chat.completions_stream(parsed_message)
+        # Wait for the first chunk before sending the headers, so that upstream errors
+        # are still returned as regular error responses
+        try:
+            first_chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            first_chunk = None
+
+        return StreamingResponse(_server_sent_events(first_chunk, chunks), media_type="text/event-stream")
+
     response = await chat.completions(parsed_message)
 
     return response
+
+
+async def _server_sent_events(first_chunk, chunks):
+    if first_chunk is not None:
+        yield "data: {}\n\n".format(first_chunk.json())
+        try:
+            async for chunk in chunks:
+                yield "data: {}\n\n".format(chunk.json())
+        except HTTPException as e:
+            yield "data: {}\n\n".format(json.dumps({"error": e.detail}))
+    yield "data: [DONE]\n\n"
@@ -1,4 +1,6 @@
 from fastapi import APIRouter
+from fastapi.responses import Response
+import orjson
 
 from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO, ResponseEmbeddingDTO
 from sagify.llm_gateway.services import embeddings
@@ -12,9 +14,29 @@ async def create(request: CreateEmbeddingDTO):
     parsed_message = CreateEmbeddingDTO(
         provider=request.provider,
         model=request.model,
-        input=request.input
+        input=request.input,
+        encoding_format=request.encoding_format,
+        dimensions=request.dimensions
     )
 
     response = await embeddings.embeddings(parsed_message)
 
-    return response
+    # The response is serialized as it is, validating and encoding every float of the embeddings
+    # through the response model would cost more than the upstream call for large batches
+    return Response(content=_response_json(response), media_type="application/json")
+
+
+def _response_json(response: ResponseEmbeddingDTO):
+    return orjson.dumps({
+        "data": [
+            {
+                "object": _item.object,
+                "embedding": _item.embedding,
+                "index": _item.index
+            } for _item in response.data
+        ],
+        "provider": response.provider,
+        "model": response.model,
+        "object": response.object,
+        "usage": response.usage.dict() if response.usage is not None else None
+    })
@@ -1,14 +1,29 @@
-from fastapi import APIRouter
+from typing import Optional
 
+from fastapi import APIRouter, Query
+from fastapi.responses import JSONResponse
+
+from sagify.llm_gateway.api.v1.exceptions import NotFoundError
+from sagify.llm_gateway.core.jobs import job_store
 from sagify.llm_gateway.services import images
-from sagify.llm_gateway.schemas.images import CreateImageDTO, ResponseImageDTO
+from sagify.llm_gateway.services.image_jobs import image_job_runner
+from sagify.llm_gateway.schemas.images import CreateImageDTO, ResponseImageDTO, ResponseImageJobDTO
 
 
 router = APIRouter()
 
 
-@router.post("/generations", tags=["generations"], response_model=ResponseImageDTO)
-async def create(request: CreateImageDTO):
+@router.post(
+    "/generations",
+    tags=["generations"],
+    response_model=ResponseImageDTO,
+    responses={202: {"model": ResponseImageJobDTO}}
+)
+async def create(
+        request: CreateImageDTO,
+        run_async: bool = Query(False, alias="async"),
+        webhook_url: Optional[str] = None
+):
     parsed_message = CreateImageDTO(
         provider=request.provider,
         model=request.model,
@@ -20,6 +35,19 @@ async def create(request: CreateImageDTO):
         response_format=request.response_format
     )
 
+    if run_async:
+        job = await image_job_runner.submit(parsed_message, webhook_url=webhook_url)
+        return JSONResponse(image_job_runner.to_response(job).dict(), status_code=202)
+
     response = await images.generations(parsed_message)
 
     return response
+
+
+@router.get("/generations/{job_id}", tags=["generations"], response_model=ResponseImageJobDTO)
+async def retrieve(job_id: str):
+    job = job_store.get(job_id)
+    if job is None or job.kind != "image":
+        raise NotFoundError(f"Image generation job {job_id} not found")
+
+    return image_job_runner.to_response(job)
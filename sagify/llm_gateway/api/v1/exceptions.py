@@ -3,6 +3,11 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import HTTPException
 
 
+class BadRequestError(HTTPException):
+    def __init__(self, detail="Bad Request"):
+        super().__init__(status_code=400, detail=detail)
+
+
 class NotFoundError(HTTPException):
     def __init__(self, detail="Not Found"):
         super().__init__(status_code=404, detail=detail)
@@ -13,6 +18,28 @@ class InternalServerError(HTTPException):
         super().__init__(status_code=500, detail=detail)
 
 
+class TooManyRequestsError(HTTPException):
+    def __init__(self, detail="Too Many Requests", retry_after=1):
+        super().__init__(status_code=429, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+class ServiceUnavailableError(HTTPException):
+    def __init__(self, detail="Service Unavailable", retry_after=1):
+        super().__init__(status_code=503, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+class GatewayTimeoutError(HTTPException):
+    def __init__(self, detail="Gateway Timeout"):
+        super().__init__(status_code=504, detail=detail)
+
+
+async def bad_request_handler(request: Request, exc: BadRequestError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": exc.detail},
+    )
+
+
 async def not_found_handler(request: Request, exc: NotFoundError):
     return JSONResponse(
         status_code=exc.status_code,
@@ -25,3 +52,26 @@ async def internal_server_error_handler(request: Request, exc: InternalServerErr
         status_code=exc.status_code,
         content={"error": exc.detail},
     )
+
+
+async def gateway_timeout_handler(request: Request, exc: GatewayTimeoutError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": exc.detail},
+    )
+
+
+async def too_many_requests_handler(request: Request, exc: TooManyRequestsError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": exc.detail},
+        headers=exc.headers,
+    )
+
+
+async def service_unavailable_handler(request: Request, exc: ServiceUnavailableError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": exc.detail},
+        headers=exc.headers,
+    )
@@ -0,0 +1,253 @@
+import asyncio
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+
+import structlog
+
+from sagify.llm_gateway.core.metrics import AUDIT_LOG_RECORDS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = structlog.get_logger()
+
+# Audit record of the request being served, if it's sampled, filled in by the services with the token usage
+audit_record = contextvars.ContextVar("audit_record", default=None)
+
+# Columns of the Parquet files, the payloads are kept as JSON text
+_PARQUET_COLUMNS = [
+    ("timestamp", "float64"),
+    ("request_id", "string"),
+    ("method", "string"),
+    ("path", "string"),
+    ("status_code", "int32"),
+    ("latency_seconds", "float64"),
+    ("provider", "string"),
+    ("model", "string"),
+    ("api_key_hash", "string"),
+    ("prompt_tokens", "int64"),
+    ("completion_tokens", "int64"),
+    ("request_body", "string"),
+    ("response_body", "string"),
+]
+
+
+def record_usage(prompt_tokens, completion_tokens):
+    """
+    Add the token usage of a provider call to the audit record of the request, if it's sampled
+    """
+    record = audit_record.get()
+    if record is not None:
+        record["prompt_tokens"] = (record.get("prompt_tokens") or 0) + prompt_tokens
+        record["completion_tokens"] = (record.get("completion_tokens") or 0) + completion_tokens
+
+
+class _JsonLinesWriter:
+    extension = ".jsonl"
+
+    def __init__(self, path):
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, records):
+        self._file.write("".join(json.dumps(_record, separators=(",", ":")) + "\n" for _record in records))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    extension = ".parquet"
+
+    def __init__(self, path):
+        self._schema = pyarrow.schema([(_name, getattr(pyarrow, _type)()) for _name, _type in _PARQUET_COLUMNS])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write(self, records):
+        rows = [
+            dict(_record, **{
+                _field: json.dumps(_record[_field]) if _record.get(_field) is not None else None
+                for _field in ("request_body", "response_body")
+            }) for _record in records
+        ]
+        self._writer.write_table(pyarrow.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+class AuditLog:
+    """
+    Audit trail of the requests, with their metadata, latency, token usage and optionally their payloads.
+    Records are put on a bounded in-memory queue and written in batches to rotating files by a background
+    task, so logging never delays a response. Records that don't fit in the queue are dropped.
+    """
+    def __init__(
+            self,
+            directory=None,
+            sample_rate=1.0,
+            log_payloads=False,
+            max_payload_bytes=65536,
+            file_format="jsonl",
+            max_queue=10000,
+            batch_size=500,
+            flush_interval=1.0,
+            max_file_bytes=100 * 1024 * 1024
+    ):
+        """
+        :param directory: [Optional[str]], folder of the audit log files, the audit log is disabled if None
+        :param sample_rate: [float], fraction of the requests that are logged
+        :param log_payloads: [bool], whether the request and response bodies are logged
+        :param max_payload_bytes: [int], size beyond which the logged bodies are truncated
+        :param file_format: [str], jsonl, or parquet if pyarrow is installed
+        :param max_queue: [int], number of records waiting to be written, beyond which records are dropped
+        :param batch_size: [int], maximum number of records written at once
+        :param flush_interval: [float], seconds between two writes when there are fewer records than a batch
+        :param max_file_bytes: [int], size of a file beyond which the next records go to a new file
+        """
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.log_payloads = log_payloads
+        self.max_payload_bytes = max_payload_bytes
+        self._writer_class = _ParquetWriter if file_format == "parquet" else _JsonLinesWriter
+        if file_format == "parquet" and pyarrow is None:
+            logger.warning("pyarrow is not installed, the audit log is written as JSON lines")
+            self._writer_class = _JsonLinesWriter
+        self._max_queue = max_queue
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_file_bytes = max_file_bytes
+        self._queue = None
+        self._task = None
+        # Records taken off the queue that aren't being written yet
+        self._pending = []
+        self._writer = None
+        self._path = None
+        self._file_count = 0
+        # A write cancelled by stop() goes on in its thread, the next writes wait for it
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.directory is not None and self.sample_rate > 0
+
+    def sampled(self):
+        """
+        :return: [bool], whether a new request should be logged
+        """
+        return self.enabled and random.random() < self.sample_rate
+
+    def log(self, record):
+        """
+        Queue a record to be written, or drop it if the queue is full. It never blocks.
+
+        :param record: [dict], audit record
+        """
+        if self._queue is None:
+            AUDIT_LOG_RECORDS.inc("dropped")
+            return
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            AUDIT_LOG_RECORDS.inc("dropped")
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._queue = asyncio.Queue(self._max_queue)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """
+        Write the records left in the queue and close the current file
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        self._drain(len(self._pending) + self._queue.qsize())
+        if self._pending:
+            await self._write(self._pending)
+        self._pending = []
+        self._queue = None
+        await asyncio.get_running_loop().run_in_executor(None, self._close)
+
+    def _drain(self, size):
+        while len(self._pending) < size and not self._queue.empty():
+            self._pending.append(self._queue.get_nowait())
+
+    async def _run(self):
+        while True:
+            self._pending.append(await self._queue.get())
+            self._drain(self._batch_size)
+            if len(self._pending) < self._batch_size:
+                # Gives the records of the next requests a chance to be written in the same batch
+                await asyncio.sleep(self._flush_interval)
+                self._drain(self._batch_size)
+            records, self._pending = self._pending, []
+            await self._write(records)
+
+    async def _write(self, records):
+        # Files are written off the event loop
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self._write_batch, records)
+            AUDIT_LOG_RECORDS.inc("written", amount=len(records))
+        except Exception as e:
+            logger.error("Audit log write failed", error=str(e))
+            AUDIT_LOG_RECORDS.inc("failed", amount=len(records))
+
+    def _close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+    def _write_batch(self, records):
+        with self._lock:
+            self._rotate()
+            self._writer.write(records)
+
+    def _rotate(self):
+        if self._writer is not None and os.path.getsize(self._path) >= self._max_file_bytes:
+            self._writer.close()
+            self._writer = None
+        if self._writer is None:
+            # Every worker process writes its own files
+            self._file_count += 1
+            self._path = os.path.join(self.directory, "audit-{}-{}-{}{}".format(
+                time.strftime("%Y%m%d-%H%M%S", time.gmtime()), os.getpid(), self._file_count, self._writer_class.extension
+            ))
+            self._writer = self._writer_class(self._path)
+
+
+def create_audit_log():
+    """
+    Create the audit log from the AUDIT_LOG_* env variables
+    """
+    return AuditLog(
+        directory=os.environ.get("AUDIT_LOG_DIR"),
+        sample_rate=float(os.environ.get("AUDIT_LOG_SAMPLE_RATE", 1.0)),
+        log_payloads=os.environ.get("AUDIT_LOG_PAYLOADS", "false").lower() == "true",
+        max_payload_bytes=int(os.environ.get("AUDIT_LOG_MAX_PAYLOAD_BYTES", 65536)),
+        file_format=os.environ.get("AUDIT_LOG_FORMAT", "jsonl"),
+        max_queue=int(os.environ.get("AUDIT_LOG_MAX_QUEUE", 10000)),
+        batch_size=int(os.environ.get("AUDIT_LOG_BATCH_SIZE", 500)),
+        flush_interval=float(os.environ.get("AUDIT_LOG_FLUSH_INTERVAL_MS", 1000)) / 1000,
+        max_file_bytes=int(float(os.environ.get("AUDIT_LOG_MAX_FILE_MB", 100)) * 1024 * 1024)
+    )
+
+
+audit_log = create_audit_log()
@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+from sagify.llm_gateway.core.metrics import BATCH_QUEUE_WAIT, BATCH_SIZE
+
+
+class _PendingBatch:
+    def __init__(self):
+        self.submissions = []
+        self.size = 0
+        self.bytes = 0
+        self.timer = None
+
+
+class MicroBatcher:
+    """
+    Gathers the items that are submitted concurrently under the same key within a time window, up to
+    a maximum batch size, and processes them with a single call. Every caller gets back the results
+    of its own items, or the error of the call.
+
+    The items of a caller are never split across batches, so a caller that submits more items than
+    the maximum batch size, or bytes, gets a batch of its own.
+    """
+    def __init__(self, process_batch, window=0.005, max_batch_size=32, name="batcher", max_batch_bytes=None, item_size=None):
+        """
+        :param process_batch: [Callable[[Hashable, list], Awaitable[list]]], processes the items of a
+        batch and returns one result per item, in the same order
+        :param window: [float], seconds to wait for more items after the first item of a batch
+        :param max_batch_size: [int], number of items that triggers processing without waiting
+        :param name: [str], name of the batcher in the batch size and queue wait metrics
+        :param max_batch_bytes: [Optional[int]], maximum size of the items of a batch, unlimited if None
+        :param item_size: [Optional[Callable[[Any], int]]], size of an item, required with max_batch_bytes
+        """
+        self.name = name
+        self._process_batch = process_batch
+        self._window = window
+        self._max_batch_size = max_batch_size
+        self._max_batch_bytes = max_batch_bytes
+        self._item_size = item_size
+        self._pending = {}
+        self._tasks = set()
+        self._stats = {"batches": 0, "items": 0, "submissions": 0, "queue_wait_seconds": 0.0}
+
+    async def submit(self, key, items):
+        """
+        Submit items to be processed in a batch with the items of other callers under the same key
+
+        :param key: [Hashable], items are only batched with items of the same key
+        :param items: [list], items to process
+
+        :return: [list], results of the items, in the same order
+        """
+        loop = asyncio.get_running_loop()
+        items_bytes = sum(self._item_size(_item) for _item in items) if self._max_batch_bytes is not None else 0
+        pending = self._pending.get(key)
+        if pending is not None and (
+                pending.size + len(items) > self._max_batch_size or
+                (self._max_batch_bytes is not None and pending.bytes + items_bytes > self._max_batch_bytes)
+        ):
+            self._flush(key)
+            pending = None
+
+        if pending is None:
+            pending = self._pending[key] = _PendingBatch()
+            pending.timer = loop.call_later(self._window, self._flush, key)
+
+        future = loop.create_future()
+        pending.submissions.append((items, future, time.monotonic()))
+        pending.size += len(items)
+        pending.bytes += items_bytes
+
+        if pending.size >= self._max_batch_size:
+            self._flush(key)
+
+        return await future
+
+    def _flush(self, key):
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        pending.timer.cancel()
+        task = asyncio.ensure_future(self._run(key, pending))
+        # Tasks are referenced until they finish, so that they aren't garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, pending):
+        started_at = time.monotonic()
+        self._stats["batches"] += 1
+        self._stats["items"] += pending.size
+        self._stats["submissions"] += len(pending.submissions)
+        BATCH_SIZE.observe(pending.size, self.name)
+        for _, _, _enqueued_at in pending.submissions:
+            self._stats["queue_wait_seconds"] += started_at - _enqueued_at
+            BATCH_QUEUE_WAIT.observe(started_at - _enqueued_at, self.name)
+
+        batch = [_item for _items, _, _ in pending.submissions for _item in _items]
+        try:
+            results = await self._process_batch(key, batch)
+            # Results can't be matched to the items of their callers unless there is one per item
+            if len(results) != len(batch):
+                raise ValueError('Expected {} results from {}, got {}'.format(len(batch), self.name, len(results)))
+        except Exception as e:
+            for _, _future, _ in pending.submissions:
+                if not _future.done():
+                    _future.set_exception(e)
+            return
+
+        offset = 0
+        for _items, _future, _ in pending.submissions:
+            if not _future.done():
+                _future.set_result(results[offset:offset + len(_items)])
+            offset += len(_items)
+
+    def stats(self):
+        """
+        :return: [dict], number of batches, items and submissions processed so far and the total time
+        the submissions waited in the queue
+        """
+        return dict(self._stats)
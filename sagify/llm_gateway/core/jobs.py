@@ -0,0 +1,156 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+
+
+_JOB_ID_PATTERN = re.compile(r"^[a-z]+_[0-9a-f]{32}$")
+
+
+class Job:
+    """
+    State and progress of a background job
+    """
+    def __init__(
+            self,
+            id,
+            kind,
+            status="in_progress",
+            created_at=None,
+            completed_at=None,
+            total=0,
+            completed=0,
+            failed=0,
+            error=None,
+            metadata=None
+    ):
+        self.id = id
+        self.kind = kind
+        self.status = status
+        self.created_at = created_at if created_at is not None else int(time.time())
+        self.completed_at = completed_at
+        self.total = total
+        self.completed = completed
+        self.failed = failed
+        self.error = error
+        self.metadata = metadata or {}
+
+    @property
+    def done(self):
+        return self.status in ("completed", "failed")
+
+    def finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.completed_at = int(time.time())
+
+    def to_dict(self):
+        return dict(vars(self))
+
+    @classmethod
+    def from_dict(cls, job_dict):
+        return cls(**job_dict)
+
+
+class JobStore:
+    """
+    Keeps the state of background jobs in memory and in a directory, along with their output files,
+    so that every worker process of the server on the same host can report on them. Files are written
+    off the event loop by a single thread, in the order they are saved.
+    """
+    def __init__(self, directory, save_interval=1.0):
+        """
+        :param directory: [str], directory of the job states and output files
+        :param save_interval: [float], minimum seconds between two saves of the progress of a job
+        """
+        self._directory = directory
+        self._save_interval = save_interval
+        self._jobs = {}
+        self._saved_at = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs")
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, job_id, suffix):
+        """
+        :return: [str], path of a file of the job, e.g. its output with the .jsonl suffix
+        """
+        return os.path.join(self._directory, job_id + suffix)
+
+    async def create(self, kind, **kwargs):
+        """
+        :param kind: [str], kind of the job, which prefixes its ID
+
+        :return: [Job], new job
+        """
+        job = Job(id="{}_{}".format(kind, uuid.uuid4().hex), kind=kind, **kwargs)
+        self._jobs[job.id] = job
+        await self.save(job, force=True)
+        return job
+
+    async def save(self, job, force=False):
+        """
+        Save the state of a job, at most once per save interval unless forced
+
+        :param job: [Job], job
+        :param force: [bool], save even if the job was saved recently
+        """
+        now = time.monotonic()
+        if not force and now - self._saved_at.get(job.id, 0.0) < self._save_interval:
+            return
+        self._saved_at[job.id] = now
+        await self._run(self._write_state, job.id, job.to_dict())
+        # Done jobs are read from their file once it's written
+        if job.done:
+            self._jobs.pop(job.id, None)
+            self._saved_at.pop(job.id, None)
+
+    async def write(self, job_id, suffix, content, append=False):
+        """
+        Write a file of a job, after the files and states saved before it
+
+        :param job_id: [str], job ID
+        :param suffix: [str], suffix of the file, see path
+        :param content: [Union[str, bytes]], content of the file
+        :param append: [bool], append the content to the file instead of replacing it
+        """
+        await self._run(self._write_file, self.path(job_id, suffix), content, append)
+
+    async def _run(self, write, *args):
+        await asyncio.get_running_loop().run_in_executor(self._executor, write, *args)
+
+    def _write_state(self, job_id, state):
+        # Written to a temporary file first, so that readers never see a partially written state
+        path = self.path(job_id, ".json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def _write_file(path, content, append):
+        mode = ("a" if append else "w") + ("b" if isinstance(content, bytes) else "")
+        with open(path, mode) as f:
+            f.write(content)
+
+    def get(self, job_id):
+        """
+        :param job_id: [str], job ID
+
+        :return: [Optional[Job]], job, or None if there's no such job
+        """
+        if not _JOB_ID_PATTERN.match(job_id):
+            return None
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        try:
+            with open(self.path(job_id, ".json")) as f:
+                return Job.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+
+
+job_store = JobStore(os.environ.get("JOBS_DIR", os.path.join(tempfile.gettempdir(), "sagify-llm-gateway-jobs")))
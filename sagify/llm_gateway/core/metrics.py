@@ -0,0 +1,326 @@
+from bisect import bisect_left
+import contextvars
+import os
+
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(_name, _escape(_value)) for _name, _value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.type),
+        ]
+        for _labels, _value in list(self._values.items()):
+            lines.append("{}{} {}".format(self.name, _format_labels(self.labelnames, _labels), _format_value(_value)))
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value per label set. Label values are passed positionally, in the
+    order of the label names, to keep recording cheap.
+    """
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value per label set that can go up and down
+    """
+    type = "gauge"
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values per label set over fixed buckets
+    """
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        values = self._values.get(labels)
+        if values is None:
+            # One counter per bucket plus the +Inf bucket, then the sum of the observed values
+            values = self._values[labels] = [0] * (len(self.buckets) + 2)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.type),
+        ]
+        for _labels, _values in list(self._values.items()):
+            cumulative = 0
+            for _bound, _count in zip(self.buckets + ("+Inf",), _values[:-1]):
+                cumulative += _count
+                lines.append("{}_bucket{} {}".format(
+                    self.name,
+                    _format_labels(self.labelnames, _labels, 'le="{}"'.format(_bound)),
+                    cumulative
+                ))
+            lines.append("{}_sum{} {}".format(
+                self.name, _format_labels(self.labelnames, _labels), _format_value(_values[-1])
+            ))
+            lines.append("{}_count{} {}".format(self.name, _format_labels(self.labelnames, _labels), cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Registry of the gateway metrics, rendered in the Prometheus text exposition format.
+    Metrics are kept per worker process.
+    """
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        return "\n".join(_line for _metric in self._metrics for _line in _metric.render()) + "\n"
+
+
+metrics = MetricsRegistry()
+
+REQUEST_LATENCY = metrics.histogram(
+    "gateway_request_duration_seconds",
+    "Time to serve a request, from receiving it to sending the last byte of the response",
+    ["route", "provider", "model"]
+)
+REQUESTS_IN_FLIGHT = metrics.gauge(
+    "gateway_requests_in_flight",
+    "Number of requests being served"
+)
+UPSTREAM_LATENCY = metrics.histogram(
+    "gateway_upstream_duration_seconds",
+    "Time spent waiting on the provider for a response",
+    ["endpoint", "provider", "model"]
+)
+UPSTREAM_ERRORS = metrics.counter(
+    "gateway_upstream_errors_total",
+    "Number of failed provider calls",
+    ["endpoint", "provider", "model"]
+)
+TIME_TO_FIRST_TOKEN = metrics.histogram(
+    "gateway_time_to_first_token_seconds",
+    "Time from calling the provider to receiving the first chunk of a streamed response",
+    ["provider", "model"]
+)
+TOKENS = metrics.counter(
+    "gateway_tokens_total",
+    "Number of tokens reported by the providers",
+    ["provider", "model", "type"]
+)
+CACHE_REQUESTS = metrics.counter(
+    "gateway_cache_requests_total",
+    "Number of cache lookups",
+    ["cache", "endpoint", "result"]
+)
+BATCH_SIZE = metrics.histogram(
+    "gateway_batch_size",
+    "Number of items sent upstream in a single batched invocation",
+    ["batcher"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+BATCH_QUEUE_WAIT = metrics.histogram(
+    "gateway_batch_queue_wait_seconds",
+    "Time a submission waited for its batch to be sent upstream",
+    ["batcher"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+ROUTING_DECISIONS = metrics.counter(
+    "gateway_sagemaker_routing_decisions_total",
+    "Number of requests routed to every endpoint of a SageMaker endpoint pool",
+    ["alias", "endpoint"]
+)
+ENDPOINT_OUTSTANDING = metrics.gauge(
+    "gateway_sagemaker_endpoint_outstanding_requests",
+    "Number of requests in flight to every endpoint of a SageMaker endpoint pool",
+    ["alias", "endpoint"]
+)
+ENDPOINT_EJECTIONS = metrics.counter(
+    "gateway_sagemaker_endpoint_ejections_total",
+    "Number of times an endpoint was taken out of rotation after consecutive failures",
+    ["alias", "endpoint"]
+)
+ENDPOINT_HEALTHY = metrics.gauge(
+    "gateway_sagemaker_endpoint_healthy",
+    "Whether the last health check of a SageMaker endpoint passed",
+    ["endpoint"]
+)
+HEALTH_PROBE_LATENCY = metrics.histogram(
+    "gateway_sagemaker_health_probe_duration_seconds",
+    "Latency of the pings of the SageMaker endpoint health checks",
+    ["endpoint"]
+)
+HEDGED_REQUESTS = metrics.counter(
+    "gateway_hedged_requests_total",
+    "Number of calls to a secondary target, because the previous target was slow (hedge) or failed (fallback)",
+    ["endpoint", "provider", "model", "reason"]
+)
+HEDGE_WINS = metrics.counter(
+    "gateway_hedge_wins_total",
+    "Number of requests answered by a secondary target",
+    ["endpoint", "provider", "model"]
+)
+RATE_LIMITED_REQUESTS = metrics.counter(
+    "gateway_rate_limited_requests_total",
+    "Number of requests rejected with a 429 response by the rate limits",
+    ["endpoint", "provider"]
+)
+ADMISSION_WAIT = metrics.histogram(
+    "gateway_admission_wait_seconds",
+    "Time admitted requests waited for the rate limits",
+    ["endpoint", "provider"],
+    buckets=(0, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+COALESCED_REQUESTS = metrics.counter(
+    "gateway_coalesced_requests_total",
+    "Number of requests that waited for the response of an identical request in flight",
+    ["endpoint"]
+)
+SEMANTIC_CACHE_SIMILARITY = metrics.histogram(
+    "gateway_semantic_cache_similarity",
+    "Cosine similarity of the prompts with the most similar cached prompt",
+    buckets=(0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95, 0.975, 0.99, 1.0)
+)
+UPSTREAM_RETRIES = metrics.counter(
+    "gateway_upstream_retries_total",
+    "Number of retries of provider calls that were throttled",
+    ["provider", "model"]
+)
+BREAKER_STATE = metrics.gauge(
+    "gateway_circuit_breaker_state",
+    "State of the circuit breaker of every provider and model, 0 if closed, 1 if half open and 2 if open",
+    ["provider", "model"]
+)
+BULKHEAD_REJECTIONS = metrics.counter(
+    "gateway_bulkhead_rejections_total",
+    "Number of provider calls rejected with a 503 response because too many calls were in flight",
+    ["provider"]
+)
+AUDIT_LOG_RECORDS = metrics.counter(
+    "gateway_audit_log_records_total",
+    "Number of audit log records written, dropped because the queue was full, or lost because a write failed",
+    ["result"]
+)
+COMPRESSED_RESPONSE_BYTES = metrics.counter(
+    "gateway_compressed_response_bytes_total",
+    "Size of the compressed responses before and after compression",
+    ["encoding", "type"]
+)
+IMAGE_UPLOAD_LATENCY = metrics.histogram(
+    "gateway_image_upload_duration_seconds",
+    "Time to store a generated image and presign its URL",
+    ["provider"]
+)
+
+
+class ModelLabels:
+    """
+    Models that get a label of their own in the metrics. Model names come from the requests, so only the
+    configured models and, up to a maximum, the models that served a request get their own label. The
+    others share the "other" label, which keeps the number of series bounded.
+    """
+    OTHER = "other"
+
+    def __init__(self, models=(), max_learned=100):
+        """
+        :param models: [Iterable[str]], configured models
+        :param max_learned: [int], number of models that get their own label once they served a request
+        """
+        self._models = set(models)
+        self._max_learned = max_learned
+        self._learned = 0
+
+    def configure(self, *models):
+        """
+        :param models: [str], models of the gateway settings, e.g. of the resilience or hedging policies
+        """
+        self._models.update(_model for _model in models if _model)
+
+    def learn(self, model):
+        """
+        :param model: [str], model that served a request successfully
+        """
+        if model and model not in self._models and self._learned < self._max_learned:
+            self._models.add(model)
+            self._learned += 1
+
+    def label(self, model):
+        """
+        :return: [str], label of a model, "other" if it isn't known
+        """
+        if not model or model in self._models:
+            return model or ""
+        return self.OTHER
+
+
+model_labels = ModelLabels(
+    [_model.strip() for _model in os.environ.get("METRICS_MODELS", "").split(",") if _model.strip()],
+    max_learned=int(os.environ.get("METRICS_MAX_MODELS", 100))
+)
+
+# Provider and model of the request being served, filled in by the services for the request metrics.
+# The model is turned into its label when the request is recorded, once it's known whether it was served.
+request_labels = contextvars.ContextVar("request_labels", default=None)
+
+
+def set_request_labels(provider, model):
+    labels = request_labels.get()
+    if labels is not None:
+        labels["provider"] = provider
+        labels["model"] = model or ""
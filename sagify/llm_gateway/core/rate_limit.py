@@ -0,0 +1,214 @@
+import asyncio
+from collections import OrderedDict
+import contextvars
+import json
+import math
+import os
+import time
+
+from sagify.llm_gateway.api.v1.exceptions import TooManyRequestsError
+from sagify.llm_gateway.core.metrics import ADMISSION_WAIT, RATE_LIMITED_REQUESTS, model_labels
+
+
+# Rough number of characters per token, good enough to estimate the cost of a request before sending it
+CHARS_PER_TOKEN = 4
+
+# API key of the request being served, filled in by the API key middleware
+api_key = contextvars.ContextVar("api_key", default=None)
+
+
+def estimate_tokens(texts, max_tokens=0):
+    """
+    :param texts: [List[str]], texts of the request
+    :param max_tokens: [int], number of tokens the response may have
+
+    :return: [int], estimated number of tokens of a request and its response
+    """
+    return sum(len(_text) for _text in texts) // CHARS_PER_TOKEN + (max_tokens or 0)
+
+
+class TokenBucket:
+    """
+    Bucket that refills at a constant rate up to its capacity. Admitted amounts are taken right away,
+    even if the bucket goes negative, so later callers wait for the earlier ones to be paid off first.
+    """
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.waiters = 0
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def wait_time(self, amount):
+        """
+        :return: [float], seconds until the amount can be taken
+        """
+        self._refill(self._clock())
+        # An amount larger than the capacity would never fit, it only waits for a full bucket
+        return max(0.0, (min(amount, self.capacity) - self._tokens) / self.rate)
+
+    def take(self, amount):
+        self._refill(self._clock())
+        self._tokens -= min(amount, self.capacity)
+
+    def settled(self):
+        """
+        :return: [bool], whether no request waits on the bucket and it isn't in debt, so that it can be
+        dropped and started over without letting requests through earlier than they would have been
+        """
+        self._refill(self._clock())
+        return self.waiters == 0 and self._tokens >= 0
+
+    def give_back(self, amount):
+        """
+        Return an amount taken by a request that was cancelled before it was served
+        """
+        self._refill(self._clock())
+        self._tokens = min(self.capacity, self._tokens + min(amount, self.capacity))
+
+
+class RateLimit:
+    """
+    Limit on the requests and estimated tokens of a provider, endpoint and model, e.g. a Sagemaker
+    endpoint, or of all of them, optionally per API key
+    """
+    def __init__(
+            self,
+            provider=None,
+            endpoint=None,
+            per_api_key=False,
+            requests_per_minute=None,
+            tokens_per_minute=None,
+            burst_seconds=1,
+            model=None
+    ):
+        self.provider = provider
+        self.endpoint = endpoint
+        self.model = model
+        self.per_api_key = per_api_key
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.burst_seconds = burst_seconds
+
+    def matches(self, provider, endpoint, model=None):
+        return self.provider in (None, provider) and self.endpoint in (None, endpoint) and self.model in (None, model)
+
+
+class RateLimiter:
+    """
+    Admits requests when every matching rate limit has room for them. Requests that have to wait
+    longer than the maximum wait, or that find the wait queue of a bucket full, are rejected with
+    a 429 response right away.
+    """
+    def __init__(self, limits, max_wait=1.0, max_queue=100, max_buckets=10000, clock=time.monotonic):
+        """
+        :param limits: [List[RateLimit]], rate limits
+        :param max_wait: [float], seconds a request may wait to be admitted
+        :param max_queue: [int], number of requests that may wait on the same bucket
+        :param max_buckets: [int], number of buckets kept, beyond which the least recently used settled
+        ones are dropped, so that clients sending random API keys can't grow them without bound
+        :param clock: [Callable[[], float]], monotonic clock
+        """
+        self._limits = limits
+        self._max_wait = max_wait
+        self._max_queue = max_queue
+        self._max_buckets = max_buckets
+        self._clock = clock
+        self._buckets = OrderedDict()
+        model_labels.configure(*[_limit.model for _limit in limits])
+
+    @property
+    def enabled(self):
+        return bool(self._limits)
+
+    def _bucket(self, key, per_minute, burst_seconds):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+
+        rate = per_minute / 60
+        bucket = self._buckets[key] = TokenBucket(rate, max(1.0, rate * burst_seconds), self._clock)
+        while len(self._buckets) > self._max_buckets:
+            evicted = next((_key for _key, _bucket in self._buckets.items() if _key != key and _bucket.settled()), None)
+            # Buckets that requests still wait on are kept even beyond the maximum, they are few
+            if evicted is None:
+                break
+            del self._buckets[evicted]
+        return bucket
+
+    def _demands(self, endpoint, provider, tokens, model):
+        key = api_key.get()
+        demands = []
+        for _index, _limit in enumerate(self._limits):
+            if not _limit.matches(provider, endpoint, model):
+                continue
+            partition = key if _limit.per_api_key else None
+            if _limit.requests_per_minute:
+                bucket = self._bucket((_index, "requests", partition), _limit.requests_per_minute, _limit.burst_seconds)
+                demands.append((bucket, 1))
+            if _limit.tokens_per_minute:
+                bucket = self._bucket((_index, "tokens", partition), _limit.tokens_per_minute, _limit.burst_seconds)
+                demands.append((bucket, tokens))
+        return demands
+
+    async def admit(self, endpoint, provider, tokens=0, model=None):
+        """
+        Wait until the request can be served or reject it
+
+        :param endpoint: [str], one of chat, embeddings or images
+        :param provider: [str], provider name
+        :param tokens: [int], estimated number of tokens of the request and its response
+        :param model: [Optional[str]], resolved model name
+        """
+        demands = self._demands(endpoint, provider, tokens, model)
+        if not demands:
+            return
+
+        wait = max(_bucket.wait_time(_amount) for _bucket, _amount in demands)
+        if wait > self._max_wait or (wait > 0 and any(_bucket.waiters >= self._max_queue for _bucket, _ in demands)):
+            RATE_LIMITED_REQUESTS.inc(endpoint, provider)
+            raise TooManyRequestsError(retry_after=max(1, math.ceil(wait)))
+
+        for _bucket, _amount in demands:
+            _bucket.take(_amount)
+        ADMISSION_WAIT.observe(wait, endpoint, provider)
+        if wait == 0:
+            return
+
+        for _bucket, _ in demands:
+            _bucket.waiters += 1
+        try:
+            await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            # The request is gone, its share of the limits goes to the requests behind it
+            for _bucket, _amount in demands:
+                _bucket.give_back(_amount)
+            raise
+        finally:
+            for _bucket, _ in demands:
+                _bucket.waiters -= 1
+
+
+def create_rate_limiter():
+    """
+    Create the rate limiter from the RATE_LIMITS env variable. It's a JSON list of limits, e.g.
+    [{"provider": "sagemaker", "endpoint": "chat", "model": "llama-2-7b", "per_api_key": true,
+    "requests_per_minute": 600, "tokens_per_minute": 100000, "burst_seconds": 1}]
+
+    :return: [RateLimiter], rate limiter of the gateway
+    """
+    return RateLimiter(
+        [RateLimit(**_limit) for _limit in json.loads(os.environ.get("RATE_LIMITS", "[]"))],
+        max_wait=float(os.environ.get("RATE_LIMIT_MAX_WAIT_MS", 1000)) / 1000,
+        max_queue=int(os.environ.get("RATE_LIMIT_MAX_QUEUE", 100)),
+        max_buckets=int(os.environ.get("RATE_LIMIT_MAX_BUCKETS", 10000))
+    )
+
+
+rate_limiter = create_rate_limiter()
@@ -0,0 +1,411 @@
+import asyncio
+from contextlib import asynccontextmanager
+import json
+import math
+import os
+import random
+import time
+
+from sagify.llm_gateway.api.v1.exceptions import GatewayTimeoutError, ServiceUnavailableError, TooManyRequestsError
+from sagify.llm_gateway.core.metrics import BREAKER_STATE, BULKHEAD_REJECTIONS, UPSTREAM_RETRIES, model_labels
+
+
+# Error codes of the AWS APIs for throttled requests
+_THROTTLING_CODES = {"ThrottlingException", "TooManyRequestsException", "Throttling", "RequestLimitExceeded"}
+
+
+def _root_cause(error):
+    """
+    :return: [BaseException], original exception of an error the providers wrapped into an HTTPException
+    """
+    while True:
+        cause = error.__cause__ or error.__context__
+        if cause is None or cause is error:
+            return error
+        error = cause
+
+
+def classify(error):
+    """
+    Tell whether an error of a provider call is worth a retry or a strike against the upstream
+
+    :param error: [Exception], error raised by the provider call
+
+    :return: [str], throttled if the upstream asked to slow down, client if the request itself is
+    invalid, upstream otherwise
+    """
+    root = _root_cause(error)
+    status_code = getattr(root, "status_code", None)
+    response = getattr(root, "response", None)
+    if isinstance(response, dict):
+        # botocore errors carry the parsed error response
+        if response.get("Error", {}).get("Code") in _THROTTLING_CODES:
+            return "throttled"
+        status_code = response.get("ResponseMetadata", {}).get("HTTPStatusCode", status_code)
+    if status_code == 429:
+        return "throttled"
+    # Timeouts and failed models (424 from SageMaker) are the upstream's fault, not the request's
+    if isinstance(status_code, int) and 400 <= status_code < 500 and status_code not in (408, 424):
+        return "client"
+    return "upstream"
+
+
+class ResiliencePolicy:
+    """
+    Timeouts, retries, circuit breaker and bulkhead settings of a provider, or of a model of it
+    """
+    def __init__(
+            self,
+            connect_timeout=5.0,
+            read_timeout=300.0,
+            max_retries=2,
+            retry_base_delay=0.1,
+            retry_max_delay=2.0,
+            failure_threshold=5,
+            recovery_time=30.0,
+            max_concurrency=256,
+            max_queue_wait=1.0
+    ):
+        """
+        :param connect_timeout: [float], seconds to wait for a connection to the upstream
+        :param read_timeout: [float], seconds to wait for a response, or for the next chunk of a stream
+        :param max_retries: [int], number of retries of a throttled call
+        :param retry_base_delay: [float], seconds of the first backoff, doubled on every retry
+        :param retry_max_delay: [float], maximum seconds of a backoff
+        :param failure_threshold: [int], number of consecutive failures after which the circuit breaker opens
+        :param recovery_time: [float], seconds the circuit breaker stays open before a trial call
+        :param max_concurrency: [Optional[int]], number of calls in flight to the provider, unlimited if None
+        :param max_queue_wait: [float], seconds a call waits for a free slot of the bulkhead before being rejected
+        """
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.max_concurrency = max_concurrency
+        self.max_queue_wait = max_queue_wait
+
+    def merge(self, settings):
+        """
+        :param settings: [dict], settings of the RESILIENCE_POLICIES env variable
+
+        :return: [ResiliencePolicy], policy with the given settings overriding those of this one
+        """
+        policy = ResiliencePolicy(**vars(self))
+        for _key, _value in settings.items():
+            if _key.endswith("_ms"):
+                setattr(policy, _key[:-len("_ms")], _value / 1000)
+            elif _key not in ("provider", "model"):
+                setattr(policy, _key, _value)
+        return policy
+
+    def backoff(self, attempt):
+        """
+        :param attempt: [int], number of the retry, starting at 0
+
+        :return: [float], seconds to wait before the retry, with full jitter
+        """
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream after consecutive failures. Once the recovery time is over, a single trial
+    call is let through (half open), which closes the breaker if it succeeds and opens it again otherwise.
+    """
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_threshold, recovery_time, labels=(), clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._labels = labels
+        self._clock = clock
+        self._trial_in_flight = False
+
+    def _set_state(self, state):
+        self.state = state
+        BREAKER_STATE.set([self.CLOSED, self.HALF_OPEN, self.OPEN].index(state), *self._labels)
+
+    def allow(self):
+        """
+        :return: [bool], whether a call may go through, which must then be recorded or released
+        """
+        if self.state == self.OPEN and self._clock() - self.opened_at >= self.recovery_time:
+            self._set_state(self.HALF_OPEN)
+            self._trial_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+        return self.state != self.OPEN
+
+    def record_success(self):
+        self.failures = 0
+        self._trial_in_flight = False
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = self._clock()
+            self._set_state(self.OPEN)
+
+    def release(self):
+        """
+        Give back a call that neither succeeded nor failed because of the upstream
+        """
+        self._trial_in_flight = False
+
+    def retry_after(self):
+        """
+        :return: [int], seconds until the next trial call
+        """
+        if self.state != self.OPEN:
+            return 1
+        return max(1, math.ceil(self.recovery_time - (self._clock() - self.opened_at)))
+
+    def to_dict(self):
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+class Bulkhead:
+    """
+    Caps the calls in flight to a provider, so that a slow provider can't take every worker of the gateway
+    """
+    def __init__(self, max_concurrency, max_queue_wait):
+        self.max_concurrency = max_concurrency
+        self.max_queue_wait = max_queue_wait
+        self.in_flight = 0
+        # Created on first use, so that it's bound to the event loop of the server
+        self._semaphore = None
+
+    @asynccontextmanager
+    async def slot(self, provider):
+        if self.max_concurrency is None:
+            yield
+            return
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_queue_wait)
+        except asyncio.TimeoutError:
+            BULKHEAD_REJECTIONS.inc(provider)
+            raise ServiceUnavailableError(f"Too many requests in flight to {provider}", retry_after=1)
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+class Resilience:
+    """
+    Wraps the provider calls with per provider and model timeouts, retries of throttled calls with
+    exponential backoff and jitter, a circuit breaker per upstream and a bulkhead per provider
+    """
+    def __init__(self, policies=None, default_policy=None, clock=time.monotonic):
+        """
+        :param policies: [dict], settings by provider and model, with a model of None for the settings
+        that apply to every model of the provider
+        :param default_policy: [Optional[ResiliencePolicy]], policy of the providers without settings
+        :param clock: [Callable[[], float]], clock of the circuit breakers
+        """
+        self._policies = policies or {}
+        self._default_policy = default_policy or ResiliencePolicy()
+        self._clock = clock
+        # Settings of models set by their providers, overridden by the model settings of the policies
+        self._model_defaults = {}
+        model_labels.configure(*[_model for _, _model in self._policies])
+        self._breakers = {}
+        self._bulkheads = {}
+
+    def policy(self, provider, model=None):
+        """
+        :return: [ResiliencePolicy], policy of a provider and model, the model settings overriding the
+        provider settings
+        """
+        policy = self._default_policy.merge(self._policies.get((provider, None), {}))
+        if model is not None:
+            policy = policy.merge(self._model_defaults.get((provider, model), {}))
+            policy = policy.merge(self._policies.get((provider, model), {}))
+        return policy
+
+    def set_model_defaults(self, provider, model, **settings):
+        """
+        Set the settings a model needs, unless the policies set them for the model, e.g. the read timeout
+        of a model whose calls wait on the upstream for longer than usual
+
+        :param provider: [str], provider name
+        :param model: [str], model name
+        :param settings: settings of a ResiliencePolicy
+        """
+        self._model_defaults[(provider, model)] = settings
+        model_labels.configure(model)
+
+    def max_read_timeout(self, provider):
+        """
+        :return: [float], longest read timeout of a provider and its models, for the clients whose timeouts
+        can only be set per provider
+        """
+        return max(
+            [self.policy(provider).read_timeout] +
+            [self.policy(provider, _model).read_timeout for _provider, _model in self._policies if _provider == provider and _model]
+        )
+
+    def breaker(self, provider, model):
+        # Models that aren't known share the breaker of the "other" models of the provider, so that requests
+        # for random models can't create breakers without bound
+        label = model_labels.label(model)
+        key = (provider, label)
+        if key not in self._breakers:
+            policy = self.policy(provider, model if label == model else None)
+            self._breakers[key] = CircuitBreaker(
+                policy.failure_threshold, policy.recovery_time, labels=key, clock=self._clock
+            )
+        return self._breakers[key]
+
+    def bulkhead(self, provider):
+        if provider not in self._bulkheads:
+            policy = self.policy(provider)
+            self._bulkheads[provider] = Bulkhead(policy.max_concurrency, policy.max_queue_wait)
+        return self._bulkheads[provider]
+
+    def _admit(self, provider, model, breaker):
+        if not breaker.allow():
+            raise ServiceUnavailableError(
+                f"The circuit breaker of {' '.join(filter(None, [provider, model]))} is open",
+                retry_after=breaker.retry_after()
+            )
+
+    async def call(self, provider, model, upstream):
+        """
+        Call a provider through its bulkhead and circuit breaker, retrying the throttled calls
+
+        :param provider: [str], provider name
+        :param model: [Optional[str]], resolved model name
+        :param upstream: [Callable[[], Awaitable[BaseModel]]], provider call
+
+        :return: [BaseModel], response DTO of the provider
+        """
+        policy = self.policy(provider, model)
+        breaker = self.breaker(provider, model)
+        async with self.bulkhead(provider).slot(provider):
+            for _attempt in range(policy.max_retries + 1):
+                self._admit(provider, model, breaker)
+                recorded = False
+                try:
+                    response = await asyncio.wait_for(upstream(), policy.read_timeout)
+                    breaker.record_success()
+                    recorded = True
+                    return response
+                except asyncio.TimeoutError:
+                    breaker.record_failure()
+                    recorded = True
+                    raise GatewayTimeoutError(f"{provider} did not respond within {policy.read_timeout:g} seconds")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    kind = classify(e)
+                    if kind == "upstream":
+                        breaker.record_failure()
+                        recorded = True
+                        raise
+                    if kind == "client":
+                        raise
+                    if _attempt == policy.max_retries:
+                        raise TooManyRequestsError(
+                            f"{provider} is throttling requests", retry_after=max(1, math.ceil(policy.retry_max_delay))
+                        ) from e
+                finally:
+                    if not recorded:
+                        breaker.release()
+                UPSTREAM_RETRIES.inc(provider, model_labels.label(model))
+                await asyncio.sleep(policy.backoff(_attempt))
+
+    async def stream(self, provider, model, chunks):
+        """
+        Relay the chunks of a streamed provider response through the bulkhead and circuit breaker of the
+        provider. Streams aren't retried, and the read timeout applies to every chunk.
+
+        :param provider: [str], provider name
+        :param model: [Optional[str]], resolved model name
+        :param chunks: [AsyncIterator[BaseModel]], streamed response of the provider
+
+        :return: [AsyncIterator[BaseModel]], chunks of the response
+        """
+        policy = self.policy(provider, model)
+        breaker = self.breaker(provider, model)
+        async with self.bulkhead(provider).slot(provider):
+            self._admit(provider, model, breaker)
+            iterator = chunks.__aiter__()
+            recorded = False
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), policy.read_timeout)
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+                breaker.record_success()
+                recorded = True
+            except asyncio.TimeoutError:
+                breaker.record_failure()
+                recorded = True
+                raise GatewayTimeoutError(f"{provider} did not respond within {policy.read_timeout:g} seconds")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if classify(e) == "upstream":
+                    breaker.record_failure()
+                    recorded = True
+                raise
+            finally:
+                if not recorded:
+                    breaker.release()
+
+    def health(self):
+        """
+        :return: [dict], state of the circuit breakers and bulkheads by provider, and whether no breaker is open
+        """
+        providers = {}
+        for (_provider, _model), _breaker in self._breakers.items():
+            provider = providers.setdefault(_provider, {"circuit_breakers": {}})
+            provider["circuit_breakers"][_model] = _breaker.to_dict()
+        for _provider, _bulkhead in self._bulkheads.items():
+            providers.setdefault(_provider, {"circuit_breakers": {}})["bulkhead"] = {
+                "in_flight": _bulkhead.in_flight,
+                "max_concurrency": _bulkhead.max_concurrency,
+            }
+        return {
+            "healthy": all(
+                _breaker.state != CircuitBreaker.OPEN for _breaker in self._breakers.values()
+            ),
+            "providers": providers,
+        }
+
+
+def create_resilience():
+    """
+    Create the resilience layer from the RESILIENCE_POLICIES env variable. It's a JSON list of settings
+    of a provider, or of a model of it, e.g. [{"provider": "sagemaker", "model": "llama-2-7b",
+    "connect_timeout_ms": 2000, "read_timeout_ms": 60000, "max_retries": 3, "retry_base_delay_ms": 100,
+    "retry_max_delay_ms": 2000, "failure_threshold": 5, "recovery_time_ms": 30000, "max_concurrency": 64,
+    "max_queue_wait_ms": 1000}]. The bulkhead settings only apply per provider.
+
+    :return: [Resilience], resilience layer
+    """
+    policies = {}
+    for _settings in json.loads(os.environ.get("RESILIENCE_POLICIES", "[]")):
+        policies[(_settings["provider"], _settings.get("model"))] = _settings
+    return Resilience(policies)
+
+
+resilience = create_resilience()
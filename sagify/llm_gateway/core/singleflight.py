@@ -0,0 +1,79 @@
+import asyncio
+import os
+
+from sagify.llm_gateway.core.metrics import COALESCED_REQUESTS
+
+
+class _Flight:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first call under a key runs, and the calls under the
+    same key that arrive while it's in flight wait for its result, or its error, instead of running
+    again. Nothing is kept once the call is done.
+    """
+    def __init__(self, disabled_endpoints=()):
+        """
+        :param disabled_endpoints: [Iterable[str]], endpoints whose calls always run
+        """
+        self._disabled_endpoints = set(disabled_endpoints)
+        self._flights = {}
+        self._stats = {"calls": 0, "coalesced": 0}
+
+    async def do(self, endpoint, key, call):
+        """
+        Run a call, or wait for the identical call in flight
+
+        :param endpoint: [str], one of chat, embeddings or images
+        :param key: [str], key of the request, e.g. from ResponseCache.key
+        :param call: [Callable[[], Awaitable[BaseModel]]], upstream call
+
+        :return: [BaseModel], response DTO
+        """
+        if endpoint in self._disabled_endpoints:
+            return await call()
+
+        flight = self._flights.get(key)
+        if flight is None:
+            self._stats["calls"] += 1
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(call()))
+            flight.task.add_done_callback(lambda _task: self._done(key, flight))
+        else:
+            self._stats["coalesced"] += 1
+            COALESCED_REQUESTS.inc(endpoint)
+
+        # The call is shielded so that a waiter that goes away, e.g. on a client disconnect, doesn't
+        # cancel it for the other waiters. It's only cancelled when every waiter went away.
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.cancelled():
+                if flight.waiters == 1 and not flight.task.done():
+                    flight.task.cancel()
+                raise
+        finally:
+            flight.waiters -= 1
+
+        # The call was cancelled by its last waiter after this one joined it, while this one wasn't
+        # cancelled, so it runs again in a new flight
+        return await self.do(endpoint, key, call)
+
+    def _done(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # Every waiter gets the error, this only keeps asyncio from reporting it as never retrieved
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def stats(self):
+        return dict(self._stats, in_flight=len(self._flights))
+
+
+singleflight = SingleFlight([
+    _endpoint.strip() for _endpoint in os.environ.get("SINGLE_FLIGHT_DISABLED_ENDPOINTS", "").split(",") if _endpoint.strip()
+])
@@ -1,29 +1,113 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
+import os
 import sys
 
 import sagify.llm_gateway
-from sagify.llm_gateway.api.v1.exceptions import InternalServerError, internal_server_error_handler
+from sagify.llm_gateway.api.v1.exceptions import (
+    BadRequestError,
+    GatewayTimeoutError,
+    InternalServerError,
+    NotFoundError,
+    ServiceUnavailableError,
+    TooManyRequestsError,
+    bad_request_handler,
+    gateway_timeout_handler,
+    internal_server_error_handler,
+    not_found_handler,
+    service_unavailable_handler,
+    too_many_requests_handler
+)
+from sagify.llm_gateway.api.middleware import (
+    ApiKeyMiddleware,
+    AuditLogMiddleware,
+    CompressionMiddleware,
+    MetricsMiddleware
+)
+from sagify.llm_gateway.api.monitoring import router as monitoring_router
 from sagify.llm_gateway.api.v1.routes import api_router
+from sagify.llm_gateway.core.audit import audit_log
+from sagify.llm_gateway.providers.registry import registry
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await registry.startup()
+    await audit_log.start()
+    yield
+    await audit_log.stop()
+    await registry.shutdown()
 
 
 app = FastAPI(
     title="Sagify LLM Gateway",
     description="Gateway for Open Source LLM providers",
-    version=sagify.llm_gateway.__version__
+    version=sagify.llm_gateway.__version__,
+    lifespan=lifespan
     )
 app.include_router(api_router)
+app.include_router(monitoring_router)
+# The last middleware added runs first
+app.add_middleware(AuditLogMiddleware)
+app.add_middleware(ApiKeyMiddleware)
+app.add_middleware(
+    CompressionMiddleware,
+    encodings=[_encoding.strip() for _encoding in os.environ.get("COMPRESSION_ENCODINGS", "zstd,gzip").split(",") if _encoding.strip()],
+    minimum_size=int(os.environ.get("COMPRESSION_MIN_SIZE", 1024)),
+    gzip_level=int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6)),
+    zstd_level=int(os.environ.get("COMPRESSION_ZSTD_LEVEL", 3)),
+    executor_minimum_size=int(os.environ.get("COMPRESSION_EXECUTOR_MIN_SIZE", 256 * 1024))
+)
+app.add_middleware(MetricsMiddleware)
+app.add_exception_handler(BadRequestError, bad_request_handler)
+app.add_exception_handler(NotFoundError, not_found_handler)
 app.add_exception_handler(InternalServerError, internal_server_error_handler)
+app.add_exception_handler(GatewayTimeoutError, gateway_timeout_handler)
+app.add_exception_handler(TooManyRequestsError, too_many_requests_handler)
+app.add_exception_handler(ServiceUnavailableError, service_unavailable_handler)
 
 
-def start_server(port):
-    uvicorn.run("sagify.llm_gateway.main:app", port=port, host="0.0.0.0")
+def start_server(
+        port,
+        workers=None,
+        loop=None,
+        http=None,
+        backlog=None,
+        timeout_keep_alive=None,
+        limit_concurrency=None
+):
+    """
+    Start the gateway server. Settings that aren't given are read from the GATEWAY_* env variables.
 
+    :param port: [int], port to listen on
+    :param workers: [Union[int, str], default=None], number of worker processes or `auto` for one per CPU core
+    :param loop: [str, default=None], event loop implementation: auto, asyncio or uvloop
+    :param http: [str, default=None], HTTP parser implementation: auto, h11 or httptools
+    :param backlog: [int, default=None], maximum number of connections waiting to be accepted
+    :param timeout_keep_alive: [int, default=None], seconds to keep idle connections open
+    :param limit_concurrency: [int, default=None], maximum number of concurrent connections and tasks
+    per worker, beyond which requests get a 503 response
+    """
+    workers = workers or os.environ.get("GATEWAY_WORKERS", 1)
+    if workers == "auto":
+        workers = os.cpu_count() or 1
+    limit_concurrency = limit_concurrency or os.environ.get("GATEWAY_LIMIT_CONCURRENCY")
 
-if __name__ == "__main__":
-    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
-    start_server(port)
+    uvicorn.run(
+        "sagify.llm_gateway.main:app",
+        port=port,
+        host="0.0.0.0",
+        workers=int(workers),
+        loop=loop or os.environ.get("GATEWAY_LOOP", "auto"),
+        http=http or os.environ.get("GATEWAY_HTTP", "auto"),
+        backlog=int(backlog or os.environ.get("GATEWAY_BACKLOG", 2048)),
+        timeout_keep_alive=int(timeout_keep_alive or os.environ.get("GATEWAY_KEEP_ALIVE_IN_SECONDS", 5)),
+        limit_concurrency=int(limit_concurrency) if limit_concurrency else None
+    )
 
 
 if __name__ == "__main__":
-    start_server()
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    start_server(port)
@@ -1,10 +1,19 @@
+import httpx
 import structlog
 import anthropic
 import os
 import time
+from uuid import uuid4
 
-from sagify.llm_gateway.api.v1.exceptions import InternalServerError
-from sagify.llm_gateway.schemas.chat import CreateCompletionDTO, ResponseCompletionDTO
+from sagify.llm_gateway.api.v1.exceptions import BadRequestError, InternalServerError
+from sagify.llm_gateway.core.resilience import resilience
+from sagify.llm_gateway.schemas.chat import (
+    CreateCompletionDTO,
+    ResponseCompletionDTO,
+    ResponseCompletionChunkDTO,
+    ChunkChoiceItem,
+    DeltaItem
+)
 from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO
 from sagify.llm_gateway.schemas.images import CreateImageDTO
 
@@ -14,9 +23,31 @@ logger = structlog.get_logger()
 
 class AnthropicClient:
     def __init__(self):
-        self.client = anthropic.Anthropic()
+        max_connections = int(os.environ.get("ANTHROPIC_MAX_CONNECTIONS", 100))
+        policy = resilience.policy("anthropic")
+        # Retries and read timeouts of every model are handled by the resilience layer
+        self.client = anthropic.AsyncAnthropic(
+            max_retries=0,
+            timeout=httpx.Timeout(resilience.max_read_timeout("anthropic"), connect=policy.connect_timeout),
+            http_client=anthropic.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        )
         self._chat_completions_model = os.environ.get("ANTHROPIC_CHAT_COMPLETIONS_MODEL")
 
+    def default_model(self, endpoint):
+        """
+        Model used when a request doesn't specify one
+
+        :param endpoint: [str], one of chat, embeddings or images
+
+        :return: [Optional[str]], model name
+        """
+        return self._chat_completions_model if endpoint == "chat" else None
+
+    async def close(self):
+        await self.client.close()
+
     async def completions(self, message: CreateCompletionDTO):
         request = {
             "model": message.model if message.model else self._chat_completions_model,
@@ -27,7 +58,7 @@ class AnthropicClient:
             "stream": False
         }
         try:
-            response = self.client.messages.create(**request)
+            response = await self.client.messages.create(**request)
             response_dict = response.model_dump()
             response_dict["provider"] = message.provider
             response_dict["created"] = int(time.time())
@@ -53,8 +84,43 @@ class AnthropicClient:
             logger.error(e)
             raise InternalServerError(str(e))
 
+    async def completions_stream(self, message: CreateCompletionDTO):
+        request = {
+            "model": message.model if message.model else self._chat_completions_model,
+            "messages": message.messages,
+            "temperature": message.temperature,
+            "max_tokens": message.max_tokens,
+            "top_p": message.top_p,
+            "stream": True
+        }
+        try:
+            stream = await self.client.messages.create(**request)
+            chunk_id, model, created = f"chatcmpl-{uuid4().hex}", request["model"], int(time.time())
+            async for event in stream:
+                if event.type == "message_start":
+                    chunk_id, model = event.message.id, event.message.model
+                    delta, finish_reason = DeltaItem(role=event.message.role), None
+                elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                    delta, finish_reason = DeltaItem(content=event.delta.text), None
+                elif event.type == "message_delta":
+                    delta, finish_reason = DeltaItem(), event.delta.stop_reason
+                else:
+                    continue
+
+                yield ResponseCompletionChunkDTO(
+                    id=chunk_id,
+                    created=created,
+                    provider=message.provider,
+                    model=model,
+                    choices=[ChunkChoiceItem(index=0, delta=delta, finish_reason=finish_reason)]
+                )
+        except Exception as e:
+            logger.error(e)
+            raise InternalServerError(str(e))
+
+    # Requests for unsupported operations are client errors, which don't count against the circuit breaker
     async def embeddings(self, embedding_input: CreateEmbeddingDTO):
-        raise InternalServerError("Not supported")
+        raise BadRequestError("Embeddings are not supported by anthropic")
 
     async def generations(self, image_input: CreateImageDTO):
-        raise InternalServerError("Not supported")
+        raise BadRequestError("Image generations are not supported by anthropic")
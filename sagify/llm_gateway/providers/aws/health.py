@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import time
+
+from botocore.exceptions import ClientError
+import structlog
+
+from sagify.llm_gateway.core.metrics import ENDPOINT_HEALTHY, HEALTH_PROBE_LATENCY
+from sagify.llm_gateway.providers.aws.routing import Endpoint
+
+
+logger = structlog.get_logger()
+
+# Endpoints that are being updated keep serving requests with their current configuration
+_SERVING_STATUSES = ("InService", "Updating", "SystemUpdating")
+
+
+class EndpointHealthMonitor:
+    """
+    Checks the health of SageMaker endpoints in the background. Every check reads the status of an
+    endpoint and, if a ping payload is configured for it, invokes it with that payload, which also
+    keeps a connection to it warm in the pool. Endpoints that fail their checks are taken out of
+    rotation in their pools until they pass them again.
+    """
+    def __init__(self, client, endpoints, interval=30, ping_payloads=None):
+        """
+        :param client: [SageMakerClient], client whose executor, control plane and runtime clients the checks use
+        :param endpoints: [List[Endpoint]], endpoints to check, the state of endpoints with the same
+        name and region is shared
+        :param interval: [float], seconds between two checks of an endpoint, 0 to disable the checks
+        :param ping_payloads: [Optional[dict]], JSON payloads of the pings by endpoint name
+        """
+        self._client = client
+        self._interval = interval
+        self._ping_payloads = ping_payloads or {}
+        self._endpoints = {}
+        for _endpoint in endpoints:
+            self._endpoints.setdefault((_endpoint.name, _endpoint.region), []).append(_endpoint)
+        self._task = None
+
+    @property
+    def endpoints(self):
+        return [_endpoints[0] for _endpoints in self._endpoints.values()]
+
+    def start(self):
+        if self._interval > 0 and self._endpoints and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self._interval)
+
+    async def check(self):
+        """
+        Check every endpoint once, concurrently
+        """
+        await asyncio.gather(*[self._check(_name, _region) for _name, _region in self._endpoints])
+
+    async def _check(self, name, region):
+        probe_latency = None
+        try:
+            status = await self._client._run_in_executor(self._describe_endpoint, name, region)
+        except ClientError as e:
+            # Missing endpoints fail validation, other errors, e.g. missing permissions, say nothing
+            # about the endpoint itself
+            if e.response.get("Error", {}).get("Code") != "ValidationException":
+                logger.warning("SageMaker endpoint status not read", endpoint=name, error=str(e))
+                return
+            status = "NotFound"
+        except Exception as e:
+            logger.warning("SageMaker endpoint status not read", endpoint=name, error=str(e))
+            return
+
+        healthy = status in _SERVING_STATUSES
+        if healthy and name in self._ping_payloads:
+            started_at = time.monotonic()
+            try:
+                await self._client._run_in_executor(
+                    self._client._invoke_endpoint,
+                    region,
+                    EndpointName=name,
+                    Body=json.dumps(self._ping_payloads[name]),
+                    ContentType="application/json",
+                    CustomAttributes="accept_eula=true"
+                )
+                probe_latency = time.monotonic() - started_at
+                HEALTH_PROBE_LATENCY.observe(probe_latency, name)
+            except Exception as e:
+                logger.warning("SageMaker endpoint ping failed", endpoint=name, error=str(e))
+                status, healthy = "PingFailed", False
+
+        if not healthy:
+            logger.warning("SageMaker endpoint is unhealthy", endpoint=name, status=status)
+        ENDPOINT_HEALTHY.set(1 if healthy else 0, name)
+        for _endpoint in self._endpoints[(name, region)]:
+            _endpoint.status = status
+            _endpoint.healthy = healthy
+            _endpoint.probe_latency = probe_latency
+            _endpoint.checked_at = int(time.time())
+
+    def _describe_endpoint(self, name, region):
+        return self._client._sagemaker_client(region).describe_endpoint(EndpointName=name)["EndpointStatus"]
+
+    def to_dict(self):
+        """
+        :return: [dict], status of every endpoint and whether all of them are healthy
+        """
+        endpoints = self.endpoints
+        return {
+            "healthy": all(_endpoint.healthy for _endpoint in endpoints),
+            "endpoints": [_endpoint.to_dict() for _endpoint in endpoints],
+        }
+
+
+def create_endpoint_health_monitor(client, pools, models):
+    """
+    Create the health monitor of the endpoints of the pools and of the other models from the
+    SM_HEALTH_CHECK_* env variables. Ping payloads can be given by endpoint name or by pool alias.
+
+    :param client: [SageMakerClient], SageMaker client
+    :param pools: [dict], endpoint pools by alias
+    :param models: [Iterable[Optional[str]]], endpoint names or pool aliases of the default models
+
+    :return: [EndpointHealthMonitor], health monitor
+    """
+    ping_payloads = json.loads(os.environ.get("SM_HEALTH_CHECK_PING_PAYLOADS", "{}"))
+    endpoints = [_endpoint for _pool in pools.values() for _endpoint in _pool.endpoints]
+    endpoints.extend(Endpoint(_model) for _model in dict.fromkeys(models) if _model and _model not in pools)
+    for _alias, _pool in pools.items():
+        if _alias in ping_payloads:
+            for _endpoint in _pool.endpoints:
+                ping_payloads.setdefault(_endpoint.name, ping_payloads[_alias])
+
+    return EndpointHealthMonitor(
+        client,
+        endpoints,
+        interval=float(os.environ.get("SM_HEALTH_CHECK_INTERVAL_SECONDS", 30)),
+        ping_payloads=ping_payloads
+    )
@@ -0,0 +1,163 @@
+from contextlib import contextmanager
+import json
+import os
+import random
+import time
+
+from sagify.llm_gateway.core.metrics import ENDPOINT_EJECTIONS, ENDPOINT_OUTSTANDING, ROUTING_DECISIONS
+from sagify.llm_gateway.core.resilience import classify
+
+
+LEAST_OUTSTANDING = "least_outstanding"
+LATENCY = "latency"
+
+
+class Endpoint:
+    """
+    A SageMaker endpoint of a pool and the state the pool routes on
+    """
+    def __init__(self, name, region=None):
+        self.name = name
+        self.region = region
+        self.outstanding = 0
+        self.latency_ewma = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        # Set by the health checks, an endpoint is assumed healthy until a check says otherwise
+        self.healthy = True
+        self.status = None
+        self.probe_latency = None
+        self.checked_at = None
+
+    def available(self, now):
+        return self.healthy and self.ejected_until <= now
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "region": self.region,
+            "status": self.status,
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "latency_ewma_seconds": self.latency_ewma,
+            "probe_latency_seconds": self.probe_latency,
+            "checked_at": self.checked_at,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+class EndpointPool:
+    """
+    Pool of SageMaker endpoints that serve the same model under an alias.
+
+    Every request is routed to the available endpoint with the least outstanding requests, or with
+    the lowest moving average of latency weighted by its outstanding requests. An endpoint that fails
+    several times in a row is taken out of rotation for a while, and so is an endpoint that fails its
+    health checks until it passes them again.
+    """
+    def __init__(
+            self,
+            alias,
+            endpoints,
+            strategy=LEAST_OUTSTANDING,
+            failure_threshold=3,
+            ejection_seconds=30,
+            latency_decay=0.3,
+            clock=time.monotonic
+    ):
+        if strategy not in (LEAST_OUTSTANDING, LATENCY):
+            raise ValueError(f"Invalid routing strategy {strategy}")
+        self.alias = alias
+        self.endpoints = endpoints
+        self._strategy = strategy
+        self._failure_threshold = failure_threshold
+        self._ejection_seconds = ejection_seconds
+        self._latency_decay = latency_decay
+        self._clock = clock
+
+    def _score(self, endpoint):
+        if self._strategy == LEAST_OUTSTANDING:
+            return endpoint.outstanding, endpoint.latency_ewma or 0.0
+        # Endpoints without a latency estimate yet are tried first
+        return (endpoint.latency_ewma or 0.0) * (endpoint.outstanding + 1), endpoint.outstanding
+
+    def pick(self):
+        """
+        :return: [Endpoint], endpoint to route the next request to
+        """
+        now = self._clock()
+        candidates = [_endpoint for _endpoint in self.endpoints if _endpoint.available(now)]
+        if not candidates:
+            # Rather than failing every request, fall back to the endpoint that will be back soonest
+            candidates = [min(self.endpoints, key=lambda _endpoint: (not _endpoint.healthy, _endpoint.ejected_until))]
+
+        best_score = min(self._score(_endpoint) for _endpoint in candidates)
+        endpoint = random.choice([_endpoint for _endpoint in candidates if self._score(_endpoint) == best_score])
+        ROUTING_DECISIONS.inc(self.alias, endpoint.name)
+        return endpoint
+
+    @contextmanager
+    def route(self):
+        """
+        Route a call to an endpoint of the pool and track its outcome. The call is made within the
+        context, on the yielded endpoint, and fails the endpoint if it raises an error other than a
+        client error, which says nothing about the health of the endpoint.
+
+        :return: [Iterator[Endpoint]], endpoint to call
+        """
+        endpoint = self.pick()
+        endpoint.outstanding += 1
+        ENDPOINT_OUTSTANDING.inc(self.alias, endpoint.name)
+        started_at = self._clock()
+        try:
+            yield endpoint
+        except Exception as e:
+            if classify(e) != "client":
+                self._record_failure(endpoint)
+            raise
+        else:
+            self._record_success(endpoint, self._clock() - started_at)
+        finally:
+            endpoint.outstanding -= 1
+            ENDPOINT_OUTSTANDING.dec(self.alias, endpoint.name)
+
+    def _record_success(self, endpoint, latency):
+        endpoint.consecutive_failures = 0
+        if endpoint.latency_ewma is None:
+            endpoint.latency_ewma = latency
+        else:
+            endpoint.latency_ewma += self._latency_decay * (latency - endpoint.latency_ewma)
+
+    def _record_failure(self, endpoint):
+        endpoint.consecutive_failures += 1
+        if endpoint.consecutive_failures >= self._failure_threshold:
+            endpoint.ejected_until = self._clock() + self._ejection_seconds
+            endpoint.consecutive_failures = 0
+            ENDPOINT_EJECTIONS.inc(self.alias, endpoint.name)
+
+
+def create_endpoint_pools():
+    """
+    Create the endpoint pools from the SM_ENDPOINT_POOLS env variable. It's a JSON object that maps
+    every model alias to a list of endpoints, each given by its name or by an object with its name
+    and region, e.g. {"llama-2-7b": ["llama-a", {"name": "llama-b", "region": "eu-west-1"}]}
+
+    :return: [dict], pools by alias
+    """
+    pools_config = json.loads(os.environ.get("SM_ENDPOINT_POOLS", "{}"))
+    strategy = os.environ.get("SM_ROUTING_STRATEGY", LEAST_OUTSTANDING)
+    failure_threshold = int(os.environ.get("SM_ENDPOINT_FAILURE_THRESHOLD", 3))
+    ejection_seconds = float(os.environ.get("SM_ENDPOINT_EJECTION_SECONDS", 30))
+
+    return {
+        _alias: EndpointPool(
+            _alias,
+            [
+                Endpoint(_endpoint) if isinstance(_endpoint, str) else Endpoint(_endpoint["name"], _endpoint.get("region"))
+                for _endpoint in _endpoints
+            ],
+            strategy=strategy,
+            failure_threshold=failure_threshold,
+            ejection_seconds=ejection_seconds
+        ) for _alias, _endpoints in pools_config.items()
+    }
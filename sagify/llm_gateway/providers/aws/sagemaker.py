@@ -1,5 +1,8 @@
 from PIL import Image
+import asyncio
 import base64
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import json
 from io import BytesIO
 import os
@@ -7,16 +10,34 @@ import time
 import uuid
 
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import structlog
 
 from sagify.llm_gateway.api.v1.exceptions import InternalServerError
-from sagify.llm_gateway.schemas.chat import CreateCompletionDTO, ResponseCompletionDTO
-from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO, ResponseEmbeddingDTO
+from sagify.llm_gateway.core.batching import MicroBatcher
+from sagify.llm_gateway.core.metrics import IMAGE_UPLOAD_LATENCY
+from sagify.llm_gateway.core.resilience import resilience
+from sagify.llm_gateway.providers.aws.health import create_endpoint_health_monitor
+from sagify.llm_gateway.providers.aws.routing import create_endpoint_pools
+from sagify.llm_gateway.schemas.chat import CreateCompletionDTO, ResponseCompletionDTO, ResponseCompletionChunkDTO
+from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO, EncodingFormat, ResponseEmbeddingDTO, input_size
 from sagify.llm_gateway.schemas.images import CreateImageDTO, ResponseImageDTO, ResponseFormat
-from sagify.llm_gateway.schemas.chat import ChoiceItem, MessageItem
+from sagify.llm_gateway.schemas.chat import ChoiceItem, MessageItem, ChunkChoiceItem, DeltaItem, RoleItem
 
 logger = structlog.get_logger()
 
+_IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+]
+
+_FINISH_REASONS = {
+    'eos_token': 'stop',
+    'stop_sequence': 'stop',
+    'length': 'length',
+}
+
 
 class SageMakerClient:
     def __init__(self):
@@ -28,13 +49,124 @@ class SageMakerClient:
         self._chat_completions_model = os.environ.get("SM_CHAT_COMPLETIONS_MODEL")
         self._embeddings_model = os.environ.get("SM_EMBEDDINGS_MODEL")
         self._image_creation_model = os.environ.get("SM_IMAGE_CREATION_MODEL")
+        # Larger embedding requests are split into concurrent requests by the embeddings service. The
+        # payloads of real-time endpoints are limited to 6 MB, the number of texts depends on the container.
+        self.embeddings_max_inputs = int(os.environ.get("SM_EMBEDDINGS_MAX_INPUTS", 0)) or None
+        self.embeddings_max_bytes = int(os.environ.get("SM_EMBEDDINGS_MAX_BYTES", 5 * 1024 * 1024)) or None
+        # Image models served by SageMaker Async Inference endpoints, whose inputs and outputs go through S3
+        self._async_inference_models = {
+            _model.strip() for _model in os.environ.get("SM_ASYNC_INFERENCE_MODELS", "").split(",") if _model.strip()
+        }
+        self._async_inference_poll_interval = float(os.environ.get("SM_ASYNC_INFERENCE_POLL_INTERVAL_MS", 1000)) / 1000
+        self._async_inference_timeout = float(os.environ.get("SM_ASYNC_INFERENCE_TIMEOUT_SECONDS", 900))
+        # The outputs of Async Inference requests are polled for up to their own timeout, which the read
+        # timeout of the resilience layer mustn't cut short, with a minute for the S3 calls around the polling
+        for _model in self._async_inference_models:
+            resilience.set_model_defaults(
+                "sagemaker", _model, read_timeout=self._async_inference_timeout + self._async_inference_poll_interval + 60
+            )
         self.boto_session = boto3.Session(
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
             region_name=aws_region_name
         )
-        self.sagemaker_runtime_client = self.boto_session.client('sagemaker-runtime')
-        self.s3_client = self.boto_session.client('s3')
+        max_connections = int(os.environ.get("SM_MAX_CONNECTIONS", 50))
+        # Retries and read timeouts of every model are handled by the resilience layer
+        boto_config = Config(
+            max_pool_connections=max_connections,
+            connect_timeout=resilience.policy("sagemaker").connect_timeout,
+            read_timeout=resilience.max_read_timeout("sagemaker"),
+            retries={"total_max_attempts": 1}
+        )
+        # Endpoint URLs can be overridden to use local stand-ins of the AWS services
+        self.sagemaker_runtime_client = self.boto_session.client(
+            'sagemaker-runtime', config=boto_config, endpoint_url=os.environ.get("SM_RUNTIME_ENDPOINT_URL")
+        )
+        # Model aliases that are served by a pool of endpoints, possibly in other regions
+        self._endpoint_pools = create_endpoint_pools()
+        self._runtime_clients = {}
+        # The endpoint health checks read the status of the endpoints of every region with the control
+        # plane clients, which are created up front as boto3 sessions aren't safe to use across threads
+        self._sagemaker_clients = {None: self.boto_session.client('sagemaker')}
+        for _pool in self._endpoint_pools.values():
+            for _endpoint in _pool.endpoints:
+                if _endpoint.region is not None and _endpoint.region not in self._runtime_clients:
+                    self._runtime_clients[_endpoint.region] = self.boto_session.client(
+                        'sagemaker-runtime',
+                        region_name=_endpoint.region,
+                        config=boto_config,
+                        endpoint_url=os.environ.get("SM_RUNTIME_ENDPOINT_URL")
+                    )
+                    self._sagemaker_clients[_endpoint.region] = self.boto_session.client(
+                        'sagemaker', region_name=_endpoint.region
+                    )
+        self.health_monitor = create_endpoint_health_monitor(
+            self,
+            self._endpoint_pools,
+            [self._chat_completions_model, self._embeddings_model, self._image_creation_model]
+        )
+        self.s3_client = self.boto_session.client(
+            's3',
+            config=Config(max_pool_connections=max_connections),
+            endpoint_url=os.environ.get("S3_ENDPOINT_URL")
+        )
+        # boto3 is synchronous, so its calls are run on a bounded pool of worker threads to keep the
+        # event loop free while waiting on SageMaker and S3
+        self._executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("SM_MAX_WORKERS", max_connections)),
+            thread_name_prefix='sagemaker'
+        )
+        # Concurrent embedding requests to the same endpoint can optionally be sent as one invocation
+        embeddings_batch_window_ms = float(os.environ.get("SM_EMBEDDINGS_BATCH_WINDOW_MS", 0))
+        # Batches stay within the limits the embeddings service chunks the requests by
+        embeddings_max_batch_size = int(os.environ.get("SM_EMBEDDINGS_MAX_BATCH_SIZE", 32))
+        self._embeddings_batcher = MicroBatcher(
+            self._embed,
+            window=embeddings_batch_window_ms / 1000,
+            max_batch_size=min(embeddings_max_batch_size, self.embeddings_max_inputs or embeddings_max_batch_size),
+            name='sagemaker_embeddings',
+            max_batch_bytes=self.embeddings_max_bytes,
+            item_size=input_size
+        ) if embeddings_batch_window_ms > 0 else None
+        # Concurrent chat requests to the same endpoint with the same parameters can optionally be sent
+        # as one invocation with a batch of dialogs
+        chat_batch_window_ms = float(os.environ.get("SM_CHAT_BATCH_WINDOW_MS", 0))
+        self._chat_batcher = MicroBatcher(
+            self._complete_dialogs,
+            window=chat_batch_window_ms / 1000,
+            max_batch_size=int(os.environ.get("SM_CHAT_MAX_BATCH_SIZE", 8)),
+            name='sagemaker_chat'
+        ) if chat_batch_window_ms > 0 else None
+
+    def default_model(self, endpoint):
+        """
+        Model used when a request doesn't specify one
+
+        :param endpoint: [str], one of chat, embeddings or images
+
+        :return: [Optional[str]], model name
+        """
+        return {
+            "chat": self._chat_completions_model,
+            "embeddings": self._embeddings_model,
+            "images": self._image_creation_model,
+        }.get(endpoint)
+
+    def health(self):
+        """
+        :return: [dict], health of the SageMaker endpoints
+        """
+        return self.health_monitor.to_dict()
+
+    async def close(self):
+        await self.health_monitor.stop()
+        self._executor.shutdown(wait=False)
+        self.sagemaker_runtime_client.close()
+        for _runtime_client in self._runtime_clients.values():
+            _runtime_client.close()
+        for _sagemaker_client in self._sagemaker_clients.values():
+            _sagemaker_client.close()
+        self.s3_client.close()
 
     async def completions(self, message: CreateCompletionDTO):
         request = {
@@ -45,7 +177,21 @@ class SageMakerClient:
             "stream": False
         }
         try:
-            return self._invoke_chat_completions_endpoint(**request)
+            return await self._invoke_chat_completions_endpoint(**request)
+        except Exception as e:
+            logger.error(e)
+            raise InternalServerError(str(e))
+
+    async def completions_stream(self, message: CreateCompletionDTO):
+        request = {
+            "model": message.model if message.model else self._chat_completions_model,
+            "messages": message.messages,
+            "temperature": message.temperature,
+            "max_tokens": message.max_tokens,
+        }
+        try:
+            async for chunk in self._stream_chat_completions_endpoint(**request):
+                yield chunk
         except Exception as e:
             logger.error(e)
             raise InternalServerError(str(e))
@@ -54,9 +200,10 @@ class SageMakerClient:
         request = {
             "model": embedding_input.model if embedding_input.model else self._embeddings_model,
             "input": embedding_input.input,
+            "encoding_format": embedding_input.encoding_format,
         }
         try:
-            return self._invoke_embeddings_endpoint(**request)
+            return await self._invoke_embeddings_endpoint(**request)
         except Exception as e:
             logger.error(e)
             raise InternalServerError(str(e))
@@ -72,12 +219,87 @@ class SageMakerClient:
             "response_format": image_input.response_format
         }
         try:
-            return self._invoke_image_creation_endpoint(**request)
+            return await self._invoke_image_creation_endpoint(**request)
         except Exception as e:
             logger.error(e)
             raise InternalServerError(str(e))
 
-    def _invoke_image_creation_endpoint(
+    async def _run_in_executor(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def _runtime_client(self, region):
+        return self.sagemaker_runtime_client if region is None else self._runtime_clients[region]
+
+    def _sagemaker_client(self, region):
+        return self._sagemaker_clients[region]
+
+    async def _invoke(self, model, **kwargs):
+        """
+        Invoke the endpoint of a model, or an endpoint of its pool when the model is a pool alias
+
+        :param model: [str], name of the endpoint or alias of an endpoint pool
+        :param kwargs: keyword arguments of the invoke_endpoint call, except for the endpoint name
+
+        :return: [dict], decoded response body
+        """
+        pool = self._endpoint_pools.get(model)
+        if pool is None:
+            return await self._run_in_executor(self._invoke_endpoint, EndpointName=model, **kwargs)
+
+        with pool.route() as endpoint:
+            return await self._run_in_executor(
+                self._invoke_endpoint, endpoint.region, EndpointName=endpoint.name, **kwargs
+            )
+
+    async def _invoke_endpoint_with_response_stream(self, model, **kwargs):
+        """
+        Invoke a SageMaker endpoint with response streaming and yield the payload parts as they arrive.
+        Reading the event stream blocks, so each read happens in the executor.
+
+        :param model: [str], name of the endpoint or alias of an endpoint pool
+        :param kwargs: keyword arguments of the invoke_endpoint_with_response_stream call, except for
+        the endpoint name
+
+        :return: [AsyncIterator[bytes]], payload parts of the response
+        """
+        pool = self._endpoint_pools.get(model)
+        if pool is None:
+            async for _part in self._read_response_stream(None, EndpointName=model, **kwargs):
+                yield _part
+            return
+
+        # The endpoint counts as busy until the whole response has been read
+        with pool.route() as endpoint:
+            async for _part in self._read_response_stream(endpoint.region, EndpointName=endpoint.name, **kwargs):
+                yield _part
+
+    async def _read_response_stream(self, region, **kwargs):
+        response = await self._run_in_executor(
+            self._runtime_client(region).invoke_endpoint_with_response_stream, **kwargs
+        )
+        events = iter(response['Body'])
+        while True:
+            event = await self._run_in_executor(next, events, None)
+            if event is None:
+                break
+            if 'PayloadPart' in event:
+                yield event['PayloadPart']['Bytes']
+
+    def _invoke_endpoint(self, region=None, **kwargs):
+        """
+        Invoke a SageMaker endpoint and read its JSON response. It blocks, so it's meant to be run
+        in the executor.
+
+        :param region: [Optional[str]], region of the endpoint, if not the default one
+        :param kwargs: keyword arguments of the invoke_endpoint call
+
+        :return: [dict], decoded response body
+        """
+        response = self._runtime_client(region).invoke_endpoint(**kwargs)
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+    async def _invoke_image_creation_endpoint(
             self,
             model,
             prompt,
@@ -90,7 +312,7 @@ class SageMakerClient:
         """
         Invoke SageMaker endpoint for image creations
 
-        :param model: [str], name of the endpoint
+        :param model: [str], name of the endpoint or alias of an endpoint pool
         :param prompt: [Union[List[str], str]], prompt text
         :param n: [int], number of images to generate
         :param width: [int], width of the image
@@ -109,30 +331,81 @@ class SageMakerClient:
             "guidance_scale": 7.5,
             "seed": seed,
         }
-        response = self.sagemaker_runtime_client.invoke_endpoint(
-            EndpointName=model,
+        invoke = self._invoke_async_inference if model in self._async_inference_models else self._invoke
+        response_dict = await invoke(
+            model,
             Body=json.dumps(payload),
             ContentType="application/json",
             CustomAttributes='accept_eula=true',
             Accept="application/json;jpeg"
         )
-        response_dict = json.loads(response['Body'].read().decode('utf-8'))
 
         return ResponseImageDTO(
             provider='sagemaker',
             model=model,
             created=int(time.time()),
-            data=[
+            data=await asyncio.gather(*[
                 self._prepare_image_item_response(
                     response_format, _base64_string
                 ) for _base64_string in response_dict['generated_images']
-            ]
+            ])
+        )
+
+    async def _invoke_async_inference(self, model, Body, **kwargs):
+        """
+        Invoke a SageMaker Async Inference endpoint: upload the request body to S3, queue the
+        invocation and poll S3 until its output, or failure, shows up
+
+        :param model: [str], name of the endpoint
+        :param Body: [str], request body
+        :param kwargs: keyword arguments of the invoke_endpoint_async call, except for the endpoint
+        name and input location
+
+        :return: [dict], decoded response body
+        """
+        key = 'async-inference/inputs/{}.json'.format(uuid.uuid4())
+        await self._run_in_executor(self.s3_client.put_object, Bucket=self._bucket_name, Key=key, Body=Body)
+        response = await self._run_in_executor(
+            self.sagemaker_runtime_client.invoke_endpoint_async,
+            EndpointName=model,
+            InputLocation='s3://{}/{}'.format(self._bucket_name, key),
+            **kwargs
         )
 
-    def _prepare_image_item_response(self, response_format, base64_string):
+        deadline = time.monotonic() + self._async_inference_timeout
+        while time.monotonic() < deadline:
+            output = await self._run_in_executor(self._read_s3_object, response['OutputLocation'])
+            if output is not None:
+                return json.loads(output.decode('utf-8'))
+            if response.get('FailureLocation'):
+                failure = await self._run_in_executor(self._read_s3_object, response['FailureLocation'])
+                if failure is not None:
+                    raise InternalServerError(failure.decode('utf-8'))
+            await asyncio.sleep(self._async_inference_poll_interval)
+        raise InternalServerError('No output from {} after {} seconds'.format(model, self._async_inference_timeout))
+
+    def _read_s3_object(self, location):
+        """
+        :param location: [str], S3 URI of the object
+
+        :return: [Optional[bytes]], content of the object, or None if it doesn't exist yet
+        """
+        bucket, _, key = location[len('s3://'):].partition('/')
+        try:
+            return self.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    async def _prepare_image_item_response(self, response_format, base64_string):
         if response_format == ResponseFormat.URL:
+            # Images are uploaded concurrently, each one on a worker thread
+            started_at = time.monotonic()
+            url = await self._run_in_executor(self._generated_image_url, base64_string)
+            IMAGE_UPLOAD_LATENCY.observe(time.monotonic() - started_at, 'sagemaker')
             return {
-                'url': self._generated_image_url(base64_string),
+                'url': url,
             }
         else:
             return {
@@ -140,20 +413,37 @@ class SageMakerClient:
             }
 
     def _generated_image_url(self, base64_string):
+        started_at = time.monotonic()
+
         # Decode the base64 string
         img_data = base64.b64decode(base64_string)
 
-        # Create a PIL Image object
-        img = Image.open(BytesIO(img_data))
-
-        # Save the image to a BytesIO object
-        buffer = BytesIO()
-        img.save(buffer, format='PNG')
-        buffer.seek(0)
+        # Images that are already PNG or JPEG encoded are uploaded as they are, anything else
+        # is re-encoded to PNG
+        image_format = next(
+            (_format for _signature, _format in _IMAGE_SIGNATURES if img_data.startswith(_signature)), None
+        )
+        if image_format is None:
+            img = Image.open(BytesIO(img_data))
+            buffer = BytesIO()
+            img.save(buffer, format='PNG')
+            img_data, image_format = buffer.getvalue(), 'png'
 
         # Upload the image to S3
-        key = '{}.png'.format(str(uuid.uuid4()))
-        self.s3_client.upload_fileobj(buffer, self._bucket_name, key)
+        key = '{}.{}'.format(str(uuid.uuid4()), image_format)
+        self.s3_client.put_object(
+            Bucket=self._bucket_name,
+            Key=key,
+            Body=img_data,
+            ContentType='image/{}'.format(image_format)
+        )
+
+        logger.debug(
+            "Generated image uploaded",
+            key=key,
+            size=len(img_data),
+            duration_seconds=round(time.monotonic() - started_at, 4)
+        )
 
         # Get the URL of the uploaded image
         return self.s3_client.generate_presigned_url(
@@ -165,37 +455,42 @@ class SageMakerClient:
             ExpiresIn=self._image_url_ttl
         )
 
-    def _invoke_embeddings_endpoint(self, model, input):
+    async def _invoke_embeddings_endpoint(self, model, input, encoding_format=EncodingFormat.FLOAT):
         """
         Invoke SageMaker endpoint for embeddings
 
-        :param model: [str], name of the endpoint
+        :param model: [str], name of the endpoint or alias of an endpoint pool
         :param input: [List[str]], input text list
+        :param encoding_format: [EncodingFormat], format of the embeddings in the response
 
         :return: [ResponseEmbeddingDTO], response from the endpoint
         """
-        response = self.sagemaker_runtime_client.invoke_endpoint(
-            EndpointName=model,
-            Body=json.dumps(input),
+        inputs = input if isinstance(input, list) else [input]
+        if self._embeddings_batcher is not None:
+            embeddings = await self._embeddings_batcher.submit(model, inputs)
+        else:
+            embeddings = await self._embed(model, inputs)
+
+        return ResponseEmbeddingDTO.from_embeddings('sagemaker', model, embeddings, encoding_format=encoding_format)
+
+    async def _embed(self, model, inputs):
+        """
+        Embed a list of texts with a single invocation of the endpoint
+
+        :param model: [str], name of the endpoint or alias of an endpoint pool
+        :param inputs: [List[str]], input text list
+
+        :return: [List[List[float]]], one embedding per input text
+        """
+        response_dict = await self._invoke(
+            model,
+            Body=json.dumps(inputs),
             ContentType="application/x-text",
             CustomAttributes='accept_eula=true'
         )
-        response_dict = json.loads(response['Body'].read().decode('utf-8'))
-
-        return ResponseEmbeddingDTO(
-            object='list',
-            provider='sagemaker',
-            model=model,
-            data=[
-                {
-                    'object': 'embedding',
-                    'embedding': _embedding,
-                    'index': _index
-                } for _index, _embedding in enumerate(response_dict['embedding'])
-            ]
-        )
+        return response_dict['embedding']
 
-    def _invoke_chat_completions_endpoint(
+    async def _invoke_chat_completions_endpoint(
             self,
             model,
             messages,
@@ -207,7 +502,7 @@ class SageMakerClient:
         """
         Invoke SageMaker endpoint for chat completions
 
-        :param model: [str], name of the endpoint
+        :param model: [str], name of the endpoint or alias of an endpoint pool
         :param messages: [list[MessageItem]], list of messages
         :param temperature: [float, default=None], Controls the randomness in the output. Higher temperature results
         in output sequence with low-probability words and lower temperature results
@@ -222,6 +517,135 @@ class SageMakerClient:
 
         :return: [ResponseCompletionDTO], response from the endpoint
         """
+        payload = self._chat_completions_payload(messages, temperature, max_tokens, top_p)
+        # Only requests with the same parameters can share an invocation
+        key = (model, json.dumps(payload.get('parameters'), sort_keys=True))
+        if self._chat_batcher is not None:
+            response_dict = await self._chat_batcher.submit(key, payload['inputs'])
+        else:
+            response_dict = await self._complete_dialogs(key, payload['inputs'])
+
+        return ResponseCompletionDTO(
+            id='chatcmpl-{}'.format(str(uuid.uuid4())),
+            object='chat.completion',
+            created=int(time.time()),
+            model=model,
+            choices=[
+                ChoiceItem(
+                    index=_index,
+                    message=MessageItem(
+                        role=_choice['generation']['role'],
+                        content=_choice['generation']['content'],
+                    )
+                ) for _index, _choice in enumerate(response_dict)
+            ],
+            provider='sagemaker'
+        )
+
+    async def _complete_dialogs(self, key, dialogs):
+        """
+        Complete a list of dialogs with a single invocation of the endpoint
+
+        :param key: [Tuple[str, str]], name of the endpoint or alias of an endpoint pool, and the JSON
+        encoded parameters of the generation
+        :param dialogs: [List[List[dict]]], dialogs, as lists of messages
+
+        :return: [List[dict]], one generation per dialog
+        """
+        model, parameters = key
+        payload = {"inputs": dialogs}
+        if parameters != 'null':
+            payload['parameters'] = json.loads(parameters)
+
+        response_dict = await self._invoke(
+            model,
+            Body=json.dumps(payload),
+            ContentType="application/json",
+            CustomAttributes='accept_eula=true'
+        )
+        if len(response_dict) != len(dialogs):
+            raise ValueError('Expected {} generations from {}, got {}'.format(len(dialogs), model, len(response_dict)))
+        return response_dict
+
+    async def _stream_chat_completions_endpoint(
+            self,
+            model,
+            messages,
+            temperature=None,
+            max_tokens=None,
+            top_p=None
+    ):
+        """
+        Invoke SageMaker endpoint for chat completions and stream the generated tokens
+
+        The payload parts of the response are new-line delimited JSON lines, optionally prefixed with
+        `data:`, that carry the generated token under `token.text` and, on the last line, the finish
+        reason under `details.finish_reason`. Lines may be split across payload parts.
+
+        :param model: [str], name of the endpoint or alias of an endpoint pool
+        :param messages: [list[MessageItem]], list of messages
+        :param temperature: [float, default=None], see _invoke_chat_completions_endpoint
+        :param max_tokens: [int, default=None], see _invoke_chat_completions_endpoint
+        :param top_p: [float, default=None], see _invoke_chat_completions_endpoint
+
+        :return: [AsyncIterator[ResponseCompletionChunkDTO]], chunks of the response
+        """
+        payload = self._chat_completions_payload(messages, temperature, max_tokens, top_p)
+        payload['stream'] = True
+
+        chunk_id, created = 'chatcmpl-{}'.format(str(uuid.uuid4())), int(time.time())
+
+        def _chunk(delta, finish_reason=None):
+            return ResponseCompletionChunkDTO(
+                id=chunk_id,
+                created=created,
+                provider='sagemaker',
+                model=model,
+                choices=[ChunkChoiceItem(index=0, delta=delta, finish_reason=finish_reason)]
+            )
+
+        buffer, role_sent = b'', False
+        async for _part in self._invoke_endpoint_with_response_stream(
+            model,
+            Body=json.dumps(payload),
+            ContentType="application/json",
+            CustomAttributes='accept_eula=true'
+        ):
+            if not role_sent:
+                yield _chunk(DeltaItem(role=RoleItem.ASSISTANT))
+                role_sent = True
+            buffer += _part
+            *lines, buffer = buffer.split(b'\n')
+            for _line in lines:
+                chunk = self._parse_stream_line(_line, _chunk)
+                if chunk is not None:
+                    yield chunk
+
+        chunk = self._parse_stream_line(buffer, _chunk)
+        if chunk is not None:
+            yield chunk
+
+    @staticmethod
+    def _parse_stream_line(line, to_chunk):
+        line = line.strip()
+        if line.startswith(b'data:'):
+            line = line[len(b'data:'):].strip()
+        if not line:
+            return None
+
+        line_dict = json.loads(line.decode('utf-8'))
+        token = line_dict.get('token') or {}
+        details = line_dict.get('details') or {}
+        finish_reason = details.get('finish_reason')
+
+        text = None if token.get('special') else token.get('text')
+        if not text and not finish_reason:
+            return None
+
+        return to_chunk(DeltaItem(content=text), _FINISH_REASONS.get(finish_reason, finish_reason))
+
+    @staticmethod
+    def _chat_completions_payload(messages, temperature=None, max_tokens=None, top_p=None):
         parameters = {}
         if temperature:
             parameters["temperature"] = temperature
@@ -246,28 +670,4 @@ class SageMakerClient:
         if parameters:
             payload['parameters'] = parameters
 
-        response = self.sagemaker_runtime_client.invoke_endpoint(
-            EndpointName=model,
-            Body=json.dumps(payload),
-            ContentType="application/json",
-            CustomAttributes='accept_eula=true'
-        )
-
-        response_dict = json.loads(response['Body'].read().decode('utf-8'))
-
-        return ResponseCompletionDTO(
-            id='chatcmpl-{}'.format(str(uuid.uuid4())),
-            object='chat.completion',
-            created=int(time.time()),
-            model=model,
-            choices=[
-                ChoiceItem(
-                    index=_index,
-                    message=MessageItem(
-                        role=_choice['generation']['role'],
-                        content=_choice['generation']['content'],
-                    )
-                ) for _index, _choice in enumerate(response_dict)
-            ],
-            provider='sagemaker'
-        )
+        return payload
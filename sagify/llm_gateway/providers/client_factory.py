@@ -4,8 +4,10 @@ from sagify.llm_gateway.providers.anthropic.client import AnthropicClient
 
 
 class LLMClientFactory:
+    PROVIDERS = ["openai", "sagemaker", "anthropic"]
+
     def __init__(self, provider):
-        self._providers = ["openai", "sagemaker", "anthropic"]
+        self._providers = self.PROVIDERS
         if provider not in self._providers:
             raise ValueError(f"Invalid provider name {provider}")
         self.provider = provider
@@ -14,6 +16,9 @@ class LLMClientFactory:
         if self.provider == "openai":
             return OpenAIClient()
         if self.provider == "sagemaker":
-            return SageMakerClient()
+            client = SageMakerClient()
+            # Health checks run in the background for as long as the client is open
+            client.health_monitor.start()
+            return client
         if self.provider == "anthropic":
             return AnthropicClient()
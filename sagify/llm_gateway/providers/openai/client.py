@@ -1,10 +1,12 @@
+import httpx
 import structlog
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 import os
 
 from sagify.llm_gateway.api.v1.exceptions import InternalServerError
-from sagify.llm_gateway.schemas.chat import CreateCompletionDTO, ResponseCompletionDTO
-from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO, ResponseEmbeddingDTO
+from sagify.llm_gateway.core.resilience import resilience
+from sagify.llm_gateway.schemas.chat import CreateCompletionDTO, ResponseCompletionDTO, ResponseCompletionChunkDTO
+from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO, EncodingFormat, ResponseEmbeddingDTO
 from sagify.llm_gateway.schemas.images import CreateImageDTO, ResponseImageDTO
 
 
@@ -13,10 +15,41 @@ logger = structlog.get_logger()
 
 class OpenAIClient:
     def __init__(self):
-        self.client = OpenAI()
+        max_connections = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100))
+        policy = resilience.policy("openai")
+        # Retries and read timeouts of every model are handled by the resilience layer
+        self.client = AsyncOpenAI(
+            max_retries=0,
+            timeout=httpx.Timeout(resilience.max_read_timeout("openai"), connect=policy.connect_timeout),
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        )
         self._chat_completions_model = os.environ.get("OPENAI_CHAT_COMPLETIONS_MODEL")
         self._embeddings_model = os.environ.get("OPENAI_EMBEDDINGS_MODEL")
         self._image_creation_model = os.environ.get("OPENAI_IMAGE_CREATION_MODEL")
+        # Larger embedding requests are split into concurrent requests by the embeddings service
+        self.embeddings_max_inputs = int(os.environ.get("OPENAI_EMBEDDINGS_MAX_INPUTS", 2048)) or None
+        self.embeddings_max_bytes = int(os.environ.get("OPENAI_EMBEDDINGS_MAX_BYTES", 1000000)) or None
+        # The dimensions of the embeddings requests are passed to the model instead of reduced by the gateway
+        self.supports_embeddings_dimensions = True
+
+    def default_model(self, endpoint):
+        """
+        Model used when a request doesn't specify one
+
+        :param endpoint: [str], one of chat, embeddings or images
+
+        :return: [Optional[str]], model name
+        """
+        return {
+            "chat": self._chat_completions_model,
+            "embeddings": self._embeddings_model,
+            "images": self._image_creation_model,
+        }.get(endpoint)
+
+    async def close(self):
+        await self.client.close()
 
     async def completions(self, message: CreateCompletionDTO):
         request = {
@@ -29,7 +62,7 @@ class OpenAIClient:
             "stream": False
         }
         try:
-            response = self.client.chat.completions.create(**request)
+            response = await self.client.chat.completions.create(**request)
             response_dict = response.model_dump()
             response_dict["provider"] = message.provider
             return ResponseCompletionDTO(**response_dict)
@@ -37,16 +70,45 @@ class OpenAIClient:
             logger.error(e)
             raise InternalServerError(str(e))
 
+    async def completions_stream(self, message: CreateCompletionDTO):
+        request = {
+            "model": message.model if message.model else self._chat_completions_model,
+            "messages": message.messages,
+            "temperature": message.temperature,
+            "max_tokens": message.max_tokens,
+            "top_p": message.top_p,
+            "seed": message.seed,
+            "stream": True
+        }
+        try:
+            stream = await self.client.chat.completions.create(**request)
+            async for chunk in stream:
+                chunk_dict = chunk.model_dump()
+                chunk_dict["provider"] = message.provider
+                yield ResponseCompletionChunkDTO(**chunk_dict)
+        except Exception as e:
+            logger.error(e)
+            raise InternalServerError(str(e))
+
     async def embeddings(self, embedding_input: CreateEmbeddingDTO):
         request = {
             "model": embedding_input.model if embedding_input.model else self._embeddings_model,
             "input": embedding_input.input,
+            # Base64 encoded float32 bytes are passed through, or decoded to vectors by the embedding cache,
+            # without parsing every float. Floats are passed through in the short form OpenAI writes them.
+            "encoding_format": "base64" if embedding_input.encoding_format == EncodingFormat.BASE64 else "float",
         }
+        if embedding_input.dimensions is not None:
+            request["dimensions"] = embedding_input.dimensions
         try:
-            response = self.client.embeddings.create(**request)
-            response_dict = response.model_dump()
-            response_dict["provider"] = embedding_input.provider
-            return ResponseEmbeddingDTO(**response_dict)
+            response = await self.client.embeddings.create(**request)
+            return ResponseEmbeddingDTO.from_embeddings(
+                embedding_input.provider,
+                response.model,
+                [_item.embedding for _item in sorted(response.data, key=lambda _item: _item.index)],
+                usage=response.usage.model_dump(),
+                encoding_format=embedding_input.encoding_format
+            )
         except Exception as e:
             logger.error(e)
             raise InternalServerError(str(e))
@@ -59,11 +121,56 @@ class OpenAIClient:
             "size": f'{image_input.width}x{image_input.height}'
         }
         try:
-            response = self.client.images.generate(**request)
+            response = await self.client.images.generate(**request)
             response_dict = response.model_dump()
             response_dict["provider"] = image_input.provider
-            response_dict["model"] = image_input.model
+            response_dict["model"] = request["model"]
             return ResponseImageDTO(**response_dict)
         except Exception as e:
             logger.error(e)
             raise InternalServerError(str(e))
+
+    async def create_batch(self, requests, endpoint):
+        """
+        Submit requests to the OpenAI Batch API
+
+        :param requests: [bytes], JSONL file of requests in the OpenAI batch input format
+        :param endpoint: [str], API path of the requests, e.g. /v1/chat/completions
+
+        :return: [str], ID of the OpenAI batch
+        """
+        try:
+            input_file = await self.client.files.create(file=("batch.jsonl", requests), purpose="batch")
+            batch = await self.client.batches.create(
+                input_file_id=input_file.id, endpoint=endpoint, completion_window="24h"
+            )
+            return batch.id
+        except Exception as e:
+            logger.error(e)
+            raise InternalServerError(str(e))
+
+    async def retrieve_batch(self, batch_id):
+        """
+        :param batch_id: [str], ID of an OpenAI batch
+
+        :return: [dict], status, request counts and output file ID of the batch
+        """
+        try:
+            batch = await self.client.batches.retrieve(batch_id)
+            return batch.model_dump()
+        except Exception as e:
+            logger.error(e)
+            raise InternalServerError(str(e))
+
+    async def batch_output(self, file_id):
+        """
+        :param file_id: [str], ID of the output file of an OpenAI batch
+
+        :return: [bytes], JSONL file of the responses
+        """
+        try:
+            content = await self.client.files.content(file_id)
+            return await content.aread()
+        except Exception as e:
+            logger.error(e)
+            raise InternalServerError(str(e))
@@ -0,0 +1,67 @@
+import structlog
+
+from sagify.llm_gateway.providers.client_factory import LLMClientFactory
+
+
+logger = structlog.get_logger()
+
+
+class LLMClientRegistry:
+    """
+    Process-wide registry of LLM provider clients.
+
+    Each provider client is created once and reused for the life of the process, so that its
+    HTTP connection pool is shared between requests instead of being rebuilt on every call.
+    """
+    def __init__(self, providers=None):
+        self._providers = providers if providers is not None else LLMClientFactory.PROVIDERS
+        self._clients = {}
+
+    async def startup(self):
+        """
+        Create the clients of all providers. Providers that are not configured (e.g. missing
+        credentials) are skipped here and will be retried on first use.
+        """
+        for _provider in self._providers:
+            try:
+                await self.get(_provider)
+            except Exception as e:
+                logger.warning("Provider client not created on startup", provider=_provider, error=str(e))
+
+    async def get(self, provider):
+        """
+        Return the shared client of the given provider, creating it on first use
+
+        :param provider: [str], provider name
+
+        :return: provider client
+        """
+        client = self._clients.get(provider)
+        if client is None:
+            client = await LLMClientFactory(provider).create_client()
+            self._clients[provider] = client
+        return client
+
+    def health(self):
+        """
+        Health of the upstreams of the clients created so far, for the clients that track it
+
+        :return: [dict], health by provider
+        """
+        return {
+            _provider: _client.health() for _provider, _client in self._clients.items() if hasattr(_client, "health")
+        }
+
+    async def shutdown(self):
+        """
+        Close all the clients and release their connection pools
+        """
+        clients, self._clients = self._clients, {}
+        for _provider, _client in clients.items():
+            try:
+                await _client.close()
+            except Exception as e:
+                logger.warning("Provider client not closed cleanly", provider=_provider, error=str(e))
+
+
+registry = LLMClientRegistry()
@@ -0,0 +1,27 @@
+from enum import Enum
+from typing import Optional
+from pydantic import BaseModel
+
+
+class BatchStatus(str, Enum):
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class RequestCountsItem(BaseModel):
+    total: int
+    completed: int
+    failed: int
+
+
+class ResponseBatchDTO(BaseModel):
+    id: str
+    object: str
+    status: BatchStatus
+    created_at: int
+    completed_at: Optional[int]
+    request_counts: RequestCountsItem
+    output_url: Optional[str]
+    provider_batch_id: Optional[str]
+    error: Optional[str]
@@ -1,6 +1,6 @@
 from enum import Enum
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 from sagify.llm_gateway.schemas import Usage
 
@@ -24,6 +24,7 @@ class CreateCompletionDTO(BaseModel):
     max_tokens: int
     top_p: Optional[float]
     seed: Optional[int]
+    stream: Optional[bool] = False
 
 
 class ChoiceItem(BaseModel):
@@ -41,5 +42,28 @@ class ResponseCompletionDTO(BaseModel):
     choices: List[ChoiceItem]
     usage: Optional[Usage]
 
+    # Set by the hedger on responses of fallback targets, which the caches don't keep under the requested target
+    _served_by_fallback: bool = PrivateAttr(default=False)
+
     class Config:
         populate_by_name = True
+
+
+class DeltaItem(BaseModel):
+    role: Optional[RoleItem] = None
+    content: Optional[str] = None
+
+
+class ChunkChoiceItem(BaseModel):
+    index: int
+    delta: DeltaItem
+    finish_reason: Optional[str] = None
+
+
+class ResponseCompletionChunkDTO(BaseModel):
+    id: str
+    object: str = 'chat.completion.chunk'
+    created: int
+    provider: str
+    model: str
+    choices: List[ChunkChoiceItem]
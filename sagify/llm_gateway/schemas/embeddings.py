@@ -1,13 +1,26 @@
+import base64
+from enum import Enum
+import json
 from typing import List, Optional, Union
-from pydantic import BaseModel
+
+import numpy as np
+import orjson
+from pydantic import BaseModel, PrivateAttr
 
 from sagify.llm_gateway.schemas import Usage
 
 
+class EncodingFormat(str, Enum):
+    FLOAT = "float"
+    BASE64 = "base64"
+
+
 class CreateEmbeddingDTO(BaseModel):
     provider: str
     model: Optional[str]
     input: Union[List[str], str]
+    encoding_format: Optional[EncodingFormat] = EncodingFormat.FLOAT
+    dimensions: Optional[int] = None
 
 
 class EmbeddingItem(BaseModel):
@@ -18,7 +31,7 @@ class EmbeddingItem(BaseModel):
 
 class DataItem(BaseModel):
     object: str
-    embedding: List[float]
+    embedding: Union[List[float], str]
     index: int
 
 
@@ -28,3 +41,99 @@ class ResponseEmbeddingDTO(BaseModel):
     model: str
     object: str
     usage: Optional[Usage]
+
+    # Set by the hedger on responses of fallback targets, which the caches don't keep under the requested target
+    _served_by_fallback: bool = PrivateAttr(default=False)
+
+    @classmethod
+    def from_embeddings(cls, provider, model, embeddings, usage=None, encoding_format=EncodingFormat.FLOAT):
+        """
+        Build a response without validating every float of the embeddings, which costs more than
+        the rest of the request for large batches
+
+        :param provider: [str], provider name
+        :param model: [str], model name
+        :param embeddings: [Iterable[Union[List[float], np.ndarray, str]]], embeddings in input order,
+        as floats or base64 encoded little-endian float32 bytes
+        :param usage: [Optional[dict]], token usage
+        :param encoding_format: [EncodingFormat], format of the embeddings in the response
+
+        :return: [ResponseEmbeddingDTO], response
+        """
+        return cls.construct(
+            object='list',
+            provider=provider,
+            model=model,
+            usage=Usage(**usage) if isinstance(usage, dict) else usage,
+            data=[
+                DataItem.construct(object='embedding', embedding=encode_embedding(_embedding, encoding_format), index=_index)
+                for _index, _embedding in enumerate(embeddings)
+            ]
+        )
+
+
+def encode_embedding(embedding, encoding_format):
+    """
+    :param embedding: [Union[List[float], np.ndarray, str]], embedding as floats or base64 encoded
+    little-endian float32 bytes
+    :param encoding_format: [EncodingFormat], format to encode the embedding in
+
+    :return: [Union[List[float], str]], encoded embedding
+    """
+    if encoding_format == EncodingFormat.BASE64:
+        if isinstance(embedding, str):
+            return embedding
+        return base64.b64encode(np.asarray(embedding, dtype='<f4').tobytes()).decode('ascii')
+    if isinstance(embedding, (str, np.ndarray)):
+        return float32_list(decode_embedding(embedding))
+    return embedding
+
+
+def input_size(text):
+    """
+    :param text: [str], input text of an embeddings request
+
+    :return: [int], bytes the text takes in the JSON list of inputs sent upstream, where non-ASCII
+    characters are escaped, e.g. as \\u0436, with its separator
+    """
+    return len(json.dumps(text)) + 2
+
+
+def float32_list(vector):
+    """
+    Convert a float32 vector to floats that are serialized in the shortest representation of their
+    float32 value, e.g. 0.012345679 instead of the 0.012345678918063641 of the widened float64
+
+    :param vector: [np.ndarray], float32 vector
+
+    :return: [List[float]], floats of the vector
+    """
+    return orjson.loads(orjson.dumps(np.ascontiguousarray(vector, dtype=np.float32), option=orjson.OPT_SERIALIZE_NUMPY))
+
+
+def decode_embedding(embedding):
+    """
+    :param embedding: [Union[List[float], np.ndarray, str]], embedding as floats or base64 encoded
+    little-endian float32 bytes
+
+    :return: [np.ndarray], embedding as float32 vector
+    """
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype='<f4')
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def reduce_dimensions(embeddings, dimensions):
+    """
+    Shorten embeddings to their first dimensions and L2 normalize them again, which is how the
+    embeddings of models trained for it, e.g. text-embedding-3, are shortened
+
+    :param embeddings: [np.ndarray], float32 matrix with one embedding per row
+    :param dimensions: [int], number of dimensions to keep
+
+    :return: [np.ndarray], float32 matrix with unit length rows of the given number of dimensions
+    """
+    truncated = embeddings[:, :dimensions]
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    # Zero vectors are kept as they are instead of being divided by zero
+    return truncated / np.where(norms > 0, norms, 1).astype(np.float32)
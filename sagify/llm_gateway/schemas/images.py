@@ -1,6 +1,6 @@
 from enum import Enum
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 
 
 class ResponseFormat(str, Enum):
@@ -33,3 +33,22 @@ class ResponseImageDTO(BaseModel):
     model: str
     created: int
     data: List[DataItem]
+
+    # Set by the hedger on responses of fallback targets, which the caches don't keep under the requested target
+    _served_by_fallback: bool = PrivateAttr(default=False)
+
+
+class ImageJobStatus(str, Enum):
+    IN_PROGRESS = "in_progress"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class ResponseImageJobDTO(BaseModel):
+    id: str
+    object: str
+    status: ImageJobStatus
+    created_at: int
+    completed_at: Optional[int]
+    result: Optional[ResponseImageDTO]
+    error: Optional[str]
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import os
+import uuid
+
+from fastapi.exceptions import HTTPException
+from pydantic import ValidationError
+import structlog
+
+from sagify.llm_gateway.api.v1.exceptions import BadRequestError
+from sagify.llm_gateway.core.audit import audit_record
+from sagify.llm_gateway.core.jobs import job_store
+from sagify.llm_gateway.core.metrics import request_labels
+from sagify.llm_gateway.providers.client_factory import LLMClientFactory
+from sagify.llm_gateway.providers.registry import registry
+from sagify.llm_gateway.schemas.chat import CreateCompletionDTO
+from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO
+from sagify.llm_gateway.services import chat, embeddings
+
+logger = structlog.get_logger()
+
+_ENDPOINTS = {
+    "/v1/chat/completions": (CreateCompletionDTO, chat.completions),
+    "/v1/embeddings": (CreateEmbeddingDTO, embeddings.embeddings),
+}
+
+_NATIVE_STATUSES = {
+    "completed": "completed",
+    "failed": "failed",
+    "expired": "failed",
+    "cancelled": "failed",
+}
+
+
+class _BatchOutput:
+    """
+    Output file of a batch, whose lines are written off the event loop in chunks
+    """
+    def __init__(self, store, job, chunk_size):
+        self._store = store
+        self._job = job
+        self._chunk_size = chunk_size
+        self._lines = []
+
+    async def add(self, result):
+        self._lines.append(json.dumps(result) + "\n")
+        if len(self._lines) >= self._chunk_size:
+            await self.flush()
+
+    async def flush(self):
+        if not self._lines:
+            return
+        content, self._lines = "".join(self._lines), []
+        await self._store.write(self._job.id, ".jsonl", content, append=True)
+        await self._store.save(self._job)
+
+
+class BatchProcessor:
+    """
+    Runs batches of chat completion and embedding requests in the background, with bounded
+    concurrency per provider and retries, and writes their responses to a JSONL output file.
+    Batches of OpenAI requests can instead be passed through to the OpenAI Batch API.
+    """
+    def __init__(self, store, max_concurrency=8, max_retries=3, retry_delay=1.0, output_chunk_size=100):
+        """
+        :param store: [JobStore], store of the batch jobs
+        :param max_concurrency: [int], number of requests of all batches in flight per provider
+        :param max_retries: [int], number of retries of a request that failed with a server error
+        :param retry_delay: [float], seconds before the first retry, doubled on every retry
+        :param output_chunk_size: [int], number of responses written to the output file at once
+        """
+        self._store = store
+        self._output_chunk_size = output_chunk_size
+        self._max_concurrency = max_concurrency
+        self._max_retries = max_retries
+        self._retry_delay = retry_delay
+        self._semaphores = {}
+        self._tasks = set()
+
+    @staticmethod
+    def parse(requests):
+        """
+        :param requests: [bytes], JSONL file of requests in the OpenAI batch input format, with the
+        request DTOs of the gateway as bodies
+
+        :return: [List[dict]], requests
+        """
+        lines = []
+        for _number, _line in enumerate(requests.splitlines(), start=1):
+            if not _line.strip():
+                continue
+            try:
+                line = json.loads(_line)
+            except ValueError:
+                raise BadRequestError(f"Line {_number} is not valid JSON")
+            if not isinstance(line, dict) or "custom_id" not in line or not isinstance(line.get("body"), dict):
+                raise BadRequestError(f"Line {_number} must have a custom_id and a body")
+            if line.get("url") not in _ENDPOINTS:
+                raise BadRequestError(f"Line {_number} has an unsupported url, use one of {', '.join(_ENDPOINTS)}")
+            lines.append(line)
+        if not lines:
+            raise BadRequestError("The batch has no requests")
+        return lines
+
+    async def submit(self, requests, native=False):
+        """
+        Start a batch job
+
+        :param requests: [bytes], JSONL file of requests, see parse
+        :param native: [bool], pass the batch through to the OpenAI Batch API
+
+        :return: [Job], batch job
+        """
+        lines = self.parse(requests)
+        if native:
+            return await self._submit_native(lines)
+
+        job = await self._store.create("batch", total=len(lines))
+        task = asyncio.ensure_future(self._run(job, lines))
+        # Tasks are referenced until they finish, so that they aren't garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    async def _submit_native(self, lines):
+        urls = {_line["url"] for _line in lines}
+        if len(urls) > 1 or any(_line["body"].get("provider") != "openai" for _line in lines):
+            raise BadRequestError("Native batches must only have OpenAI requests to the same url")
+
+        url = urls.pop()
+        llm_client = await registry.get("openai")
+        native_lines = []
+        for _line in lines:
+            body = {_key: _value for _key, _value in _line["body"].items() if _key != "provider" and _value is not None}
+            body["model"] = body.get("model") or llm_client.default_model(
+                "chat" if url == "/v1/chat/completions" else "embeddings"
+            )
+            native_lines.append(json.dumps({"custom_id": _line["custom_id"], "method": "POST", "url": url, "body": body}))
+
+        provider_batch_id = await llm_client.create_batch("\n".join(native_lines).encode("utf-8"), url)
+        return await self._store.create("batch", total=len(lines), metadata={"provider_batch_id": provider_batch_id})
+
+    async def refresh(self, job):
+        """
+        Update the status of a batch that was passed through to the OpenAI Batch API and download its
+        output once it's done
+
+        :param job: [Job], batch job
+
+        :return: [Job], updated batch job
+        """
+        provider_batch_id = job.metadata.get("provider_batch_id")
+        if provider_batch_id is None or job.done:
+            return job
+
+        llm_client = await registry.get("openai")
+        batch = await llm_client.retrieve_batch(provider_batch_id)
+        counts = batch.get("request_counts") or {}
+        job.completed, job.failed = counts.get("completed", 0), counts.get("failed", 0)
+
+        status = _NATIVE_STATUSES.get(batch["status"])
+        if status == "completed" and batch.get("output_file_id"):
+            await self._store.write(job.id, ".jsonl", await llm_client.batch_output(batch["output_file_id"]))
+        if status is not None:
+            job.finish(status, error=None if status == "completed" else f"OpenAI batch {batch['status']}")
+        await self._store.save(job, force=True)
+        return job
+
+    async def _run(self, job, lines):
+        # Requests of the batch aren't part of the request that submitted it
+        request_labels.set(None)
+        audit_record.set(None)
+        by_provider = {}
+        for _line in lines:
+            by_provider.setdefault(_line["body"].get("provider"), []).append(_line)
+
+        output = _BatchOutput(self._store, job, self._output_chunk_size)
+        try:
+            await self._store.write(job.id, ".jsonl", "")
+            await asyncio.gather(*[
+                self._run_provider(job, output, _provider, _lines) for _provider, _lines in by_provider.items()
+            ])
+            await output.flush()
+            job.finish("completed")
+        except Exception as e:
+            logger.error(e)
+            job.finish("failed", error=str(e))
+        await self._store.save(job, force=True)
+
+    async def _run_provider(self, job, output, provider, lines):
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = self._semaphores[provider] = asyncio.Semaphore(self._max_concurrency)
+        pending = iter(lines)
+
+        async def _worker():
+            for _line in pending:
+                async with semaphore:
+                    result = await self._process(_line)
+                if result["error"] is None:
+                    job.completed += 1
+                else:
+                    job.failed += 1
+                await output.add(result)
+
+        await asyncio.gather(*[_worker() for _ in range(min(self._max_concurrency, len(lines)))])
+
+    async def _process(self, line):
+        request_class, service = _ENDPOINTS[line["url"]]
+        result = {"id": "batch_req_{}".format(uuid.uuid4().hex), "custom_id": line["custom_id"], "response": None, "error": None}
+        try:
+            request = request_class(**line["body"])
+        except ValidationError as e:
+            result["error"] = {"code": 400, "message": str(e)}
+            return result
+        # Unknown providers would fail every attempt, as errors that look like upstream ones
+        if request.provider not in LLMClientFactory.PROVIDERS:
+            result["error"] = {"code": 400, "message": f"Invalid provider name {request.provider}"}
+            return result
+
+        for _attempt in range(self._max_retries + 1):
+            try:
+                response = await service(request)
+                result["response"] = {"status_code": 200, "body": response.dict()}
+                result["error"] = None
+                return result
+            except HTTPException as e:
+                result["error"] = {"code": e.status_code, "message": e.detail}
+                retryable = e.status_code == 429 or e.status_code >= 500
+            except Exception as e:
+                result["error"] = {"code": 500, "message": str(e)}
+                retryable = True
+            if not retryable or _attempt == self._max_retries:
+                break
+            await asyncio.sleep(self._retry_delay * 2 ** _attempt)
+        return result
+
+
+batch_processor = BatchProcessor(
+    job_store,
+    max_concurrency=int(os.environ.get("BATCH_MAX_CONCURRENCY", 8)),
+    max_retries=int(os.environ.get("BATCH_MAX_RETRIES", 3)),
+    retry_delay=float(os.environ.get("BATCH_RETRY_DELAY_MS", 1000)) / 1000
+)
@@ -0,0 +1,222 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import structlog
+
+from sagify.llm_gateway.core.metrics import CACHE_REQUESTS
+
+
+logger = structlog.get_logger()
+
+ENDPOINTS = ["chat", "embeddings", "images"]
+
+
+class MemoryCacheBackend:
+    """
+    In-memory LRU cache with a TTL per entry, bounded by its number of entries and optionally by the
+    size of the responses, which for images can be megabytes each
+    """
+    def __init__(self, max_entries=1024, ttl=3600, clock=time.time, max_bytes=None):
+        """
+        :param max_entries: [int], maximum number of entries
+        :param ttl: [float], seconds an entry is served for
+        :param clock: [Callable[[], float]], current time in seconds
+        :param max_bytes: [Optional[int]], maximum JSON size of the responses, unlimited if None
+        """
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value, _ = entry
+        if expires_at <= self._clock():
+            self._evict(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        size = len(value.json()) if self._max_bytes is not None else 0
+        if key in self._entries:
+            self._evict(key)
+        # A response that doesn't fit at all would only evict every other entry
+        if self._max_bytes is not None and size > self._max_bytes:
+            return
+
+        self._entries[key] = (self._clock() + self._ttl, value, size)
+        self._bytes += size
+        while len(self._entries) > self._max_entries or (self._max_bytes is not None and self._bytes > self._max_bytes):
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DiskCacheBackend:
+    """
+    SQLite backed cache with a TTL per entry that survives restarts. Responses are stored as
+    JSON text and read back as dicts. Reads and writes happen off the event loop.
+    """
+    def __init__(self, path, max_entries=100000, ttl=3600, clock=time.time):
+        self._path = path
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._clock = clock
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires_at REAL, value TEXT)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _get(self, key):
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, self._clock())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, key, value):
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, self._clock() + self._ttl, value.json())
+            )
+            connection.execute("DELETE FROM cache WHERE expires_at <= ?", (self._clock(),))
+            excess = connection.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self._max_entries
+            if excess > 0:
+                connection.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at LIMIT ?)", (excess,)
+                )
+            connection.commit()
+
+    async def get(self, key):
+        return await asyncio.get_running_loop().run_in_executor(None, self._get, key)
+
+    async def set(self, key, value):
+        await asyncio.get_running_loop().run_in_executor(None, self._set, key, value)
+
+
+class ResponseCache:
+    """
+    Cache of gateway responses to deterministic requests, keyed by a canonical hash of the provider,
+    the resolved model and the normalized request
+    """
+    def __init__(self, backend, disabled_endpoints=()):
+        self._backend = backend
+        self._disabled_endpoints = set(disabled_endpoints)
+        self._stats = {_endpoint: {"hits": 0, "misses": 0} for _endpoint in ENDPOINTS}
+
+    def enabled(self, endpoint):
+        return self._backend is not None and endpoint not in self._disabled_endpoints
+
+    @staticmethod
+    def key(endpoint, provider, model, request):
+        """
+        Canonical key of a request
+
+        :param endpoint: [str], one of chat, embeddings or images
+        :param provider: [str], provider name
+        :param model: [str], resolved model name
+        :param request: [BaseModel], request DTO
+
+        :return: [str], hex digest of the request
+        """
+        normalized = request.dict(exclude={"provider", "model", "stream"})
+        canonical = json.dumps(
+            [endpoint, provider, model, normalized],
+            sort_keys=True,
+            separators=(",", ":"),
+            default=str
+        )
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    async def get_or_call(self, endpoint, key, response_class, call):
+        """
+        Return the cached response of the given key, or call upstream and cache its response
+
+        :param endpoint: [str], one of chat, embeddings or images
+        :param key: [str], key of the request
+        :param response_class: [Type[BaseModel]], response DTO class
+        :param call: [Callable[[], Awaitable[BaseModel]]], upstream call
+
+        :return: [BaseModel], response DTO
+        """
+        try:
+            cached = await self._backend.get(key)
+        except Exception as e:
+            logger.warning("Response cache read failed", error=str(e))
+            cached = None
+
+        if cached is not None:
+            self._stats[endpoint]["hits"] += 1
+            CACHE_REQUESTS.inc("response", endpoint, "hit")
+            return cached if isinstance(cached, response_class) else response_class(**cached)
+
+        self._stats[endpoint]["misses"] += 1
+        CACHE_REQUESTS.inc("response", endpoint, "miss")
+        response = await call()
+        # The key is of the requested target, which didn't serve the responses of fallback targets
+        if response._served_by_fallback:
+            return response
+        try:
+            await self._backend.set(key, response)
+        except Exception as e:
+            logger.warning("Response cache write failed", error=str(e))
+        return response
+
+    def stats(self):
+        return {_endpoint: dict(_stats) for _endpoint, _stats in self._stats.items()}
+
+
+def create_response_cache():
+    """
+    Create the response cache from the CACHE_* env variables
+    """
+    backend_name = os.environ.get("CACHE_BACKEND", "memory")
+    max_entries = int(os.environ.get("CACHE_MAX_ENTRIES", 1024))
+    max_bytes = int(float(os.environ.get("CACHE_MAX_SIZE_IN_MB", 256)) * 1024 * 1024)
+    ttl = float(os.environ.get("CACHE_TTL_IN_SECONDS", 3600))
+    disabled_endpoints = [
+        _endpoint.strip() for _endpoint in os.environ.get("CACHE_DISABLED_ENDPOINTS", "").split(",") if _endpoint.strip()
+    ]
+
+    if backend_name == "memory":
+        backend = MemoryCacheBackend(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes)
+    elif backend_name == "disk":
+        backend = DiskCacheBackend(
+            os.environ.get("CACHE_DISK_PATH", ".sagify_llm_gateway_cache.sqlite"), max_entries=max_entries, ttl=ttl
+        )
+    elif backend_name == "none":
+        backend = None
+    else:
+        raise ValueError(f"Invalid cache backend {backend_name}")
+
+    return ResponseCache(backend, disabled_endpoints)
+
+
+response_cache = create_response_cache()
@@ -1,8 +1,59 @@
-from sagify.llm_gateway.schemas.chat import CreateCompletionDTO
-from sagify.llm_gateway.providers.client_factory import LLMClientFactory
+from sagify.llm_gateway.core.metrics import set_request_labels
+from sagify.llm_gateway.core.rate_limit import estimate_tokens, rate_limiter
+from sagify.llm_gateway.core.singleflight import singleflight
+from sagify.llm_gateway.schemas.chat import CreateCompletionDTO, ResponseCompletionDTO
+from sagify.llm_gateway.providers.registry import registry
+from sagify.llm_gateway.services import upstream
+from sagify.llm_gateway.services.cache import response_cache
+from sagify.llm_gateway.services.hedging import hedger
+from sagify.llm_gateway.services.semantic_cache import semantic_cache
 
 
 async def completions(message: CreateCompletionDTO):
-    llm_client = await LLMClientFactory(message.provider).create_client()
+    llm_client = await registry.get(message.provider)
+    model = message.model or llm_client.default_model("chat")
+    set_request_labels(message.provider, model)
+    await _admit(message, model)
 
-    return await llm_client.completions(message)
+    def _call():
+        return hedger.call("chat", message, model, _completions)
+
+    def _deterministic_call():
+        # Identical deterministic requests get the same response, so concurrent ones share a single call
+        if not _is_deterministic(message):
+            return _call()
+        key = response_cache.key("chat", message.provider, model, message)
+        if not response_cache.enabled("chat"):
+            return singleflight.do("chat", key, _call)
+        return singleflight.do(
+            "chat", key, lambda: response_cache.get_or_call("chat", key, ResponseCompletionDTO, _call)
+        )
+
+    if not semantic_cache.enabled:
+        return await _deterministic_call()
+    return await semantic_cache.get_or_call(message, model, _deterministic_call)
+
+
+async def completions_stream(message: CreateCompletionDTO):
+    llm_client = await registry.get(message.provider)
+    model = message.model or llm_client.default_model("chat")
+    await _admit(message, model)
+
+    async for chunk in upstream.stream("chat", message.provider, model, llm_client.completions_stream(message)):
+        yield chunk
+
+
+async def _admit(message: CreateCompletionDTO, model):
+    if rate_limiter.enabled:
+        tokens = estimate_tokens([_message.content for _message in message.messages], message.max_tokens)
+        await rate_limiter.admit("chat", message.provider, tokens, model)
+
+
+async def _completions(message: CreateCompletionDTO):
+    llm_client = await registry.get(message.provider)
+    model = message.model or llm_client.default_model("chat")
+    return await upstream.call("chat", message.provider, model, lambda: llm_client.completions(message))
+
+
+def _is_deterministic(message: CreateCompletionDTO):
+    return message.temperature == 0 or message.seed is not None
@@ -0,0 +1,157 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import structlog
+
+from sagify.llm_gateway.core.metrics import CACHE_REQUESTS
+
+
+logger = structlog.get_logger()
+
+
+class EmbeddingStore:
+    """
+    SQLite backed store of embedding vectors, kept as little-endian float32 blobs
+    """
+    def __init__(self, path):
+        self._path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._connection.commit()
+        return self._connection
+
+    def get_many(self, keys):
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT key, vector FROM embeddings WHERE key IN ({})".format(", ".join("?" * len(keys))), keys
+            ).fetchall()
+        return {_key: np.frombuffer(_vector, dtype="<f4") for _key, _vector in rows}
+
+    def set_many(self, items):
+        with self._lock:
+            connection = self._connect()
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(_key, _vector.astype("<f4").tobytes()) for _key, _vector in items]
+            )
+            connection.commit()
+
+
+class EmbeddingCache:
+    """
+    Cache of embedding vectors per (provider, model, text), bounded by the memory footprint of
+    the vectors. Vectors are kept as float32 arrays and the least recently used ones are evicted
+    first. An optional persistent store backs the in-memory cache.
+    """
+    # Approximate memory overhead of an entry on top of the vector data: key, array header, dict slot
+    ENTRY_OVERHEAD_BYTES = 250
+
+    def __init__(self, max_bytes, store=None):
+        self._max_bytes = max_bytes
+        self._store = store
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self._max_bytes > 0
+
+    @staticmethod
+    def key(provider, model, text, dimensions=None):
+        # Full embeddings keep the keys they had before dimensions could be requested
+        parts = [provider, model or "", text] + ([str(dimensions)] if dimensions is not None else [])
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    async def get_many(self, keys):
+        """
+        Look up the vectors of the given keys
+
+        :param keys: [List[str]], keys of the texts
+
+        :return: [List[Optional[np.ndarray]]], vectors in the order of the keys, None for misses
+        """
+        vectors = [self._get(_key) for _key in keys]
+
+        missing_keys = [_key for _key, _vector in zip(keys, vectors) if _vector is None]
+        if self._store is not None and missing_keys:
+            try:
+                stored = await asyncio.get_running_loop().run_in_executor(
+                    None, self._store.get_many, list(set(missing_keys))
+                )
+            except Exception as e:
+                logger.warning("Embedding store read failed", error=str(e))
+                stored = {}
+            for _key, _vector in stored.items():
+                self._set(_key, _vector)
+            vectors = [_vector if _vector is not None else stored.get(_key) for _key, _vector in zip(keys, vectors)]
+
+        hits = sum(1 for _vector in vectors if _vector is not None)
+        self.hits += hits
+        self.misses += len(vectors) - hits
+        CACHE_REQUESTS.inc("embedding", "embeddings", "hit", amount=hits)
+        CACHE_REQUESTS.inc("embedding", "embeddings", "miss", amount=len(vectors) - hits)
+        return vectors
+
+    async def set_many(self, keys, vectors):
+        """
+        Cache the given vectors
+
+        :param keys: [List[str]], keys of the texts
+        :param vectors: [np.ndarray], float32 matrix with one row per key
+        """
+        items = list(zip(keys, vectors))
+        for _key, _vector in items:
+            self._set(_key, _vector)
+
+        if self._store is not None:
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._store.set_many, items)
+            except Exception as e:
+                logger.warning("Embedding store write failed", error=str(e))
+
+    def _get(self, key):
+        vector = self._entries.get(key)
+        if vector is not None:
+            self._entries.move_to_end(key)
+        return vector
+
+    def _set(self, key, vector):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+
+        # Copy the row so that the cache doesn't keep the whole response matrix alive
+        vector = np.array(vector, dtype=np.float32)
+        self._entries[key] = vector
+        self._bytes += vector.nbytes + self.ENTRY_OVERHEAD_BYTES
+        while self._bytes > self._max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes + self.ENTRY_OVERHEAD_BYTES
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._bytes}
+
+
+def create_embedding_cache():
+    """
+    Create the embedding cache from the EMBEDDING_CACHE_* env variables
+    """
+    max_bytes = int(float(os.environ.get("EMBEDDING_CACHE_MAX_SIZE_IN_MB", 256)) * 1024 * 1024)
+    disk_path = os.environ.get("EMBEDDING_CACHE_DISK_PATH")
+
+    return EmbeddingCache(max_bytes, store=EmbeddingStore(disk_path) if disk_path else None)
+
+
+embedding_cache = create_embedding_cache()
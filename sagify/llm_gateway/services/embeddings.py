@@ -1,8 +1,203 @@
-from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO
-from sagify.llm_gateway.providers.client_factory import LLMClientFactory
+import asyncio
+import os
 
+import numpy as np
 
-async def embeddings(embedding_input: CreateEmbeddingDTO):
-    llm_client = await LLMClientFactory(embedding_input.provider).create_client()
+from sagify.llm_gateway.api.v1.exceptions import BadRequestError
+from sagify.llm_gateway.core.metrics import set_request_labels
+from sagify.llm_gateway.core.rate_limit import estimate_tokens, rate_limiter
+from sagify.llm_gateway.core.singleflight import singleflight
+from sagify.llm_gateway.schemas.embeddings import (
+    CreateEmbeddingDTO,
+    EncodingFormat,
+    ResponseEmbeddingDTO,
+    decode_embedding,
+    input_size,
+    reduce_dimensions
+)
+from sagify.llm_gateway.schemas import Usage
+from sagify.llm_gateway.providers.registry import registry
+from sagify.llm_gateway.services import upstream
+from sagify.llm_gateway.services.cache import response_cache
+from sagify.llm_gateway.services.embedding_cache import embedding_cache
+from sagify.llm_gateway.services.hedging import hedger
 
-    return await llm_client.embeddings(embedding_input)
+
+# Number of chunks of an oversized embeddings request in flight at the same time
+CHUNK_MAX_CONCURRENCY = int(os.environ.get("EMBEDDINGS_CHUNK_MAX_CONCURRENCY", 4))
+
+
+async def embeddings(embedding_input: CreateEmbeddingDTO, rate_limited=True):
+    """
+    :param embedding_input: [CreateEmbeddingDTO], embeddings request
+    :param rate_limited: [bool], whether the request is admitted by the rate limits, which the internal
+    requests of the gateway, e.g. of the semantic cache, aren't
+
+    :return: [ResponseEmbeddingDTO], embeddings
+    """
+    if embedding_input.dimensions is not None and embedding_input.dimensions < 1:
+        raise BadRequestError("dimensions must be a positive number")
+    llm_client = await registry.get(embedding_input.provider)
+    model = embedding_input.model or llm_client.default_model("embeddings")
+    set_request_labels(embedding_input.provider, model)
+    if rate_limited and rate_limiter.enabled:
+        texts = embedding_input.input if isinstance(embedding_input.input, list) else [embedding_input.input]
+        await rate_limiter.admit("embeddings", embedding_input.provider, estimate_tokens(texts), model)
+
+    key = response_cache.key("embeddings", embedding_input.provider, model, embedding_input)
+    if embedding_cache.enabled:
+        return await singleflight.do("embeddings", key, lambda: _cached_embeddings(embedding_input, model))
+
+    def _call():
+        return hedger.call("embeddings", embedding_input, model, _embeddings)
+
+    if not response_cache.enabled("embeddings"):
+        return await singleflight.do("embeddings", key, _call)
+    return await singleflight.do(
+        "embeddings", key, lambda: response_cache.get_or_call("embeddings", key, ResponseEmbeddingDTO, _call)
+    )
+
+
+async def _embeddings(embedding_input: CreateEmbeddingDTO):
+    llm_client = await registry.get(embedding_input.provider)
+    model = embedding_input.model or llm_client.default_model("embeddings")
+    response = await _chunked_embeddings(llm_client, model, embedding_input)
+    if (
+            embedding_input.dimensions is None or not response.data or
+            getattr(llm_client, "supports_embeddings_dimensions", False)
+    ):
+        return response
+
+    # Providers without a dimensions parameter return full embeddings, which are shortened all at once
+    vectors = np.stack(
+        [decode_embedding(_item.embedding) for _item in sorted(response.data, key=lambda _item: _item.index)]
+    )
+    if embedding_input.dimensions > vectors.shape[1]:
+        raise BadRequestError(f"dimensions must be at most {vectors.shape[1]} for model {model}")
+    return ResponseEmbeddingDTO.from_embeddings(
+        response.provider,
+        response.model,
+        reduce_dimensions(vectors, embedding_input.dimensions),
+        usage=response.usage,
+        encoding_format=embedding_input.encoding_format
+    )
+
+
+async def _chunked_embeddings(llm_client, model, embedding_input: CreateEmbeddingDTO):
+    texts = embedding_input.input if isinstance(embedding_input.input, list) else [embedding_input.input]
+    chunks = _chunks(
+        texts, getattr(llm_client, "embeddings_max_inputs", None), getattr(llm_client, "embeddings_max_bytes", None)
+    )
+    if len(chunks) <= 1:
+        return await upstream.call(
+            "embeddings", embedding_input.provider, model, lambda: llm_client.embeddings(embedding_input)
+        )
+
+    semaphore = asyncio.Semaphore(CHUNK_MAX_CONCURRENCY)
+
+    async def _embed_chunk(chunk):
+        chunk_input = embedding_input.copy(update={"input": chunk})
+        async with semaphore:
+            return await upstream.call(
+                "embeddings", embedding_input.provider, model, lambda: llm_client.embeddings(chunk_input)
+            )
+
+    tasks = [asyncio.ensure_future(_embed_chunk(_chunk)) for _chunk in chunks]
+    try:
+        responses = await asyncio.gather(*tasks)
+    except BaseException:
+        # The other chunks are useless once one of them failed
+        for _task in tasks:
+            _task.cancel()
+        raise
+
+    usages = [_response.usage for _response in responses]
+    return ResponseEmbeddingDTO.from_embeddings(
+        embedding_input.provider,
+        responses[0].model,
+        [
+            _item.embedding
+            for _response in responses
+            for _item in sorted(_response.data, key=lambda _item: _item.index)
+        ],
+        usage=Usage(
+            prompt_tokens=sum(_usage.prompt_tokens for _usage in usages),
+            total_tokens=sum(_usage.total_tokens for _usage in usages)
+        ) if all(_usage is not None for _usage in usages) else None,
+        encoding_format=embedding_input.encoding_format
+    )
+
+
+def _chunks(texts, max_inputs=None, max_bytes=None):
+    """
+    Split the texts of an embeddings request into chunks that fit the limits of the provider. A text
+    larger than the byte limit gets a chunk of its own.
+
+    :param texts: [List[str]], input texts
+    :param max_inputs: [Optional[int]], maximum number of texts per chunk, unlimited if None
+    :param max_bytes: [Optional[int]], maximum size of the texts of a chunk in the JSON payload, unlimited if None
+
+    :return: [List[List[str]]], chunks of consecutive texts, in the order of the input
+    """
+    if max_bytes is None and (max_inputs is None or len(texts) <= max_inputs):
+        return [texts]
+
+    chunks, chunk, chunk_bytes = [], [], 0
+    for _text in texts:
+        text_bytes = input_size(_text) if max_bytes is not None else 0
+        if chunk and (
+                (max_inputs is not None and len(chunk) >= max_inputs) or
+                (max_bytes is not None and chunk_bytes + text_bytes > max_bytes)
+        ):
+            chunks.append(chunk)
+            chunk, chunk_bytes = [], 0
+        chunk.append(_text)
+        chunk_bytes += text_bytes
+    chunks.append(chunk)
+    return chunks
+
+
+async def _cached_embeddings(embedding_input: CreateEmbeddingDTO, model):
+    """
+    Look up every input text in the embedding cache, embed only the misses upstream and merge
+    the results back in the order of the input
+    """
+    texts = embedding_input.input if isinstance(embedding_input.input, list) else [embedding_input.input]
+    keys = [
+        embedding_cache.key(embedding_input.provider, model, _text, embedding_input.dimensions) for _text in texts
+    ]
+    vectors = await embedding_cache.get_many(keys)
+
+    # Each distinct missing text is sent upstream once, even if it's repeated in the input
+    missing = {}
+    for _key, _text, _vector in zip(keys, texts, vectors):
+        if _vector is None:
+            missing.setdefault(_key, _text)
+
+    response_model, usage = model, None
+    if missing:
+        # Base64 encoded embeddings are decoded to vectors without going through Python floats
+        missing_input = CreateEmbeddingDTO(
+            provider=embedding_input.provider,
+            model=embedding_input.model,
+            input=list(missing.values()),
+            encoding_format=EncodingFormat.BASE64,
+            dimensions=embedding_input.dimensions
+        )
+        response = await hedger.call("embeddings", missing_input, model, _embeddings)
+        response_model, usage = response.model, response.usage
+        missing_vectors = np.stack(
+            [decode_embedding(_item.embedding) for _item in sorted(response.data, key=lambda _item: _item.index)]
+        )
+        # Vectors of a fallback model would be mixed into the similarity searches on the requested model
+        if not response._served_by_fallback:
+            await embedding_cache.set_many(list(missing.keys()), missing_vectors)
+
+        upstream_vectors = dict(zip(missing.keys(), missing_vectors))
+        vectors = [
+            _vector if _vector is not None else upstream_vectors[_key] for _key, _vector in zip(keys, vectors)
+        ]
+
+    return ResponseEmbeddingDTO.from_embeddings(
+        embedding_input.provider, response_model, vectors, usage=usage, encoding_format=embedding_input.encoding_format
+    )
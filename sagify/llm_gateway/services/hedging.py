@@ -0,0 +1,172 @@
+import asyncio
+from collections import deque
+import json
+import os
+import time
+
+from sagify.llm_gateway.api.v1.exceptions import GatewayTimeoutError
+from sagify.llm_gateway.core.metrics import HEDGED_REQUESTS, HEDGE_WINS, model_labels
+from sagify.llm_gateway.core.resilience import classify
+
+
+class HedgingPolicy:
+    """
+    How the requests for a provider, and optionally a model, are hedged and fall back to other targets
+    """
+    def __init__(self, fallbacks, hedge_percentile=None, hedge_delay=None, budget=None):
+        """
+        :param fallbacks: [List[Tuple[str, Optional[str]]]], provider and model of the targets to try after
+        the primary, in order. A model of None is the default model of the provider.
+        :param hedge_percentile: [Optional[float]], percentile of the recent latencies of the primary after
+        which the next target is called without cancelling the pending calls
+        :param hedge_delay: [Optional[float]], seconds after which the next target is called, until there are
+        enough latencies for the percentile. Without it nor a percentile, the next target is only called
+        when the previous one fails.
+        :param budget: [Optional[float]], seconds after which the request fails with a 504 response
+        """
+        self.fallbacks = fallbacks
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.budget = budget
+
+
+class Hedger:
+    """
+    Calls a provider according to the hedging policy of the request, if any. The first target to
+    respond successfully wins and the calls to the other targets are cancelled. Client errors fail the
+    request right away, only upstream errors, timeouts and throttling fall back to the next target.
+    """
+    def __init__(self, policies, window_size=200, min_samples=20):
+        """
+        :param policies: [dict], policies by endpoint, provider and model, with a model of None for
+        the policies that apply to every model of the provider
+        :param window_size: [int], number of recent latencies kept per target for the hedge percentile
+        :param min_samples: [int], number of latencies needed before the hedge percentile is used
+        """
+        self._policies = policies
+        self._window_size = window_size
+        self._min_samples = min_samples
+        self._latencies = {}
+        for (_, _, _model), _policy in policies.items():
+            model_labels.configure(_model, *[_fallback_model for _, _fallback_model in _policy.fallbacks])
+
+    def policy(self, endpoint, provider, model):
+        return self._policies.get((endpoint, provider, model)) or self._policies.get((endpoint, provider, None))
+
+    def hedge_delay(self, endpoint, provider, model, policy):
+        """
+        :return: [Optional[float]], seconds to wait on the primary before calling the next target
+        """
+        latencies = self._latencies.get((endpoint, provider, model_labels.label(model)))
+        if policy.hedge_percentile is not None and latencies is not None and len(latencies) >= self._min_samples:
+            ordered = sorted(latencies)
+            index = min(len(ordered) - 1, int(len(ordered) * policy.hedge_percentile / 100))
+            return ordered[index]
+        return policy.hedge_delay
+
+    async def call(self, endpoint, request, model, invoke):
+        """
+        Call the provider of a request, hedging it or falling back to other targets if it has a policy
+
+        :param endpoint: [str], one of chat, embeddings or images
+        :param request: [BaseModel], request DTO
+        :param model: [str], resolved model of the request
+        :param invoke: [Callable[[BaseModel], Awaitable[BaseModel]]], calls the provider and model of the
+        given request DTO
+
+        :return: [BaseModel], response DTO of the first target to respond successfully, marked as served
+        by a fallback if it isn't the primary
+        """
+        policy = self.policy(endpoint, request.provider, model)
+        if policy is None:
+            return await invoke(request)
+
+        targets = [(request.provider, model, request)] + [
+            (_provider, _model, request.copy(update={"provider": _provider, "model": _model}))
+            for _provider, _model in policy.fallbacks
+        ]
+        delay = self.hedge_delay(endpoint, request.provider, model, policy)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + policy.budget if policy.budget is not None else None
+        pending = {}
+        next_index = 0
+
+        def _start(reason=None):
+            nonlocal next_index
+            provider, target_model, target_request = targets[next_index]
+            task = asyncio.ensure_future(self._timed(endpoint, provider, target_model, invoke(target_request)))
+            pending[task] = next_index
+            next_index += 1
+            if reason is not None:
+                HEDGED_REQUESTS.inc(endpoint, provider, model_labels.label(target_model), reason)
+            return loop.time() + delay if delay is not None else None
+
+        hedge_at = _start()
+        last_error = None
+        try:
+            while pending:
+                wakeups = [_at for _at in (hedge_at if next_index < len(targets) else None, deadline) if _at is not None]
+                timeout = max(0.0, min(wakeups) - loop.time()) if wakeups else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                # Errors are read off every finished call first, so that none of them goes unretrieved
+                finished = [(pending.pop(_task), _task, _task.exception()) for _task in done]
+                for _index, _task, _error in finished:
+                    if _error is None:
+                        response = _task.result()
+                        if _index > 0:
+                            HEDGE_WINS.inc(endpoint, targets[_index][0], model_labels.label(targets[_index][1]))
+                            response._served_by_fallback = True
+                        return response
+                    # An invalid request fails on the other targets too, so they aren't called
+                    if classify(_error) == "client":
+                        raise _error
+                    last_error = _error
+
+                if deadline is not None and loop.time() >= deadline:
+                    raise GatewayTimeoutError(f"No response within the latency budget of {policy.budget} seconds")
+
+                if next_index < len(targets):
+                    if finished:
+                        hedge_at = _start("fallback")
+                    elif hedge_at is not None and loop.time() >= hedge_at:
+                        hedge_at = _start("hedge")
+        finally:
+            for _task in pending:
+                _task.cancel()
+
+        raise last_error
+
+    async def _timed(self, endpoint, provider, model, call):
+        started_at = time.monotonic()
+        response = await call
+        # Latencies are kept per model label, so that requests for random models can't grow them without bound
+        key = (endpoint, provider, model_labels.label(model))
+        latencies = self._latencies.get(key)
+        if latencies is None:
+            latencies = self._latencies[key] = deque(maxlen=self._window_size)
+        latencies.append(time.monotonic() - started_at)
+        return response
+
+
+def create_hedger():
+    """
+    Create the hedger from the HEDGING_POLICIES env variable. It's a JSON list of policies, e.g.
+    [{"endpoint": "chat", "provider": "sagemaker", "model": "llama-2-7b", "fallbacks": [{"provider": "openai"}],
+    "hedge_percentile": 95, "hedge_delay_ms": 2000, "budget_ms": 10000}]
+
+    :return: [Hedger], hedger of the gateway
+    """
+    policies = {}
+    for _policy in json.loads(os.environ.get("HEDGING_POLICIES", "[]")):
+        hedge_delay_ms, budget_ms = _policy.get("hedge_delay_ms"), _policy.get("budget_ms")
+        policies[(_policy["endpoint"], _policy["provider"], _policy.get("model"))] = HedgingPolicy(
+            fallbacks=[(_fallback["provider"], _fallback.get("model")) for _fallback in _policy.get("fallbacks", [])],
+            hedge_percentile=_policy.get("hedge_percentile"),
+            hedge_delay=hedge_delay_ms / 1000 if hedge_delay_ms is not None else None,
+            budget=budget_ms / 1000 if budget_ms is not None else None
+        )
+    return Hedger(policies)
+
+
+hedger = create_hedger()
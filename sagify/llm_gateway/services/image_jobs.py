@@ -0,0 +1,140 @@
+import asyncio
+import os
+from urllib.parse import urlparse
+
+from fastapi.exceptions import HTTPException
+import httpx
+import structlog
+
+from sagify.llm_gateway.api.v1.exceptions import BadRequestError
+from sagify.llm_gateway.core.audit import audit_record
+from sagify.llm_gateway.core.jobs import job_store
+from sagify.llm_gateway.core.metrics import request_labels
+from sagify.llm_gateway.schemas.images import CreateImageDTO, ResponseImageDTO, ResponseImageJobDTO
+from sagify.llm_gateway.services import images
+
+logger = structlog.get_logger()
+
+
+class ImageJobRunner:
+    """
+    Generates images in the background, so that the requests that start the jobs return right away.
+    The results are kept with the job states and can be polled for, or posted to a webhook once the
+    job is done.
+    """
+    def __init__(self, store, max_concurrency=4, webhook_hosts=(), webhook_retries=3, webhook_timeout=10.0):
+        """
+        :param store: [JobStore], store of the image generation jobs
+        :param max_concurrency: [int], number of image generations of the jobs in flight
+        :param webhook_hosts: [Iterable[str]], hosts that webhooks may be posted to, none if empty
+        :param webhook_retries: [int], number of retries of a webhook that failed
+        :param webhook_timeout: [float], seconds to wait for a webhook response
+        """
+        self._store = store
+        self._max_concurrency = max_concurrency
+        self._webhook_hosts = set(webhook_hosts)
+        self._webhook_retries = webhook_retries
+        self._webhook_timeout = webhook_timeout
+        self._semaphore = None
+        self._tasks = set()
+
+    async def submit(self, image_input: CreateImageDTO, webhook_url=None):
+        """
+        Start an image generation job. The request is admitted through the rate limits right away.
+
+        :param image_input: [CreateImageDTO], image generation request
+        :param webhook_url: [Optional[str]], URL to post the job to once it's done
+
+        :return: [Job], image generation job
+        """
+        if webhook_url is not None and urlparse(webhook_url).hostname not in self._webhook_hosts:
+            raise BadRequestError("The host of the webhook URL is not allowed")
+        model = await images.admit(image_input)
+
+        job = await self._store.create("image", total=image_input.n)
+        task = asyncio.ensure_future(self._run(job, image_input, model, webhook_url))
+        # Tasks are referenced until they finish, so that they aren't garbage collected
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def result(self, job):
+        """
+        :param job: [Job], image generation job
+
+        :return: [Optional[ResponseImageDTO]], generated images, or None if the job didn't complete
+        """
+        if job.status != "completed":
+            return None
+        return ResponseImageDTO.parse_file(self._store.path(job.id, ".result.json"))
+
+    def to_response(self, job, result=None):
+        """
+        :param job: [Job], image generation job
+        :param result: [Optional[ResponseImageDTO]], generated images, read from the store if None
+
+        :return: [ResponseImageJobDTO], job
+        """
+        return ResponseImageJobDTO(
+            id=job.id,
+            object="image_generation.job",
+            status=job.status,
+            created_at=job.created_at,
+            completed_at=job.completed_at,
+            result=result or self.result(job),
+            error=job.error
+        )
+
+    async def _run(self, job, image_input, model, webhook_url):
+        # The generation isn't part of the request that started the job
+        request_labels.set(None)
+        audit_record.set(None)
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        result = None
+        try:
+            async with self._semaphore:
+                result = await images.generate(image_input, model)
+            # The base64 encoded images take megabytes, which are serialized and written off the event loop
+            content = await asyncio.get_running_loop().run_in_executor(None, result.json)
+            await self._store.write(job.id, ".result.json", content)
+            job.completed = len(result.data)
+            job.finish("completed")
+        except HTTPException as e:
+            job.failed = job.total
+            job.finish("failed", error=e.detail)
+        except Exception as e:
+            logger.error(e)
+            job.failed = job.total
+            job.finish("failed", error=str(e))
+        await self._store.save(job, force=True)
+
+        if webhook_url is not None:
+            await self._post_webhook(webhook_url, self.to_response(job, result))
+
+    async def _post_webhook(self, webhook_url, response: ResponseImageJobDTO):
+        async with httpx.AsyncClient(timeout=self._webhook_timeout) as client:
+            for _attempt in range(self._webhook_retries + 1):
+                try:
+                    webhook_response = await client.post(
+                        webhook_url, content=response.json(), headers={"Content-Type": "application/json"}
+                    )
+                    if webhook_response.status_code < 500:
+                        return
+                    error = "status code {}".format(webhook_response.status_code)
+                except httpx.HTTPError as e:
+                    error = str(e)
+                if _attempt < self._webhook_retries:
+                    await asyncio.sleep(2 ** _attempt)
+        logger.warning("Image job webhook failed", job_id=response.id, error=error)
+
+
+image_job_runner = ImageJobRunner(
+    job_store,
+    max_concurrency=int(os.environ.get("IMAGE_JOB_MAX_CONCURRENCY", 4)),
+    webhook_hosts=[
+        _host.strip() for _host in os.environ.get("IMAGE_JOB_WEBHOOK_HOSTS", "").split(",") if _host.strip()
+    ],
+    webhook_retries=int(os.environ.get("IMAGE_JOB_WEBHOOK_RETRIES", 3))
+)
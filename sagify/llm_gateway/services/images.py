@@ -1,8 +1,63 @@
-from sagify.llm_gateway.schemas.images import CreateImageDTO
-from sagify.llm_gateway.providers.client_factory import LLMClientFactory
+from sagify.llm_gateway.core.metrics import set_request_labels
+from sagify.llm_gateway.core.rate_limit import estimate_tokens, rate_limiter
+from sagify.llm_gateway.core.singleflight import singleflight
+from sagify.llm_gateway.schemas.images import CreateImageDTO, ResponseImageDTO, ResponseFormat
+from sagify.llm_gateway.providers.registry import registry
+from sagify.llm_gateway.services import upstream
+from sagify.llm_gateway.services.cache import response_cache
+from sagify.llm_gateway.services.hedging import hedger
 
 
 async def generations(image_input: CreateImageDTO):
-    llm_client = await LLMClientFactory(image_input.provider).create_client()
+    model = await admit(image_input)
+    return await generate(image_input, model)
 
-    return await llm_client.generations(image_input)
+
+async def admit(image_input: CreateImageDTO):
+    """
+    Resolve the model of a request and admit it through the rate limits
+
+    :param image_input: [CreateImageDTO], image generation request
+
+    :return: [str], resolved model
+    """
+    llm_client = await registry.get(image_input.provider)
+    model = image_input.model or llm_client.default_model("images")
+    set_request_labels(image_input.provider, model)
+    if rate_limiter.enabled:
+        await rate_limiter.admit("images", image_input.provider, estimate_tokens([image_input.prompt]), model)
+    return model
+
+
+async def generate(image_input: CreateImageDTO, model):
+    """
+    Generate the images of an admitted request
+
+    :param image_input: [CreateImageDTO], image generation request
+    :param model: [str], resolved model
+
+    :return: [ResponseImageDTO], generated images
+    """
+    def _call():
+        return hedger.call("images", image_input, model, _generations)
+
+    if not _is_deterministic(image_input):
+        return await _call()
+
+    key = response_cache.key("images", image_input.provider, model, image_input)
+    if not response_cache.enabled("images"):
+        return await singleflight.do("images", key, _call)
+    return await singleflight.do(
+        "images", key, lambda: response_cache.get_or_call("images", key, ResponseImageDTO, _call)
+    )
+
+
+async def _generations(image_input: CreateImageDTO):
+    llm_client = await registry.get(image_input.provider)
+    model = image_input.model or llm_client.default_model("images")
+    return await upstream.call("images", image_input.provider, model, lambda: llm_client.generations(image_input))
+
+
+def _is_deterministic(image_input: CreateImageDTO):
+    # Image URLs expire, so only inline images are cached
+    return image_input.seed is not None and image_input.response_format == ResponseFormat.B64_JSON
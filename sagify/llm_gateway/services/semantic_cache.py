@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import json
+import os
+
+import numpy as np
+import structlog
+
+from sagify.llm_gateway.core.metrics import (
+    CACHE_REQUESTS,
+    SEMANTIC_CACHE_SIMILARITY,
+    request_labels,
+    set_request_labels
+)
+from sagify.llm_gateway.schemas.chat import CreateCompletionDTO
+from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO, EncodingFormat, decode_embedding
+from sagify.llm_gateway.services import embeddings
+
+
+logger = structlog.get_logger()
+
+
+class SemanticIndex:
+    """
+    Bounded index of unit vectors and their values, searched by cosine similarity with a single matrix
+    product. Every vector belongs to a partition and only matches vectors of the same partition.
+    The least recently used entry is evicted when the index is full.
+    """
+    def __init__(self, max_entries, initial_capacity=256):
+        self._max_entries = max_entries
+        self._initial_capacity = initial_capacity
+        self._matrix = None
+        self._partitions = None
+        self._last_used = None
+        self._values = []
+        self._partition_ids = {}
+        self._tick = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def _allocate(self, dimensions):
+        capacity = min(self._max_entries, self._initial_capacity)
+        self._matrix = np.zeros((capacity, dimensions), dtype=np.float32)
+        self._partitions = np.full(capacity, -1, dtype=np.int64)
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+
+    def _grow(self):
+        capacity = min(self._max_entries, 2 * len(self._matrix))
+        extra = capacity - len(self._matrix)
+        self._matrix = np.vstack([self._matrix, np.zeros((extra, self._matrix.shape[1]), dtype=np.float32)])
+        self._partitions = np.concatenate([self._partitions, np.full(extra, -1, dtype=np.int64)])
+        self._last_used = np.concatenate([self._last_used, np.zeros(extra, dtype=np.int64)])
+
+    def search(self, vector, partition):
+        """
+        :param vector: [np.ndarray], unit vector
+        :param partition: [Hashable], partition of the vector
+
+        :return: [Tuple[Optional[int], float]], slot of the most similar vector of the partition and
+        its similarity, or None and -1 if the partition is empty
+        """
+        partition_id = self._partition_ids.get(partition)
+        if partition_id is None or self._matrix is None or self._matrix.shape[1] != len(vector):
+            return None, -1.0
+        size = len(self._values)
+        similarities = self._matrix[:size] @ vector
+        similarities[self._partitions[:size] != partition_id] = -np.inf
+        slot = int(np.argmax(similarities))
+        if similarities[slot] == -np.inf:
+            return None, -1.0
+        return slot, float(similarities[slot])
+
+    def similarity(self, slot, vector, partition):
+        """
+        :return: [float], similarity of a vector with the vector of a slot, or -1 if the slot now
+        belongs to another partition
+        """
+        if slot >= len(self._values) or self._partitions[slot] != self._partition_ids.get(partition):
+            return -1.0
+        return float(self._matrix[slot] @ vector)
+
+    def get(self, slot):
+        self._tick += 1
+        self._last_used[slot] = self._tick
+        return self._values[slot]
+
+    def add(self, vector, partition, value):
+        if self._matrix is None:
+            self._allocate(len(vector))
+        if len(vector) != self._matrix.shape[1]:
+            return
+        partition_id = self._partition_ids.setdefault(partition, len(self._partition_ids))
+
+        size = len(self._values)
+        if size < self._max_entries:
+            if size == len(self._matrix):
+                self._grow()
+            slot = size
+            self._values.append(value)
+        else:
+            slot = int(np.argmin(self._last_used))
+            self._values[slot] = value
+
+        self._matrix[slot] = vector
+        self._partitions[slot] = partition_id
+        self._tick += 1
+        self._last_used[slot] = self._tick
+
+
+class SemanticCache:
+    """
+    Cache of chat completions that also answers paraphrases of cached prompts. Prompts are embedded
+    with the configured embeddings provider and a completion is returned from the cache when the
+    cosine similarity of its prompt with the new one reaches the threshold. Only requests with the
+    same provider, model and generation parameters match each other.
+    """
+    def __init__(self, provider, model=None, threshold=0.95, max_entries=10000):
+        """
+        :param provider: [Optional[str]], embeddings provider, the cache is disabled without one
+        :param model: [Optional[str]], embeddings model, the default model of the provider if None
+        :param threshold: [float], minimum cosine similarity of the prompts for a hit
+        :param max_entries: [int], maximum number of cached completions
+        """
+        self._provider = provider
+        self._model = model
+        self._threshold = threshold
+        self._index = SemanticIndex(max_entries)
+        self._stats = {"hits": 0, "misses": 0}
+        self._similarities = []
+
+    @property
+    def enabled(self):
+        return bool(self._provider)
+
+    @staticmethod
+    def prompt(message: CreateCompletionDTO):
+        return "\n".join("{}: {}".format(_message.role.value, _message.content) for _message in message.messages)
+
+    @staticmethod
+    def partition(message: CreateCompletionDTO, model):
+        parameters = [message.provider, model, message.temperature, message.max_tokens, message.top_p, message.seed]
+        return hashlib.sha256(json.dumps(parameters).encode("utf-8")).hexdigest()
+
+    async def _embed(self, text):
+        # The embeddings service labels the request with its own provider and model, which are put back.
+        # The lookup is part of the chat request, so it isn't admitted by the embeddings rate limits.
+        labels = dict(request_labels.get() or {})
+        try:
+            response = await embeddings.embeddings(CreateEmbeddingDTO(
+                provider=self._provider, model=self._model, input=[text], encoding_format=EncodingFormat.BASE64
+            ), rate_limited=False)
+        finally:
+            if labels:
+                set_request_labels(labels.get("provider"), labels.get("model"))
+        vector = decode_embedding(response.data[0].embedding)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    async def get_or_call(self, message: CreateCompletionDTO, model, call):
+        """
+        Return the cached completion of a similar prompt, or call upstream and cache its completion
+
+        :param message: [CreateCompletionDTO], chat completion request
+        :param model: [str], resolved model of the request
+        :param call: [Callable[[], Awaitable[ResponseCompletionDTO]]], upstream call
+
+        :return: [ResponseCompletionDTO], completion
+        """
+        try:
+            vector = await self._embed(self.prompt(message))
+        except Exception as e:
+            # The cache is only an optimization, the request is served without it
+            logger.warning("Semantic cache lookup failed", error=str(e))
+            self._stats["misses"] += 1
+            CACHE_REQUESTS.inc("semantic", "chat", "miss")
+            return await call()
+        partition = self.partition(message, model)
+
+        # The matrix product releases the GIL, so large indexes are searched off the event loop.
+        # The index may change meanwhile, so the similarity of the match is checked again after.
+        slot, similarity = await asyncio.get_running_loop().run_in_executor(
+            None, self._index.search, vector, partition
+        )
+        if slot is not None:
+            similarity = self._index.similarity(slot, vector, partition)
+            self._observe(similarity)
+
+        if slot is not None and similarity >= self._threshold:
+            self._stats["hits"] += 1
+            CACHE_REQUESTS.inc("semantic", "chat", "hit")
+            return self._index.get(slot)
+
+        self._stats["misses"] += 1
+        CACHE_REQUESTS.inc("semantic", "chat", "miss")
+        response = await call()
+        if not response._served_by_fallback:
+            self._index.add(vector, partition, response)
+        return response
+
+    def _observe(self, similarity):
+        SEMANTIC_CACHE_SIMILARITY.observe(similarity)
+        self._similarities.append(similarity)
+        if len(self._similarities) > 1000:
+            del self._similarities[:500]
+
+    def stats(self):
+        """
+        :return: [dict], hits, misses, hit rate, number of entries and percentiles of the best
+        similarity found for the recent lookups
+        """
+        lookups = self._stats["hits"] + self._stats["misses"]
+        stats = dict(self._stats, entries=len(self._index), hit_rate=self._stats["hits"] / lookups if lookups else 0.0)
+        if self._similarities:
+            p50, p90, p99 = np.percentile(self._similarities, [50, 90, 99])
+            stats["similarity"] = {"p50": float(p50), "p90": float(p90), "p99": float(p99)}
+        return stats
+
+
+def create_semantic_cache():
+    """
+    Create the semantic cache from the SEMANTIC_CACHE_* env variables
+    """
+    return SemanticCache(
+        os.environ.get("SEMANTIC_CACHE_EMBEDDINGS_PROVIDER"),
+        model=os.environ.get("SEMANTIC_CACHE_EMBEDDINGS_MODEL"),
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95)),
+        max_entries=int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 10000))
+    )
+
+
+semantic_cache = create_semantic_cache()
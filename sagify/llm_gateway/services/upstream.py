@@ -0,0 +1,74 @@
+import time
+
+from sagify.llm_gateway.core.audit import record_usage
+from sagify.llm_gateway.core.metrics import (
+    TIME_TO_FIRST_TOKEN,
+    TOKENS,
+    UPSTREAM_ERRORS,
+    UPSTREAM_LATENCY,
+    model_labels,
+    set_request_labels
+)
+from sagify.llm_gateway.core.resilience import resilience
+
+
+async def call(endpoint, provider, model, upstream):
+    """
+    Call a provider through the resilience layer and record the latency, errors and token usage of the call
+
+    :param endpoint: [str], one of chat, embeddings or images
+    :param provider: [str], provider name
+    :param model: [str], resolved model name
+    :param upstream: [Callable[[], Awaitable[BaseModel]]], provider call
+
+    :return: [BaseModel], response DTO of the provider
+    """
+    model = model or ""
+    set_request_labels(provider, model)
+    started_at = time.perf_counter()
+    try:
+        response = await resilience.call(provider, model, upstream)
+        model_labels.learn(model)
+    except Exception:
+        UPSTREAM_ERRORS.inc(endpoint, provider, model_labels.label(model))
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started_at, endpoint, provider, model_labels.label(model))
+
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        label = model_labels.label(model)
+        TOKENS.inc(provider, label, "prompt", amount=usage.prompt_tokens)
+        TOKENS.inc(provider, label, "completion", amount=usage.total_tokens - usage.prompt_tokens)
+        record_usage(usage.prompt_tokens, usage.total_tokens - usage.prompt_tokens)
+    return response
+
+
+async def stream(endpoint, provider, model, chunks):
+    """
+    Relay the chunks of a streamed provider response through the resilience layer and record the time
+    to first token, the latency and the errors of the call
+
+    :param endpoint: [str], one of chat, embeddings or images
+    :param provider: [str], provider name
+    :param model: [str], resolved model name
+    :param chunks: [AsyncIterator[BaseModel]], streamed response of the provider
+
+    :return: [AsyncIterator[BaseModel]], chunks of the response
+    """
+    model = model or ""
+    set_request_labels(provider, model)
+    started_at = time.perf_counter()
+    first_chunk = True
+    try:
+        async for chunk in resilience.stream(provider, model, chunks):
+            if first_chunk:
+                model_labels.learn(model)
+                TIME_TO_FIRST_TOKEN.observe(time.perf_counter() - started_at, provider, model_labels.label(model))
+                first_chunk = False
+            yield chunk
+    except Exception:
+        UPSTREAM_ERRORS.inc(endpoint, provider, model_labels.label(model))
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started_at, endpoint, provider, model_labels.label(model))
@@ -407,3 +407,26 @@ class TestLlmStop(object):
                 mocked_sagemaker_client.return_value.shutdown_endpoint.assert_called_with('endpoint1')
 
                 assert result.exit_code == -1
+
+
+class TestLlmGateway(object):
+    def test_gateway_server_settings_are_passed_to_the_container(self):
+        runner = CliRunner()
+        with patch('sagify.commands.llm.docker.from_env') as mocked_docker_from_env:
+            result = runner.invoke(
+                cli=cli,
+                args=[
+                    'llm', 'gateway',
+                    '--image', 'sagify-llm-gateway:v0.1.0',
+                    '--start-local',
+                    '--workers', '4',
+                    '--loop', 'uvloop',
+                    '--keep-alive', '30'
+                ]
+            )
+
+            assert result.exit_code == 0
+            environment = mocked_docker_from_env.return_value.containers.run.call_args[1]['environment']
+            assert environment['GATEWAY_WORKERS'] == '4'
+            assert environment['GATEWAY_LOOP'] == 'uvloop'
+            assert environment['GATEWAY_KEEP_ALIVE_IN_SECONDS'] == 30
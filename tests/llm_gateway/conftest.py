@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import time
+
+from sagify.llm_gateway.schemas.embeddings import ResponseEmbeddingDTO
+
+
+class FakeClock(object):
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeEmbeddingsClient(object):
+    """
+    Embeddings client that records the inputs of its requests and embeds every text with the given function
+    """
+    def __init__(self, embed=lambda _text: [0.1], tokens_per_text=None):
+        """
+        :param embed: [Callable[[str], List[float]]], embedding of a text
+        :param tokens_per_text: [Optional[int]], prompt tokens reported per text, no usage if None
+        """
+        self.inputs = []
+        self._embed = embed
+        self._tokens_per_text = tokens_per_text
+
+    def default_model(self, endpoint):
+        return 'embeddings-model'
+
+    async def embeddings(self, embedding_input):
+        self.inputs.append(embedding_input.input)
+        texts = embedding_input.input if isinstance(embedding_input.input, list) else [embedding_input.input]
+        usage = None
+        if self._tokens_per_text is not None:
+            usage = {'prompt_tokens': self._tokens_per_text * len(texts), 'total_tokens': self._tokens_per_text * len(texts)}
+        return ResponseEmbeddingDTO.from_embeddings(
+            embedding_input.provider, 'embeddings-model', [self._embed(_text) for _text in texts], usage=usage
+        )
+
+
+def wait_until_done(client, url, timeout=5):
+    """
+    Poll a background job until it's no longer in progress
+
+    :param client: [TestClient], client of the gateway
+    :param url: [str], URL of the job
+    :param timeout: [float], seconds before giving up
+
+    :return: [dict], job
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(url).json()
+        if job['status'] != 'in_progress':
+            return job
+        time.sleep(0.02)
+    raise AssertionError('{} did not finish'.format(url))
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import glob
+import json
+import os
+import uuid
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from sagify.llm_gateway.core.audit import AuditLog
+from sagify.llm_gateway.main import app
+from tests.llm_gateway.conftest import FakeEmbeddingsClient
+
+
+def _records(directory):
+    records = []
+    for _path in sorted(glob.glob(os.path.join(str(directory), 'audit-*.jsonl'))):
+        with open(_path) as f:
+            records.extend(json.loads(_line) for _line in f)
+    return records
+
+
+class TestAuditLog(object):
+    def test_sampled_requests_are_written_with_their_payloads(self, tmp_path):
+        audit_log = AuditLog(str(tmp_path), log_payloads=True, flush_interval=0.01)
+        request = {'provider': 'sagemaker', 'model': None, 'input': [uuid.uuid4().hex]}
+        fake_client = FakeEmbeddingsClient(lambda _text: [0.5, 1.0], tokens_per_text=3)
+
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.api.middleware.audit_log', audit_log), \
+                patch('sagify.llm_gateway.main.audit_log', audit_log), \
+                TestClient(app) as client:
+            response = client.post('/v1/embeddings', json=request, headers={'X-API-Key': 'secret'})
+
+        assert response.status_code == 200
+        records = _records(tmp_path)
+        assert len(records) == 1
+        record = records[0]
+        assert (record['method'], record['path'], record['status_code']) == ('POST', '/v1/embeddings', 200)
+        assert (record['provider'], record['model']) == ('sagemaker', 'embeddings-model')
+        assert (record['prompt_tokens'], record['completion_tokens']) == (3, 0)
+        assert record['request_body'] == request
+        assert record['response_body']['data'][0]['embedding'] == [0.5, 1.0]
+        assert record['api_key_hash'] is not None and 'secret' not in json.dumps(record)
+        assert record['latency_seconds'] > 0
+
+    def test_requests_are_sampled(self, tmp_path):
+        assert not AuditLog(None).enabled
+        assert not AuditLog(str(tmp_path), sample_rate=0).sampled()
+        with patch('sagify.llm_gateway.core.audit.random.random', side_effect=[0.2, 0.7]):
+            audit_log = AuditLog(str(tmp_path), sample_rate=0.5)
+            assert [audit_log.sampled(), audit_log.sampled()] == [True, False]
+
+    @pytest.mark.asyncio
+    async def test_records_beyond_the_queue_are_dropped(self, tmp_path):
+        audit_log = AuditLog(str(tmp_path), max_queue=2, flush_interval=10)
+        await audit_log.start()
+
+        # The writer doesn't get to run in between, as if it couldn't keep up
+        for _index in range(5):
+            audit_log.log({'request_id': str(_index)})
+        await audit_log.stop()
+
+        assert [_record['request_id'] for _record in _records(tmp_path)] == ['0', '1']
+
+    @pytest.mark.asyncio
+    async def test_files_are_rotated(self, tmp_path):
+        audit_log = AuditLog(str(tmp_path), batch_size=2, flush_interval=0, max_file_bytes=1)
+        await audit_log.start()
+
+        for _index in range(6):
+            audit_log.log({'request_id': str(_index)})
+            if _index % 2:
+                await asyncio.sleep(0.05)
+        await audit_log.stop()
+
+        assert len(glob.glob(os.path.join(str(tmp_path), 'audit-*.jsonl'))) == 3
+        assert sorted(_record['request_id'] for _record in _records(tmp_path)) == [str(_index) for _index in range(6)]
+
+    @pytest.mark.asyncio
+    async def test_records_are_written_as_parquet(self, tmp_path):
+        parquet = pytest.importorskip('pyarrow.parquet')
+        audit_log = AuditLog(str(tmp_path), file_format='parquet', flush_interval=0)
+        await audit_log.start()
+
+        audit_log.log({'request_id': 'a', 'status_code': 200, 'prompt_tokens': 3, 'request_body': {'input': 'hi'}})
+        await audit_log.stop()
+
+        table = parquet.read_table(glob.glob(os.path.join(str(tmp_path), 'audit-*.parquet'))[0])
+        assert table.to_pylist()[0]['request_body'] == '{"input": "hi"}'
+        assert table.to_pylist()[0]['status_code'] == 200
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+import threading
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from sagify.llm_gateway.api.v1.exceptions import BadRequestError, InternalServerError
+from sagify.llm_gateway.core.jobs import JobStore
+from sagify.llm_gateway.main import app
+from sagify.llm_gateway.schemas.chat import ChoiceItem, MessageItem, ResponseCompletionDTO
+from sagify.llm_gateway.schemas.embeddings import ResponseEmbeddingDTO
+from sagify.llm_gateway.services.batches import BatchProcessor
+from tests.llm_gateway.conftest import wait_until_done
+
+
+class FakeClient(object):
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.batches = []
+
+    def default_model(self, endpoint):
+        return '{}-model'.format(endpoint)
+
+    async def completions(self, message):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        if self.failures:
+            self.failures -= 1
+            raise InternalServerError('upstream is down')
+        return ResponseCompletionDTO(
+            id='chatcmpl-1',
+            object='chat.completion',
+            created=1,
+            provider=message.provider,
+            model='chat-model',
+            choices=[ChoiceItem(index=0, message=MessageItem(role='assistant', content=message.messages[0].content.upper()))]
+        )
+
+    async def embeddings(self, embedding_input):
+        return ResponseEmbeddingDTO.from_embeddings(embedding_input.provider, 'embeddings-model', [[0.5]])
+
+    async def create_batch(self, requests, endpoint):
+        self.batches.append((requests, endpoint))
+        return 'batch_openai'
+
+    async def retrieve_batch(self, batch_id):
+        return {'status': 'completed', 'request_counts': {'completed': 1, 'failed': 0}, 'output_file_id': 'file-1'}
+
+    async def batch_output(self, file_id):
+        return b'{"custom_id": "a"}\n'
+
+
+def _chat_line(custom_id, content, provider='sagemaker'):
+    return json.dumps({
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': '/v1/chat/completions',
+        'body': {
+            'provider': provider,
+            'model': None,
+            'messages': [{'role': 'user', 'content': content}],
+            'max_tokens': 10,
+            'top_p': None,
+            'seed': None
+        }
+    })
+
+
+class TestBatches(object):
+    def test_batch_is_processed_in_the_background(self, tmp_path):
+        fake_client = FakeClient(failures=1)
+        processor = BatchProcessor(JobStore(str(tmp_path)), max_concurrency=2, max_retries=1, retry_delay=0.01)
+        lines = [_chat_line(str(_index), 'hi {}'.format(_index)) for _index in range(6)]
+        lines.append(json.dumps({'custom_id': 'e', 'url': '/v1/embeddings', 'body': {'provider': 'openai', 'input': 'x'}}))
+        lines.append(json.dumps({'custom_id': 'invalid', 'url': '/v1/embeddings', 'body': {'provider': 'openai'}}))
+
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.api.v1.endpoints.batches.batch_processor', processor), \
+                patch('sagify.llm_gateway.api.v1.endpoints.batches.job_store', processor._store), \
+                TestClient(app) as client:
+            response = client.post('/v1/batches', content='\n'.join(lines))
+            assert response.status_code == 202
+            batch = wait_until_done(client, '/v1/batches/{}'.format(response.json()['id']))
+            output = client.get(batch['output_url'])
+
+        assert batch['status'] == 'completed'
+        assert batch['request_counts'] == {'total': 8, 'completed': 7, 'failed': 1}
+        assert fake_client.calls == 7
+        assert fake_client.max_in_flight == 2
+
+        results = {_result['custom_id']: _result for _result in map(json.loads, output.text.splitlines())}
+        assert results['3']['response']['body']['choices'][0]['message']['content'] == 'HI 3'
+        assert results['e']['response']['body']['data'][0]['embedding'] == [0.5]
+        assert results['invalid']['error']['code'] == 400
+
+    @pytest.mark.asyncio
+    async def test_requests_to_unknown_providers_fail_without_retries(self, tmp_path):
+        processor = BatchProcessor(JobStore(str(tmp_path)), max_retries=3, retry_delay=10)
+
+        result = await asyncio.wait_for(processor._process(json.loads(_chat_line('a', 'hi', provider='azure'))), 1)
+
+        assert result['error'] == {'code': 400, 'message': 'Invalid provider name azure'}
+
+    def test_invalid_batch_is_rejected(self, tmp_path):
+        processor = BatchProcessor(JobStore(str(tmp_path)))
+
+        with pytest.raises(BadRequestError):
+            processor.parse(b'{"custom_id": "a", "url": "/v1/images/generations", "body": {}}')
+        with pytest.raises(BadRequestError):
+            processor.parse(b'not json')
+
+    def test_unknown_batch_is_not_found(self):
+        response = TestClient(app).get('/v1/batches/batch_{}'.format('0' * 32))
+
+        assert response.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_native_batch_is_passed_through_to_openai(self, tmp_path):
+        fake_client = FakeClient()
+        store = JobStore(str(tmp_path))
+        processor = BatchProcessor(store)
+
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client):
+            job = await processor.submit(_chat_line('a', 'hi', provider='openai').encode('utf-8'), native=True)
+            job = await processor.refresh(store.get(job.id))
+
+        requests, endpoint = fake_client.batches[0]
+        assert endpoint == '/v1/chat/completions'
+        body = json.loads(requests)['body']
+        assert 'provider' not in body
+        assert body['model'] == 'chat-model'
+        assert (job.status, job.completed, job.metadata['provider_batch_id']) == ('completed', 1, 'batch_openai')
+        with open(store.path(job.id, '.jsonl'), 'rb') as f:
+            assert f.read() == b'{"custom_id": "a"}\n'
+
+    @pytest.mark.asyncio
+    async def test_output_is_written_off_the_event_loop_in_chunks(self, tmp_path):
+        store = JobStore(str(tmp_path))
+        processor = BatchProcessor(store, output_chunk_size=2)
+        writes = []
+        write_file = store._write_file
+
+        def _write_file(path, content, append):
+            if path.endswith('.jsonl'):
+                writes.append((threading.current_thread().name, content.count('\n')))
+            write_file(path, content, append)
+
+        store._write_file = _write_file
+        lines = '\n'.join(_chat_line(str(_index), 'hi') for _index in range(5)).encode('utf-8')
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=FakeClient()):
+            job = await processor.submit(lines)
+            await asyncio.gather(*processor._tasks)
+
+        assert all(_thread.startswith('jobs') for _thread, _ in writes)
+        assert [_lines for _, _lines in writes] == [0, 2, 2, 1]
+        assert store.get(job.id).completed == 5
+        with open(store.path(job.id, '.jsonl')) as f:
+            assert sorted(json.loads(_line)['custom_id'] for _line in f) == ['0', '1', '2', '3', '4']
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import io
+import json
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+
+from sagify.llm_gateway.core.batching import MicroBatcher
+from sagify.llm_gateway.providers.aws.sagemaker import SageMakerClient
+from sagify.llm_gateway.schemas.chat import CreateCompletionDTO, MessageItem
+from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO
+
+
+class RecordingSageMakerRuntime(object):
+    def __init__(self):
+        self.bodies = []
+
+    def invoke_endpoint(self, **kwargs):
+        inputs = json.loads(kwargs['Body'])
+        self.bodies.append(inputs)
+        return {'Body': io.BytesIO(json.dumps({'embedding': [[float(len(_text))] for _text in inputs]}).encode('utf-8'))}
+
+    def close(self):
+        pass
+
+
+class ChatSageMakerRuntime(object):
+    def __init__(self):
+        self.bodies = []
+
+    def invoke_endpoint(self, **kwargs):
+        body = json.loads(kwargs['Body'])
+        self.bodies.append(body)
+        generations = [
+            {'generation': {'role': 'assistant', 'content': _dialog[-1]['content'].upper()}} for _dialog in body['inputs']
+        ]
+        return {'Body': io.BytesIO(json.dumps(generations).encode('utf-8'))}
+
+    def close(self):
+        pass
+
+
+class TestMicroBatcher(object):
+    @pytest.mark.asyncio
+    async def test_concurrent_submissions_are_processed_in_one_batch(self):
+        batches = []
+
+        async def process_batch(key, items):
+            batches.append((key, items))
+            return [_item * 10 for _item in items]
+
+        batcher = MicroBatcher(process_batch, window=0.01, max_batch_size=10)
+        results = await asyncio.gather(
+            batcher.submit('endpoint', [1, 2]),
+            batcher.submit('endpoint', [3]),
+            batcher.submit('other-endpoint', [4]),
+        )
+
+        assert results == [[10, 20], [30], [40]]
+        assert sorted(batches) == [('endpoint', [1, 2, 3]), ('other-endpoint', [4])]
+        assert batcher.stats()['batches'] == 2
+        assert batcher.stats()['items'] == 4
+
+    @pytest.mark.asyncio
+    async def test_batch_is_processed_when_full_without_waiting_for_the_window(self):
+        batches = []
+
+        async def process_batch(key, items):
+            batches.append(items)
+            return items
+
+        batcher = MicroBatcher(process_batch, window=10, max_batch_size=2)
+        results = await asyncio.wait_for(
+            asyncio.gather(batcher.submit('endpoint', [1]), batcher.submit('endpoint', [2])), timeout=1
+        )
+
+        assert results == [[1], [2]]
+        assert batches == [[1, 2]]
+
+    @pytest.mark.asyncio
+    async def test_batches_stay_within_the_maximum_bytes(self):
+        batches = []
+
+        async def process_batch(key, items):
+            batches.append(items)
+            return items
+
+        batcher = MicroBatcher(process_batch, window=0.01, max_batch_size=10, max_batch_bytes=5, item_size=len)
+        await asyncio.gather(
+            batcher.submit('endpoint', ['aa']), batcher.submit('endpoint', ['bbb']), batcher.submit('endpoint', ['cc'])
+        )
+
+        assert batches == [['aa', 'bbb'], ['cc']]
+
+    @pytest.mark.asyncio
+    async def test_every_caller_gets_the_error(self):
+        async def process_batch(key, items):
+            raise ValueError('endpoint failed')
+
+        batcher = MicroBatcher(process_batch, window=0.01)
+        results = await asyncio.gather(
+            batcher.submit('endpoint', [1]), batcher.submit('endpoint', [2]), return_exceptions=True
+        )
+
+        assert all(isinstance(_result, ValueError) for _result in results)
+
+    @pytest.mark.asyncio
+    async def test_every_caller_gets_an_error_when_results_are_missing(self):
+        async def process_batch(key, items):
+            return items[1:]
+
+        batcher = MicroBatcher(process_batch, window=0.01)
+        results = await asyncio.gather(
+            batcher.submit('endpoint', [1]), batcher.submit('endpoint', [2, 3]), return_exceptions=True
+        )
+
+        await asyncio.sleep(0)
+
+        assert all(isinstance(_result, ValueError) for _result in results)
+        assert not batcher._tasks
+
+    @pytest.mark.asyncio
+    async def test_sagemaker_embeddings_are_batched_per_endpoint(self):
+        with patch.dict('os.environ', {'SM_EMBEDDINGS_BATCH_WINDOW_MS': '10'}):
+            client = SageMakerClient()
+        client.sagemaker_runtime_client = RecordingSageMakerRuntime()
+
+        responses = await asyncio.gather(*[
+            client.embeddings(CreateEmbeddingDTO(provider='sagemaker', model='embeddings-endpoint', input=_input))
+            for _input in ['a', ['bb', 'ccc'], 'dddd']
+        ])
+        await client.close()
+
+        assert client.sagemaker_runtime_client.bodies == [['a', 'bb', 'ccc', 'dddd']]
+        assert [[_item.embedding for _item in _response.data] for _response in responses] == \
+            [[[1.0]], [[2.0], [3.0]], [[4.0]]]
+
+    @pytest.mark.asyncio
+    async def test_sagemaker_embeddings_batches_stay_within_the_chunk_limits(self):
+        with patch.dict('os.environ', {
+            'SM_EMBEDDINGS_BATCH_WINDOW_MS': '10', 'SM_EMBEDDINGS_MAX_INPUTS': '2', 'SM_EMBEDDINGS_MAX_BYTES': '20'
+        }):
+            client = SageMakerClient()
+        client.sagemaker_runtime_client = RecordingSageMakerRuntime()
+
+        await asyncio.gather(*[
+            client.embeddings(CreateEmbeddingDTO(provider='sagemaker', model='embeddings-endpoint', input=_input))
+            for _input in ['a', 'bb', 'ccc', 'dddddddd', 'e']
+        ])
+        await client.close()
+
+        bodies = client.sagemaker_runtime_client.bodies
+        assert bodies == [['a', 'bb'], ['ccc', 'dddddddd'], ['e']]
+        assert all(len(json.dumps(_body)) <= 20 for _body in bodies)
+
+    @pytest.mark.asyncio
+    async def test_sagemaker_chat_dialogs_are_batched_per_endpoint_and_parameters(self):
+        with patch.dict('os.environ', {'SM_CHAT_BATCH_WINDOW_MS': '10', 'SM_CHAT_MAX_BATCH_SIZE': '2'}):
+            client = SageMakerClient()
+        client.sagemaker_runtime_client = ChatSageMakerRuntime()
+
+        def _message(content, max_tokens=10):
+            return CreateCompletionDTO(
+                provider='sagemaker',
+                model='chat-endpoint',
+                messages=[MessageItem(role='user', content=content)],
+                temperature=None,
+                max_tokens=max_tokens
+            )
+
+        responses = await asyncio.gather(*[
+            client.completions(_message('a')),
+            client.completions(_message('b')),
+            client.completions(_message('c', max_tokens=20)),
+            client.completions(_message('d')),
+        ])
+        await client.close()
+
+        bodies = client.sagemaker_runtime_client.bodies
+        assert sorted(
+            ([_dialog[0]['content'] for _dialog in _body['inputs']], _body['parameters']['max_new_tokens']) for _body in bodies
+        ) == [(['a', 'b'], 10), (['c'], 20), (['d'], 10)]
+        assert [_response.choices[0].message.content for _response in responses] == ['A', 'B', 'C', 'D']
+        assert all(len(_response.choices) == 1 for _response in responses)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+
+from sagify.llm_gateway.schemas.chat import CreateCompletionDTO, MessageItem, ResponseCompletionDTO
+from sagify.llm_gateway.services import chat
+from sagify.llm_gateway.services.cache import DiskCacheBackend, MemoryCacheBackend, ResponseCache
+from tests.llm_gateway.conftest import FakeClock
+
+
+class FakeChatClient(object):
+    def __init__(self):
+        self.calls = 0
+
+    def default_model(self, endpoint):
+        return 'default-model'
+
+    async def completions(self, message):
+        self.calls += 1
+        return _response('answer {}'.format(self.calls))
+
+
+def _response(content):
+    return ResponseCompletionDTO(
+        id='chatcmpl-1',
+        object='chat.completion',
+        created=1,
+        provider='openai',
+        model='default-model',
+        choices=[{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+        usage=None
+    )
+
+
+def _request(**kwargs):
+    request = {
+        'provider': 'openai',
+        'model': None,
+        'messages': [MessageItem(role='user', content='hi')],
+        'max_tokens': 10,
+        'top_p': None,
+        'seed': None,
+        'temperature': 0
+    }
+    request.update(kwargs)
+    return CreateCompletionDTO(**request)
+
+
+class TestMemoryCacheBackend(object):
+    @pytest.mark.asyncio
+    async def test_least_recently_used_entry_is_evicted(self):
+        backend = MemoryCacheBackend(max_entries=2)
+        await backend.set('a', 1)
+        await backend.set('b', 2)
+        await backend.get('a')
+        await backend.set('c', 3)
+
+        assert await backend.get('a') == 1
+        assert await backend.get('b') is None
+        assert await backend.get('c') == 3
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_entries_are_evicted_beyond_the_maximum_bytes(self):
+        responses = {_key: _response(_key * 50) for _key in 'abcd'}
+        size = len(responses['a'].json())
+        backend = MemoryCacheBackend(max_bytes=2 * size)
+        for _key in 'abc':
+            await backend.set(_key, responses[_key])
+        await backend.set('d', _response('d' * 1000))
+
+        assert [await backend.get(_key) is not None for _key in 'abcd'] == [False, True, True, False]
+        assert len(backend) == 2
+
+    @pytest.mark.asyncio
+    async def test_entry_expires_after_ttl(self):
+        clock = FakeClock(now=1000.0)
+        backend = MemoryCacheBackend(ttl=10, clock=clock)
+        await backend.set('a', 1)
+        clock.now += 11
+
+        assert await backend.get('a') is None
+
+
+class TestDiskCacheBackend(object):
+    @pytest.mark.asyncio
+    async def test_entries_survive_restarts(self, tmp_path):
+        path = str(tmp_path / 'cache.sqlite')
+        await DiskCacheBackend(path).set('a', _response('cached'))
+
+        cached = await DiskCacheBackend(path).get('a')
+
+        assert ResponseCompletionDTO(**cached).choices[0].message.content == 'cached'
+
+
+class TestResponseCache(object):
+    def test_key_resolves_default_model(self):
+        assert ResponseCache.key('chat', 'openai', 'gpt-4', _request(model='gpt-4')) == \
+            ResponseCache.key('chat', 'openai', 'gpt-4', _request(model=None))
+        assert ResponseCache.key('chat', 'openai', 'gpt-4', _request()) != \
+            ResponseCache.key('chat', 'openai', 'gpt-4', _request(max_tokens=20))
+
+    @pytest.mark.asyncio
+    async def test_deterministic_chat_requests_are_cached(self):
+        fake_client = FakeChatClient()
+        cache = ResponseCache(MemoryCacheBackend())
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.chat.response_cache', cache):
+            first = await chat.completions(_request())
+            second = await chat.completions(_request(model='default-model'))
+
+        assert fake_client.calls == 1
+        assert first.choices[0].message.content == second.choices[0].message.content
+        assert cache.stats()['chat'] == {'hits': 1, 'misses': 1}
+
+    @pytest.mark.asyncio
+    async def test_non_deterministic_and_disabled_requests_are_not_cached(self):
+        fake_client = FakeChatClient()
+        cache = ResponseCache(MemoryCacheBackend(), disabled_endpoints=['embeddings'])
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.chat.response_cache', cache):
+            await chat.completions(_request(temperature=0.7))
+            await chat.completions(_request(temperature=0.7))
+
+        assert fake_client.calls == 2
+        assert not cache.enabled('embeddings')
+        assert cache.stats()['chat'] == {'hits': 0, 'misses': 0}
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import json
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from fastapi.testclient import TestClient
+
+from sagify.llm_gateway.api.v1.exceptions import InternalServerError
+from sagify.llm_gateway.main import app
+from sagify.llm_gateway.schemas.chat import ResponseCompletionChunkDTO, ChunkChoiceItem, DeltaItem
+
+REQUEST = {
+    'provider': 'openai',
+    'model': 'gpt-4',
+    'messages': [{'role': 'user', 'content': 'hi'}],
+    'max_tokens': 10,
+    'top_p': None,
+    'seed': None,
+    'stream': True
+}
+
+
+def _chunk(content=None, finish_reason=None):
+    return ResponseCompletionChunkDTO(
+        id='chatcmpl-1',
+        created=1,
+        provider='openai',
+        model='gpt-4',
+        choices=[ChunkChoiceItem(index=0, delta=DeltaItem(content=content), finish_reason=finish_reason)]
+    )
+
+
+class FakeStreamingClient(object):
+    def __init__(self, chunks=None, error=None):
+        self.chunks = chunks or []
+        self.error = error
+
+    async def completions_stream(self, message):
+        if self.error:
+            raise self.error
+        for _chunk in self.chunks:
+            yield _chunk
+
+
+class TestChatCompletionsStream(object):
+    def test_stream_returns_server_sent_events(self):
+        fake_client = FakeStreamingClient(chunks=[_chunk('Hel'), _chunk('lo'), _chunk(finish_reason='stop')])
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client):
+            response = TestClient(app).post('/v1/chat/completions', json=REQUEST)
+
+        assert response.status_code == 200
+        assert response.headers['content-type'].startswith('text/event-stream')
+        events = [_line[len('data: '):] for _line in response.text.split('\n\n') if _line]
+        assert events[-1] == '[DONE]'
+        chunks = [json.loads(_event) for _event in events[:-1]]
+        assert [_chunk['choices'][0]['delta']['content'] for _chunk in chunks] == ['Hel', 'lo', None]
+        assert chunks[-1]['choices'][0]['finish_reason'] == 'stop'
+
+    def test_stream_upstream_error_before_first_chunk_is_an_error_response(self):
+        fake_client = FakeStreamingClient(error=InternalServerError('upstream is down'))
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client):
+            response = TestClient(app).post('/v1/chat/completions', json=REQUEST)
+
+        assert response.status_code == 500
+        assert response.json() == {'error': 'upstream is down'}
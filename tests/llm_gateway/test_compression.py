@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from sagify.llm_gateway.api.middleware import CompressionMiddleware, negotiate_encoding
+from sagify.llm_gateway.main import app
+from tests.llm_gateway.conftest import FakeEmbeddingsClient
+
+
+def _app(**kwargs):
+    test_app = FastAPI()
+    test_app.add_middleware(CompressionMiddleware, **kwargs)
+
+    @test_app.get('/text')
+    async def text(size: int):
+        return PlainTextResponse('a' * size)
+
+    @test_app.get('/events')
+    async def events():
+        async def _events():
+            for _index in range(3):
+                yield 'data: {}\n\n'.format('a' * 2048)
+        return StreamingResponse(_events(), media_type='text/event-stream')
+
+    return test_app
+
+
+class TestNegotiateEncoding(object):
+    def test_quality_then_server_preference(self):
+        assert negotiate_encoding('gzip, deflate, br, zstd', ['zstd', 'gzip']) == 'zstd'
+        assert negotiate_encoding('gzip;q=1.0, zstd;q=0.5', ['zstd', 'gzip']) == 'gzip'
+        assert negotiate_encoding('gzip;q=0, identity', ['gzip']) is None
+        assert negotiate_encoding('*', ['gzip']) == 'gzip'
+        assert negotiate_encoding('', ['zstd', 'gzip']) is None
+
+
+class TestCompressionMiddleware(object):
+    def test_large_responses_are_compressed(self):
+        client = TestClient(_app(encodings=['gzip'], minimum_size=100, executor_minimum_size=1000))
+
+        for _size in (500, 5000):
+            response = client.get('/text', params={'size': _size}, headers={'Accept-Encoding': 'gzip'})
+            assert response.headers['content-encoding'] == 'gzip'
+            assert response.headers['vary'] == 'Accept-Encoding'
+            assert int(response.headers['content-length']) < _size
+            assert response.text == 'a' * _size
+
+        small = client.get('/text', params={'size': 50}, headers={'Accept-Encoding': 'gzip'})
+        identity = client.get('/text', params={'size': 500}, headers={'Accept-Encoding': 'identity'})
+        assert 'content-encoding' not in small.headers and small.text == 'a' * 50
+        assert 'content-encoding' not in identity.headers and identity.text == 'a' * 500
+
+    def test_server_sent_events_are_not_compressed(self):
+        response = TestClient(_app(encodings=['gzip'], minimum_size=100)).get('/events', headers={'Accept-Encoding': 'gzip'})
+
+        assert 'content-encoding' not in response.headers
+        assert response.text.count('data: ') == 3
+
+    def test_zstd_is_used_if_installed(self):
+        zstandard = pytest.importorskip('zstandard')
+        client = TestClient(_app(minimum_size=100))
+
+        response = client.get('/text', params={'size': 500}, headers={'Accept-Encoding': 'zstd, gzip'})
+
+        assert response.headers['content-encoding'] == 'zstd'
+        assert zstandard.ZstdDecompressor().decompress(response.content) == b'a' * 500
+
+    def test_embeddings_are_compressed(self):
+        request = {'provider': 'sagemaker', 'model': None, 'input': ['apple', 'kiwi', 'fig']}
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=FakeEmbeddingsClient(lambda _text: [0.25] * 256)):
+            response = TestClient(app).post('/v1/embeddings', json=request, headers={'Accept-Encoding': 'gzip'})
+
+        assert response.status_code == 200
+        assert response.headers['content-encoding'] == 'gzip'
+        assert int(response.headers['content-length']) < len(response.content)
+        assert response.json()['data'][2]['embedding'] == [0.25] * 256
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import asyncio
+import base64
+import json
+
+import httpx
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
+
+from sagify.llm_gateway.api.v1.endpoints.embeddings import _response_json
+from sagify.llm_gateway.api.v1.exceptions import BadRequestError
+from sagify.llm_gateway.main import app
+from sagify.llm_gateway.providers.openai.client import OpenAIClient
+from sagify.llm_gateway.schemas.embeddings import (
+    CreateEmbeddingDTO,
+    EncodingFormat,
+    ResponseEmbeddingDTO,
+    decode_embedding,
+    encode_embedding,
+    reduce_dimensions
+)
+from sagify.llm_gateway.services import embeddings
+from sagify.llm_gateway.services.embedding_cache import EmbeddingCache, EmbeddingStore
+from tests.llm_gateway.conftest import FakeEmbeddingsClient
+
+
+class LimitedEmbeddingsClient(FakeEmbeddingsClient):
+    embeddings_max_inputs = 3
+    embeddings_max_bytes = 20
+
+    def __init__(self):
+        super(LimitedEmbeddingsClient, self).__init__(_embed, tokens_per_text=1)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def embeddings(self, embedding_input):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if 'boom' in embedding_input.input:
+                raise RuntimeError('payload too large')
+            return await super(LimitedEmbeddingsClient, self).embeddings(embedding_input)
+        finally:
+            self.in_flight -= 1
+
+
+def _vector(text):
+    return np.array([len(text), ord(text[0]), 0.5], dtype=np.float32)
+
+
+def _embed(text):
+    return _vector(text).tolist()
+
+
+def _request(input):
+    return CreateEmbeddingDTO(provider='sagemaker', model=None, input=input)
+
+
+class TestEmbeddingCache(object):
+    @pytest.mark.asyncio
+    async def test_only_misses_are_sent_upstream_and_merged_in_order(self):
+        fake_client = FakeEmbeddingsClient(_embed, tokens_per_text=1)
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.embeddings.embedding_cache', EmbeddingCache(1024 * 1024)):
+            await embeddings.embeddings(_request(['apple', 'banana']))
+            response = await embeddings.embeddings(_request(['banana', 'cherry', 'apple', 'cherry']))
+
+        assert fake_client.inputs == [['apple', 'banana'], ['cherry']]
+        assert [_item.index for _item in response.data] == [0, 1, 2, 3]
+        for _item, _text in zip(response.data, ['banana', 'cherry', 'apple', 'cherry']):
+            assert _item.embedding == _vector(_text).tolist()
+        assert response.usage.prompt_tokens == 1
+
+    @pytest.mark.asyncio
+    async def test_all_hits_do_not_call_upstream(self):
+        fake_client = FakeEmbeddingsClient(_embed, tokens_per_text=1)
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.embeddings.embedding_cache', EmbeddingCache(1024 * 1024)):
+            await embeddings.embeddings(_request('apple'))
+            response = await embeddings.embeddings(_request('apple'))
+
+        assert fake_client.inputs == [['apple']]
+        assert response.data[0].embedding == _vector('apple').tolist()
+        assert response.usage is None
+
+    @pytest.mark.asyncio
+    async def test_memory_footprint_is_bounded(self):
+        cache = EmbeddingCache(max_bytes=2 * (EmbeddingCache.ENTRY_OVERHEAD_BYTES + 12))
+        await cache.set_many(['a', 'b', 'c'], np.ones((3, 3), dtype=np.float32))
+
+        vectors = await cache.get_many(['a', 'b', 'c'])
+
+        assert [_vector is None for _vector in vectors] == [True, False, False]
+        assert cache.stats()['entries'] == 2
+
+    @pytest.mark.asyncio
+    async def test_vectors_are_persisted(self, tmp_path):
+        store_path = str(tmp_path / 'embeddings.sqlite')
+        await EmbeddingCache(1024, store=EmbeddingStore(store_path)).set_many(['a'], np.array([[0.25, 0.5]]))
+
+        vectors = await EmbeddingCache(1024, store=EmbeddingStore(store_path)).get_many(['a', 'b'])
+
+        assert vectors[0].dtype == np.float32
+        assert vectors[0].tolist() == [0.25, 0.5]
+        assert vectors[1] is None
+
+
+def _base64(values):
+    return base64.b64encode(np.array(values, dtype='<f4').tobytes()).decode('ascii')
+
+
+async def openai_upstream(request):
+    body = json.loads(request.content)
+    return httpx.Response(
+        200,
+        json={
+            'object': 'list',
+            'model': 'text-embedding-3-small',
+            'data': [{
+                'object': 'embedding',
+                'embedding': _base64([0.5, -1.0]) if body['encoding_format'] == 'base64' else [0.5, -1.0],
+                'index': 0
+            }],
+            'usage': {'prompt_tokens': 1, 'total_tokens': 1}
+        }
+    )
+
+
+class TestEmbeddingsEncoding(object):
+    def test_base64_is_little_endian_float32(self):
+        encoded = encode_embedding([0.5, -1.0], EncodingFormat.BASE64)
+
+        assert base64.b64decode(encoded) == b'\x00\x00\x00?\x00\x00\x80\xbf'
+        assert encode_embedding(encoded, EncodingFormat.FLOAT) == [0.5, -1.0]
+        assert decode_embedding(encoded).tolist() == [0.5, -1.0]
+
+    def test_response_is_built_without_validating_the_floats(self):
+        response = ResponseEmbeddingDTO.from_embeddings(
+            'sagemaker', 'model', np.ones((2, 3), dtype=np.float32), usage={'prompt_tokens': 2, 'total_tokens': 2}
+        )
+
+        assert [_item.index for _item in response.data] == [0, 1]
+        assert response.data[1].embedding == [1.0, 1.0, 1.0]
+        assert response.usage.prompt_tokens == 2
+
+    @pytest.mark.asyncio
+    async def test_openai_embeddings_are_passed_through(self):
+        bodies = []
+
+        async def _upstream(request):
+            bodies.append(json.loads(request.content))
+            return await openai_upstream(request)
+
+        with patch.dict('os.environ', {'OPENAI_API_KEY': 'test'}):
+            client = OpenAIClient()
+        client.client = AsyncOpenAI(api_key='test', http_client=httpx.AsyncClient(transport=httpx.MockTransport(_upstream)))
+        request = CreateEmbeddingDTO(provider='openai', model=None, input='hello', encoding_format='base64')
+
+        base64_response = await client.embeddings(request)
+        float_response = await client.embeddings(request.copy(update={'encoding_format': EncodingFormat.FLOAT}))
+        await client.close()
+
+        assert [_body['encoding_format'] for _body in bodies] == ['base64', 'float']
+        assert base64_response.data[0].embedding == _base64([0.5, -1.0])
+        assert float_response.data[0].embedding == [0.5, -1.0]
+        assert float_response.usage.total_tokens == 1
+
+    def test_floats_are_written_in_their_shortest_float32_form(self):
+        vectors = np.random.RandomState(0).uniform(-0.1, 0.1, (4, 256)).astype(np.float32)
+
+        response = ResponseEmbeddingDTO.from_embeddings('sagemaker', 'model', vectors)
+        body = _response_json(response)
+
+        assert [np.array(_item['embedding'], dtype=np.float32).tolist() for _item in json.loads(body)['data']] == vectors.tolist()
+        # Widened to float64, the same floats take about 20 bytes each
+        assert len(body) < vectors.size * 13
+
+    def test_api_returns_the_requested_encoding(self):
+        request = {'provider': 'sagemaker', 'model': None, 'input': ['apple', 'kiwi'], 'encoding_format': 'base64'}
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=FakeEmbeddingsClient(_embed, tokens_per_text=1)), \
+                patch('sagify.llm_gateway.services.embeddings.embedding_cache', EmbeddingCache(1024 * 1024)):
+            response = TestClient(app).post('/v1/embeddings', json=request)
+
+        assert response.status_code == 200
+        body = response.json()
+        assert [_item['index'] for _item in body['data']] == [0, 1]
+        assert decode_embedding(body['data'][1]['embedding']).tolist() == _vector('kiwi').tolist()
+        assert body['usage'] == {'prompt_tokens': 2, 'total_tokens': 2}
+
+
+class TestEmbeddingsChunking(object):
+    def test_texts_are_chunked_by_count_and_size(self):
+        assert embeddings._chunks(['a'] * 5, max_inputs=2) == [['a', 'a'], ['a', 'a'], ['a']]
+        # Texts are sized as they are written in the JSON payload, quoted and separated
+        assert embeddings._chunks(['aaaa', 'bbbb', 'cc', 'd' * 20, 'e'], max_bytes=22) == [
+            ['aaaa', 'bbbb', 'cc'], ['d' * 20], ['e']
+        ]
+        # Non-ASCII characters are escaped in the payload, e.g. as \u00e9
+        assert embeddings._chunks(['é' * 3, 'é' * 3], max_bytes=30) == [['ééé'], ['ééé']]
+        assert len(json.dumps(['é' * 3])) == 22
+        assert embeddings._chunks(['a', 'b']) == [['a', 'b']]
+
+    @pytest.mark.asyncio
+    async def test_oversized_requests_are_split_and_merged_in_order(self):
+        fake_client = LimitedEmbeddingsClient()
+        texts = ['apple', 'kiwi', 'fig', 'pear', 'plum', 'lime', 'date', 'banana', 'cherry']
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.embeddings.CHUNK_MAX_CONCURRENCY', 2):
+            response = await embeddings._embeddings(_request(texts))
+
+        assert fake_client.inputs == [['apple', 'kiwi'], ['fig', 'pear'], ['plum', 'lime'], ['date', 'banana'], ['cherry']]
+        assert fake_client.max_in_flight == 2
+        assert [_item.index for _item in response.data] == list(range(len(texts)))
+        for _item, _text in zip(response.data, texts):
+            assert _item.embedding == _vector(_text).tolist()
+        assert response.usage.total_tokens == len(texts)
+
+    @pytest.mark.asyncio
+    async def test_failed_chunk_fails_the_request(self):
+        fake_client = LimitedEmbeddingsClient()
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client):
+            with pytest.raises(RuntimeError):
+                await embeddings._embeddings(_request(['boom', 'a', 'b', 'c', 'd', 'e', 'f']))
+            await asyncio.sleep(0.05)
+
+        assert fake_client.in_flight == 0
+
+
+class TestEmbeddingsDimensions(object):
+    def test_embeddings_are_truncated_and_normalized(self):
+        vectors = np.array([[3.0, 4.0, 12.0], [0.0, 0.0, 1.0]], dtype=np.float32)
+
+        reduced = reduce_dimensions(vectors, 2)
+
+        assert reduced.dtype == np.float32
+        assert reduced.tolist() == [[0.6000000238418579, 0.800000011920929], [0.0, 0.0]]
+
+    @pytest.mark.asyncio
+    async def test_dimensions_are_reduced_by_the_gateway(self):
+        fake_client = FakeEmbeddingsClient(_embed, tokens_per_text=1)
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.embeddings.embedding_cache', EmbeddingCache(1024 * 1024)):
+            full = await embeddings.embeddings(_request(['melon']))
+            reduced = await embeddings.embeddings(_request(['melon']).copy(update={'dimensions': 2}))
+            with pytest.raises(BadRequestError):
+                await embeddings.embeddings(_request(['melon']).copy(update={'dimensions': 4}))
+
+        assert fake_client.inputs == [['melon'], ['melon'], ['melon']]
+        assert len(full.data[0].embedding) == 3
+        assert np.array(reduced.data[0].embedding, dtype=np.float32).tolist() == \
+            reduce_dimensions(_vector('melon')[np.newaxis], 2)[0].tolist()
+
+    @pytest.mark.asyncio
+    async def test_dimensions_are_passed_to_openai(self):
+        bodies = []
+
+        async def _upstream(request):
+            bodies.append(json.loads(request.content))
+            return await openai_upstream(request)
+
+        with patch.dict('os.environ', {'OPENAI_API_KEY': 'test'}):
+            client = OpenAIClient()
+        client.client = AsyncOpenAI(api_key='test', http_client=httpx.AsyncClient(transport=httpx.MockTransport(_upstream)))
+        request = CreateEmbeddingDTO(provider='openai', model='text-embedding-3-small', input='hello', dimensions=2)
+
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=client):
+            response = await embeddings._embeddings(request)
+        await client.close()
+
+        assert bodies[0]['dimensions'] == 2
+        assert response.data[0].embedding == [0.5, -1.0]
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from botocore.exceptions import ClientError
+import pytest
+from fastapi.testclient import TestClient
+
+from sagify.llm_gateway.core.metrics import ModelLabels
+from sagify.llm_gateway.core.resilience import Resilience, ResiliencePolicy
+from sagify.llm_gateway.main import app
+from sagify.llm_gateway.providers.aws.sagemaker import SageMakerClient
+from sagify.llm_gateway.providers.registry import LLMClientRegistry
+
+
+class FakeSageMaker(object):
+    def __init__(self, statuses):
+        self.statuses = statuses
+
+    def describe_endpoint(self, EndpointName):
+        status = self.statuses.get(EndpointName)
+        if status is None:
+            raise ClientError(
+                {'Error': {'Code': 'ValidationException', 'Message': 'Could not find endpoint'}}, 'DescribeEndpoint'
+            )
+        return {'EndpointName': EndpointName, 'EndpointStatus': status}
+
+    def close(self):
+        pass
+
+
+class PingSageMakerRuntime(object):
+    def __init__(self, failing_endpoints=()):
+        self.pings = []
+        self._failing_endpoints = failing_endpoints
+
+    def invoke_endpoint(self, **kwargs):
+        self.pings.append((kwargs['EndpointName'], json.loads(kwargs['Body'])))
+        if kwargs['EndpointName'] in self._failing_endpoints:
+            raise RuntimeError('endpoint is down')
+        return {'Body': io.BytesIO(b'{}')}
+
+    def close(self):
+        pass
+
+
+def _client(statuses, failing_endpoints=(), **env):
+    with patch.dict('os.environ', dict({
+        'SM_ENDPOINT_POOLS': json.dumps({'llama': ['llama-a', 'llama-b', 'llama-c']}),
+        'SM_CHAT_COMPLETIONS_MODEL': 'llama',
+        'SM_EMBEDDINGS_MODEL': 'embedder',
+    }, **env)):
+        client = SageMakerClient()
+    client._sagemaker_clients[None] = FakeSageMaker(statuses)
+    client.sagemaker_runtime_client = PingSageMakerRuntime(failing_endpoints)
+    return client
+
+
+class TestEndpointHealthMonitor(object):
+    @pytest.mark.asyncio
+    async def test_unhealthy_endpoints_are_taken_out_of_their_pool(self):
+        client = _client(
+            {'llama-a': 'InService', 'llama-b': 'Failed', 'llama-c': 'InService', 'embedder': 'InService'},
+            failing_endpoints=['llama-c'],
+            SM_HEALTH_CHECK_PING_PAYLOADS=json.dumps({'llama': {'inputs': 'ping'}})
+        )
+
+        await client.health_monitor.check()
+        pool = client._endpoint_pools['llama']
+        picked = {pool.pick().name for _ in range(10)}
+        health = client.health()
+        await client.close()
+
+        assert picked == {'llama-a'}
+        assert sorted(client.sagemaker_runtime_client.pings) == [('llama-a', {'inputs': 'ping'}), ('llama-c', {'inputs': 'ping'})]
+        statuses = {_endpoint['name']: (_endpoint['status'], _endpoint['healthy']) for _endpoint in health['endpoints']}
+        assert statuses == {
+            'llama-a': ('InService', True),
+            'llama-b': ('Failed', False),
+            'llama-c': ('PingFailed', False),
+            'embedder': ('InService', True),
+        }
+        assert not health['healthy']
+        assert health['endpoints'][0]['probe_latency_seconds'] is not None
+
+    @pytest.mark.asyncio
+    async def test_endpoints_recover_and_unreadable_statuses_are_ignored(self):
+        statuses = {'llama-a': 'InService', 'llama-b': 'InService', 'llama-c': 'Creating'}
+        client = _client(statuses)
+
+        await client.health_monitor.check()
+        assert [_endpoint.healthy for _endpoint in client._endpoint_pools['llama'].endpoints] == [True, True, False]
+        assert client.health_monitor.endpoints[-1].status == 'NotFound'
+
+        statuses['llama-c'] = 'InService'
+        client._sagemaker_clients[None] = object()
+        await client.health_monitor.check()
+        assert client.health_monitor.endpoints[2].healthy is False
+
+        client._sagemaker_clients[None] = FakeSageMaker(statuses)
+        await client.health_monitor.check()
+        await client.close()
+        assert client.health_monitor.endpoints[2].healthy is True
+
+    @pytest.mark.asyncio
+    async def test_endpoints_in_other_regions_are_checked_with_their_own_client(self):
+        client = _client({}, SM_ENDPOINT_POOLS=json.dumps({'llama': ['llama-a', {'name': 'llama-b', 'region': 'eu-west-1'}]}))
+        client._sagemaker_clients['eu-west-1'] = FakeSageMaker({'llama-b': 'InService'})
+
+        await client.health_monitor.check()
+        await client.close()
+
+        assert [_endpoint.status for _endpoint in client._endpoint_pools['llama'].endpoints] == ['NotFound', 'InService']
+
+
+class TestHealthRoute(object):
+    def test_health_reports_the_upstreams(self):
+        client = _client({'llama-a': 'InService', 'llama-b': 'InService', 'llama-c': 'Failed', 'embedder': 'InService'})
+        registry = LLMClientRegistry(providers=[])
+        registry._clients['sagemaker'] = client
+
+        with patch('sagify.llm_gateway.api.monitoring.registry', registry):
+            with TestClient(app) as test_client:
+                test_client.portal.call(client.health_monitor.check)
+                response = test_client.get('/health')
+
+        assert response.status_code == 200
+        assert response.json()['status'] == 'degraded'
+        assert len(response.json()['upstreams']['sagemaker']['endpoints']) == 4
+
+    def test_open_breakers_degrade_the_health(self):
+        resilience = Resilience(default_policy=ResiliencePolicy(failure_threshold=1))
+        with patch('sagify.llm_gateway.core.resilience.model_labels', ModelLabels(['gpt-4o'])):
+            resilience.breaker('openai', 'gpt-4o').record_failure()
+
+        with patch('sagify.llm_gateway.api.monitoring.resilience', resilience):
+            response = TestClient(app).get('/health')
+
+        assert response.status_code == 200
+        assert response.json()['status'] == 'degraded'
+        assert response.json()['resilience']['openai']['circuit_breakers']['gpt-4o']['state'] == 'open'
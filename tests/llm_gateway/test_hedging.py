@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+
+from sagify.llm_gateway.api.v1.exceptions import BadRequestError, GatewayTimeoutError, InternalServerError
+from sagify.llm_gateway.schemas.chat import CreateCompletionDTO
+from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO
+from sagify.llm_gateway.services import embeddings
+from sagify.llm_gateway.services.cache import MemoryCacheBackend, ResponseCache
+from sagify.llm_gateway.services.embedding_cache import EmbeddingCache
+from sagify.llm_gateway.services.hedging import Hedger, HedgingPolicy, create_hedger
+from tests.llm_gateway.conftest import FakeEmbeddingsClient
+
+REQUEST = CreateCompletionDTO(
+    provider='sagemaker',
+    model='llama',
+    messages=[{'role': 'user', 'content': 'hi'}],
+    max_tokens=10,
+    top_p=None,
+    seed=None
+)
+
+
+class Answer(str):
+    _served_by_fallback = False
+
+
+class FakeTargets(object):
+    """
+    Answers with the provider of the request after the latency configured for it, or fails
+    """
+    def __init__(self, latencies, failing=(), invalid=()):
+        self.latencies = latencies
+        self.failing = failing
+        self.invalid = invalid
+        self.calls = []
+        self.cancelled = []
+
+    async def __call__(self, request):
+        self.calls.append(request.provider)
+        try:
+            await asyncio.sleep(self.latencies.get(request.provider, 0))
+        except asyncio.CancelledError:
+            self.cancelled.append(request.provider)
+            raise
+        if request.provider in self.failing:
+            raise InternalServerError('{} failed'.format(request.provider))
+        if request.provider in self.invalid:
+            raise BadRequestError('Invalid request')
+        return Answer(request.provider)
+
+
+class FlakyEmbeddingsClient(FakeEmbeddingsClient):
+    """
+    Embeds every text with the provider of the request, and fails on the primary while it's down
+    """
+    def __init__(self):
+        super(FlakyEmbeddingsClient, self).__init__()
+        self.primary_down = True
+
+    async def embeddings(self, embedding_input):
+        if embedding_input.provider == 'sagemaker' and self.primary_down:
+            raise InternalServerError('sagemaker failed')
+        self._embed = lambda _text: [1.0 if embedding_input.provider == 'sagemaker' else -1.0]
+        return await super(FlakyEmbeddingsClient, self).embeddings(embedding_input)
+
+
+def _hedger(**policy):
+    return Hedger({('chat', 'sagemaker', None): HedgingPolicy([('openai', 'gpt-4')], **policy)}, min_samples=3)
+
+
+class TestHedger(object):
+    @pytest.mark.asyncio
+    async def test_requests_without_policy_call_the_provider_only(self):
+        targets = FakeTargets({})
+
+        assert await Hedger({}).call('chat', REQUEST, 'llama', targets) == 'sagemaker'
+        assert targets.calls == ['sagemaker']
+
+    @pytest.mark.asyncio
+    async def test_fast_primary_is_not_hedged(self):
+        targets = FakeTargets({'sagemaker': 0.01})
+
+        assert await _hedger(hedge_delay=0.2).call('chat', REQUEST, 'llama', targets) == 'sagemaker'
+        assert targets.calls == ['sagemaker']
+
+    @pytest.mark.asyncio
+    async def test_slow_primary_is_hedged_and_cancelled(self):
+        targets = FakeTargets({'sagemaker': 1, 'openai': 0.01})
+
+        answer = await _hedger(hedge_delay=0.05).call('chat', REQUEST, 'llama', targets)
+
+        assert answer == 'openai' and answer._served_by_fallback
+        await asyncio.sleep(0)
+        assert targets.calls == ['sagemaker', 'openai']
+        assert targets.cancelled == ['sagemaker']
+
+    @pytest.mark.asyncio
+    async def test_failing_primary_falls_back_without_waiting(self):
+        targets = FakeTargets({}, failing=['sagemaker'])
+
+        result = await asyncio.wait_for(_hedger(hedge_delay=10).call('chat', REQUEST, 'llama', targets), timeout=1)
+
+        assert result == 'openai'
+        assert targets.calls == ['sagemaker', 'openai']
+
+    @pytest.mark.asyncio
+    async def test_client_errors_do_not_fall_back(self):
+        targets = FakeTargets({'openai': 1}, invalid=['sagemaker'])
+
+        with pytest.raises(BadRequestError):
+            await _hedger(hedge_delay=10).call('chat', REQUEST, 'llama', targets)
+        assert targets.calls == ['sagemaker']
+
+        # Nor do they wait for a hedged call in flight
+        targets = FakeTargets({'sagemaker': 0.05, 'openai': 1}, invalid=['sagemaker'])
+        with pytest.raises(BadRequestError):
+            await asyncio.wait_for(_hedger(hedge_delay=0.01).call('chat', REQUEST, 'llama', targets), timeout=0.5)
+        await asyncio.sleep(0)
+        assert targets.cancelled == ['openai']
+
+    @pytest.mark.asyncio
+    async def test_last_error_is_raised_when_every_target_fails(self):
+        targets = FakeTargets({}, failing=['sagemaker', 'openai'])
+
+        with pytest.raises(InternalServerError) as exc_info:
+            await _hedger().call('chat', REQUEST, 'llama', targets)
+        assert exc_info.value.detail == 'openai failed'
+
+    @pytest.mark.asyncio
+    async def test_exceeding_the_budget_raises_a_gateway_timeout(self):
+        targets = FakeTargets({'sagemaker': 1, 'openai': 1})
+
+        with pytest.raises(GatewayTimeoutError):
+            await _hedger(hedge_delay=0.01, budget=0.05).call('chat', REQUEST, 'llama', targets)
+        await asyncio.sleep(0)
+        assert sorted(targets.cancelled) == ['openai', 'sagemaker']
+
+    @pytest.mark.asyncio
+    async def test_hedge_delay_follows_the_primary_latency_percentile(self):
+        hedger = _hedger(hedge_percentile=50, hedge_delay=10)
+        policy = hedger.policy('chat', 'sagemaker', 'llama')
+        assert hedger.hedge_delay('chat', 'sagemaker', 'llama', policy) == 10
+
+        for _latency in (0.01, 0.02, 0.03):
+            await hedger.call('chat', REQUEST, 'llama', FakeTargets({'sagemaker': _latency}))
+
+        assert hedger.hedge_delay('chat', 'sagemaker', 'llama', policy) == pytest.approx(0.02, abs=0.01)
+
+    def test_policies_are_created_from_the_environment(self):
+        policies = json.dumps([{
+            'endpoint': 'chat',
+            'provider': 'sagemaker',
+            'fallbacks': [{'provider': 'openai', 'model': 'gpt-4'}, {'provider': 'anthropic'}],
+            'hedge_delay_ms': 500,
+            'budget_ms': 5000
+        }])
+        with patch.dict('os.environ', {'HEDGING_POLICIES': policies}):
+            hedger = create_hedger()
+
+        policy = hedger.policy('chat', 'sagemaker', 'any-model')
+        assert policy.fallbacks == [('openai', 'gpt-4'), ('anthropic', None)]
+        assert (policy.hedge_delay, policy.budget) == (0.5, 5)
+        assert hedger.policy('embeddings', 'sagemaker', 'any-model') is None
+
+
+class TestHedgedCaching(object):
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('embedding_cache, response_cache', [
+        (EmbeddingCache(1024 * 1024), ResponseCache(None)),
+        (EmbeddingCache(0), ResponseCache(MemoryCacheBackend())),
+    ])
+    async def test_responses_of_fallback_targets_are_not_cached(self, embedding_cache, response_cache):
+        fake_client = FlakyEmbeddingsClient()
+        hedger = Hedger({('embeddings', 'sagemaker', None): HedgingPolicy([('openai', 'embeddings-model')])})
+        request = CreateEmbeddingDTO(provider='sagemaker', model=None, input=['apple'])
+
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.embeddings.hedger', hedger), \
+                patch('sagify.llm_gateway.services.embeddings.embedding_cache', embedding_cache), \
+                patch('sagify.llm_gateway.services.embeddings.response_cache', response_cache):
+            fallback = await embeddings.embeddings(request)
+            fake_client.primary_down = False
+            primary = await embeddings.embeddings(request)
+            cached = await embeddings.embeddings(request)
+
+        assert [fallback.data[0].embedding, primary.data[0].embedding, cached.data[0].embedding] == [[-1.0], [1.0], [1.0]]
+        assert fake_client.inputs == [['apple'], ['apple']]
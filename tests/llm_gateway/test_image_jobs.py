@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+from contextlib import contextmanager
+import asyncio
+import io
+import json
+import time
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from botocore.exceptions import ClientError
+import pytest
+from fastapi.testclient import TestClient
+
+from sagify.llm_gateway.api.v1.exceptions import InternalServerError
+from sagify.llm_gateway.core.jobs import JobStore
+from sagify.llm_gateway.core.resilience import Resilience, ResiliencePolicy
+from sagify.llm_gateway.main import app
+from sagify.llm_gateway.providers.aws.sagemaker import SageMakerClient
+from sagify.llm_gateway.schemas.images import CreateImageDTO, ResponseImageDTO
+from sagify.llm_gateway.services import upstream
+from sagify.llm_gateway.services.image_jobs import ImageJobRunner
+from tests.llm_gateway.conftest import wait_until_done
+
+
+class FakeClient(object):
+    def __init__(self, error=None):
+        self.error = error
+
+    def default_model(self, endpoint):
+        return '{}-model'.format(endpoint)
+
+    async def generations(self, image_input):
+        await asyncio.sleep(0.05)
+        if self.error is not None:
+            raise self.error
+        return ResponseImageDTO(
+            provider=image_input.provider,
+            model='images-model',
+            created=1,
+            data=[{'b64_json': 'aW1hZ2U='} for _ in range(image_input.n)]
+        )
+
+
+class RecordingWebhookClient(object):
+    posts = []
+
+    def __init__(self, timeout):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def post(self, url, content, headers):
+        self.posts.append((url, json.loads(content)))
+        return type('Response', (object,), {'status_code': 200})()
+
+
+class FakeS3(object):
+    """
+    Stand-in of S3 where the objects written by an Async Inference endpoint show up after a few reads
+    """
+    def __init__(self, reads_until_ready=3):
+        self.objects = {}
+        self.pending = {}
+        self.reads_until_ready = reads_until_ready
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body.encode('utf-8') if isinstance(Body, str) else Body
+
+    def get_object(self, Bucket, Key):
+        self.reads_until_ready -= 1
+        if self.reads_until_ready <= 0:
+            self.objects.update(self.pending)
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'Not found'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def close(self):
+        pass
+
+
+class AsyncInferenceSageMakerRuntime(object):
+    def __init__(self, s3, fail=False):
+        self.s3 = s3
+        self.fail = fail
+        self.invocations = []
+
+    def invoke_endpoint_async(self, **kwargs):
+        self.invocations.append(kwargs)
+        bucket, _, key = kwargs['InputLocation'][len('s3://'):].partition('/')
+        body = json.loads(self.s3.objects[(bucket, key)])
+        if self.fail:
+            self.s3.pending[(bucket, 'failure')] = b'Out of memory'
+        else:
+            images = ['aW1hZ2U=' for _ in range(body['num_images_per_prompt'])]
+            self.s3.pending[(bucket, 'output')] = json.dumps({'generated_images': images}).encode('utf-8')
+        return {
+            'InferenceId': 'inference-1',
+            'OutputLocation': 's3://{}/output'.format(bucket),
+            'FailureLocation': 's3://{}/failure'.format(bucket)
+        }
+
+    def close(self):
+        pass
+
+
+def _image_request(**kwargs):
+    return dict({
+        'provider': 'sagemaker',
+        'model': None,
+        'prompt': 'a cat',
+        'n': 2,
+        'width': 64,
+        'height': 64,
+        'seed': None,
+        'response_format': 'b64_json'
+    }, **kwargs)
+
+
+@contextmanager
+def _patched(fake_client, runner):
+    with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+            patch('sagify.llm_gateway.api.v1.endpoints.images.image_job_runner', runner), \
+            patch('sagify.llm_gateway.api.v1.endpoints.images.job_store', runner._store), \
+            patch('sagify.llm_gateway.services.image_jobs.httpx.AsyncClient', RecordingWebhookClient), \
+            TestClient(app) as client:
+        yield client
+
+
+class TestImageJobs(object):
+    def test_job_result_is_polled_and_posted_to_the_webhook(self, tmp_path):
+        runner = ImageJobRunner(JobStore(str(tmp_path)), webhook_hosts=['hooks.example.com'])
+        RecordingWebhookClient.posts = []
+
+        with _patched(FakeClient(), runner) as client:
+            response = client.post(
+                '/v1/images/generations',
+                json=_image_request(),
+                params={'async': 'true', 'webhook_url': 'https://hooks.example.com/images'}
+            )
+            assert response.status_code == 202
+            assert response.json()['status'] == 'in_progress'
+            job = wait_until_done(client, '/v1/images/generations/{}'.format(response.json()['id']))
+            deadline = time.time() + 5
+            while not RecordingWebhookClient.posts and time.time() < deadline:
+                time.sleep(0.02)
+
+        assert job['status'] == 'completed'
+        assert [_item['b64_json'] for _item in job['result']['data']] == ['aW1hZ2U=', 'aW1hZ2U=']
+        url, posted_job = RecordingWebhookClient.posts[0]
+        assert url == 'https://hooks.example.com/images'
+        assert posted_job['id'] == job['id'] and posted_job['result'] == job['result']
+
+    def test_failed_job_reports_the_error(self, tmp_path):
+        runner = ImageJobRunner(JobStore(str(tmp_path)))
+
+        with _patched(FakeClient(error=InternalServerError('endpoint is down')), runner) as client:
+            response = client.post('/v1/images/generations', json=_image_request(), params={'async': 'true'})
+            job = wait_until_done(client, '/v1/images/generations/{}'.format(response.json()['id']))
+            not_allowed = client.post(
+                '/v1/images/generations',
+                json=_image_request(),
+                params={'async': 'true', 'webhook_url': 'http://169.254.169.254/latest'}
+            )
+
+        assert (job['status'], job['error'], job['result']) == ('failed', 'endpoint is down', None)
+        assert not_allowed.status_code == 400
+
+    def test_unknown_job_is_not_found(self):
+        response = TestClient(app).get('/v1/images/generations/image_{}'.format('0' * 32))
+
+        assert response.status_code == 404
+
+
+class TestSageMakerAsyncInference(object):
+    def _client(self, fail=False, reads_until_ready=3):
+        with patch.dict('os.environ', {
+            'SM_ASYNC_INFERENCE_MODELS': 'sd-async',
+            'SM_ASYNC_INFERENCE_POLL_INTERVAL_MS': '10',
+            'S3_BUCKET_NAME': 'bucket'
+        }):
+            client = SageMakerClient()
+        client.s3_client = FakeS3(reads_until_ready)
+        client.sagemaker_runtime_client = AsyncInferenceSageMakerRuntime(client.s3_client, fail=fail)
+        return client
+
+    @pytest.mark.asyncio
+    async def test_images_are_generated_through_s3(self):
+        client = self._client()
+        request = CreateImageDTO(**_image_request(model='sd-async'))
+
+        response = await client.generations(request)
+        await client.close()
+
+        invocation = client.sagemaker_runtime_client.invocations[0]
+        assert invocation['EndpointName'] == 'sd-async'
+        assert invocation['InputLocation'].startswith('s3://bucket/async-inference/inputs/')
+        assert [_item.b64_json for _item in response.data] == ['aW1hZ2U=', 'aW1hZ2U=']
+
+    @pytest.mark.asyncio
+    async def test_failure_location_fails_the_generation(self):
+        client = self._client(fail=True)
+
+        with pytest.raises(InternalServerError) as e:
+            await client.generations(CreateImageDTO(**_image_request(model='sd-async')))
+        await client.close()
+
+        assert 'Out of memory' in e.value.detail
+
+    @pytest.mark.asyncio
+    async def test_read_timeout_is_that_of_the_async_inference(self):
+        resilience = Resilience(default_policy=ResiliencePolicy(read_timeout=0.05))
+        with patch('sagify.llm_gateway.providers.aws.sagemaker.resilience', resilience), \
+                patch('sagify.llm_gateway.services.upstream.resilience', resilience):
+            # The output shows up after about 0.1 seconds of polling
+            client = self._client(reads_until_ready=12)
+            request = CreateImageDTO(**_image_request(model='sd-async'))
+
+            response = await upstream.call('images', 'sagemaker', 'sd-async', lambda: client.generations(request))
+        await client.close()
+
+        assert len(response.data) == 2
+        assert resilience.policy('sagemaker', 'sd-async').read_timeout > 900
+        assert resilience.policy('sagemaker', 'sd').read_timeout == 0.05
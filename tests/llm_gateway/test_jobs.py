@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+
+import pytest
+
+from sagify.llm_gateway.core.jobs import JobStore
+
+
+class TestJobStore(object):
+    @pytest.mark.asyncio
+    async def test_files_are_written_off_the_event_loop_in_order(self, tmp_path):
+        store = JobStore(str(tmp_path))
+        threads = []
+        write_file = store._write_file
+
+        def _write_file(path, content, append):
+            threads.append(threading.current_thread().name)
+            write_file(path, content, append)
+
+        store._write_file = _write_file
+        job = await store.create('image', total=1)
+        await store.write(job.id, '.result.json', 'a' * 1024)
+        await store.write(job.id, '.result.json', b'b', append=True)
+        job.finish('completed')
+        await store.save(job, force=True)
+
+        assert threads and all(_thread.startswith('jobs') for _thread in threads)
+        with open(store.path(job.id, '.result.json')) as f:
+            assert f.read() == 'a' * 1024 + 'b'
+        with open(store.path(job.id, '.json')) as f:
+            assert json.load(f)['status'] == 'completed'
+        assert store.get(job.id).status == 'completed'
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from sagify.llm_gateway.main import start_server
+
+
+class TestStartServer(object):
+    def test_settings_are_read_from_env_variables(self):
+        with patch('uvicorn.run') as mocked_run, patch.dict('os.environ', {
+            'GATEWAY_WORKERS': '4',
+            'GATEWAY_LOOP': 'uvloop',
+            'GATEWAY_HTTP': 'httptools',
+            'GATEWAY_BACKLOG': '4096',
+            'GATEWAY_KEEP_ALIVE_IN_SECONDS': '30',
+            'GATEWAY_LIMIT_CONCURRENCY': '1000'
+        }):
+            start_server(8000)
+
+        mocked_run.assert_called_once_with(
+            'sagify.llm_gateway.main:app',
+            port=8000,
+            host='0.0.0.0',
+            workers=4,
+            loop='uvloop',
+            http='httptools',
+            backlog=4096,
+            timeout_keep_alive=30,
+            limit_concurrency=1000
+        )
+
+    def test_arguments_override_env_variables(self):
+        with patch('uvicorn.run') as mocked_run, patch.dict('os.environ', {'GATEWAY_WORKERS': '4'}), \
+                patch('os.cpu_count', return_value=8):
+            start_server(8000, workers='auto', loop='asyncio')
+
+        assert mocked_run.call_args[1]['workers'] == 8
+        assert mocked_run.call_args[1]['loop'] == 'asyncio'
+        assert mocked_run.call_args[1]['limit_concurrency'] is None
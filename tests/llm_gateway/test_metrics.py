@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from fastapi.testclient import TestClient
+
+from sagify.llm_gateway.api.v1.exceptions import BadRequestError
+from sagify.llm_gateway.core.metrics import MetricsRegistry, ModelLabels
+from sagify.llm_gateway.main import app
+from sagify.llm_gateway.schemas.chat import ResponseCompletionDTO
+
+
+class FakeChatClient(object):
+    def default_model(self, endpoint):
+        return 'gpt-4'
+
+    async def completions(self, message):
+        return ResponseCompletionDTO(
+            id='chatcmpl-1',
+            object='chat.completion',
+            created=1,
+            provider='openai',
+            model='gpt-4',
+            choices=[{'index': 0, 'message': {'role': 'assistant', 'content': 'hi'}, 'finish_reason': 'stop'}],
+            usage={'prompt_tokens': 3, 'total_tokens': 5}
+        )
+
+
+class FailingChatClient(object):
+    def default_model(self, endpoint):
+        return 'gpt-4'
+
+    async def completions(self, message):
+        raise BadRequestError('The model {} does not exist'.format(message.model))
+
+
+class TestMetricsRegistry(object):
+    def test_histogram_is_rendered_with_cumulative_buckets(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('latency_seconds', 'Latency', ['route'], buckets=(0.1, 1.0))
+        histogram.observe(0.05, '/a')
+        histogram.observe(0.5, '/a')
+        histogram.observe(5, '/a')
+
+        assert registry.render().splitlines() == [
+            '# HELP latency_seconds Latency',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{route="/a",le="0.1"} 1',
+            'latency_seconds_bucket{route="/a",le="1.0"} 2',
+            'latency_seconds_bucket{route="/a",le="+Inf"} 3',
+            'latency_seconds_sum{route="/a"} 5.55',
+            'latency_seconds_count{route="/a"} 3',
+        ]
+
+    def test_label_values_are_escaped(self):
+        registry = MetricsRegistry()
+        registry.counter('errors_total', 'Errors', ['model']).inc('a"b\\c')
+
+        assert 'errors_total{model="a\\"b\\\\c"} 1' in registry.render()
+
+
+class TestMetricsEndpoint(object):
+    def test_request_upstream_and_token_metrics_are_exported(self):
+        client = TestClient(app)
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=FakeChatClient()):
+            response = client.post('/v1/chat/completions', json={
+                'provider': 'openai',
+                'model': None,
+                'messages': [{'role': 'user', 'content': 'hi'}],
+                'temperature': 0.5,
+                'max_tokens': 10,
+                'top_p': None,
+                'seed': None
+            })
+        assert response.status_code == 200
+
+        metrics = client.get('/metrics').text
+
+        assert 'gateway_request_duration_seconds_count{route="/v1/chat/completions",provider="openai",model="gpt-4"}' \
+            in metrics
+        assert 'gateway_upstream_duration_seconds_count{endpoint="chat",provider="openai",model="gpt-4"}' in metrics
+        assert 'gateway_tokens_total{provider="openai",model="gpt-4",type="completion"}' in metrics
+        assert 'gateway_requests_in_flight 1' in metrics
+
+    def test_unknown_models_are_labeled_other(self):
+        client = TestClient(app)
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=FailingChatClient()), \
+                patch('sagify.llm_gateway.api.middleware.model_labels', ModelLabels()), \
+                patch('sagify.llm_gateway.services.upstream.model_labels', ModelLabels()):
+            for _index in range(3):
+                response = client.post('/v1/chat/completions', json={
+                    'provider': 'openai',
+                    'model': 'random-model-{}'.format(_index),
+                    'messages': [{'role': 'user', 'content': 'hi'}],
+                    'temperature': 0.5,
+                    'max_tokens': 10,
+                    'top_p': None,
+                    'seed': None
+                })
+                assert response.status_code == 400
+
+        metrics = client.get('/metrics').text
+
+        assert 'random-model' not in metrics
+        assert 'gateway_upstream_errors_total{endpoint="chat",provider="openai",model="other"} 3' in metrics
+        assert 'gateway_request_duration_seconds_count{route="/v1/chat/completions",provider="openai",model="other"} 3' \
+            in metrics
+
+
+class TestModelLabels(object):
+    def test_configured_and_learned_models_get_their_own_label(self):
+        labels = ModelLabels(['llama'], max_learned=1)
+        labels.configure('mistral', None)
+        labels.learn('gpt-4o')
+        labels.learn('gpt-4o-mini')
+
+        assert [labels.label(_model) for _model in ('llama', 'mistral', 'gpt-4o', 'gpt-4o-mini', None)] == \
+            ['llama', 'mistral', 'gpt-4o', 'other', '']
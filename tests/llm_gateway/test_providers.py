@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import base64
+import io
+import json
+import time
+from types import SimpleNamespace
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+from PIL import Image
+
+from sagify.llm_gateway.providers.anthropic.client import AnthropicClient
+from sagify.llm_gateway.providers.aws.sagemaker import SageMakerClient
+from sagify.llm_gateway.providers.openai.client import OpenAIClient
+from sagify.llm_gateway.schemas.chat import CreateCompletionDTO, MessageItem
+from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO
+from sagify.llm_gateway.schemas.images import CreateImageDTO
+
+UPSTREAM_LATENCY = 0.2
+CONCURRENT_REQUESTS = 10
+
+
+class SlowSageMakerRuntime(object):
+    def __init__(self):
+        self.calls = 0
+
+    def invoke_endpoint(self, **kwargs):
+        self.calls += 1
+        time.sleep(UPSTREAM_LATENCY)
+        inputs = json.loads(kwargs['Body'])
+        return {'Body': io.BytesIO(json.dumps({'embedding': [[0.1, 0.2] for _ in inputs]}).encode('utf-8'))}
+
+    def close(self):
+        pass
+
+
+class StreamingSageMakerRuntime(object):
+    def __init__(self, payload_parts):
+        self.payload_parts = payload_parts
+        self.body = None
+
+    def invoke_endpoint_with_response_stream(self, **kwargs):
+        self.body = json.loads(kwargs['Body'])
+        return {'Body': iter([{'PayloadPart': {'Bytes': _part}} for _part in self.payload_parts])}
+
+    def close(self):
+        pass
+
+
+class ImagesSageMakerRuntime(object):
+    def __init__(self, images):
+        self.images = images
+
+    def invoke_endpoint(self, **kwargs):
+        body = {'generated_images': [base64.b64encode(_image).decode('utf-8') for _image in self.images]}
+        return {'Body': io.BytesIO(json.dumps(body).encode('utf-8'))}
+
+    def close(self):
+        pass
+
+
+class SlowS3(object):
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        time.sleep(UPSTREAM_LATENCY)
+        self.objects[Key] = (Body, ContentType)
+
+    def generate_presigned_url(self, method, Params, ExpiresIn):
+        return 'https://s3/{}'.format(Params['Key'])
+
+    def close(self):
+        pass
+
+
+def _encoded_image(image_format):
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4)).save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+async def slow_openai_upstream(request):
+    await asyncio.sleep(UPSTREAM_LATENCY)
+    return httpx.Response(
+        200,
+        json={
+            'object': 'list',
+            'model': 'text-embedding-3-small',
+            'data': [{'object': 'embedding', 'embedding': [0.1, 0.2], 'index': 0}],
+            'usage': {'prompt_tokens': 1, 'total_tokens': 1}
+        }
+    )
+
+
+class StreamingAnthropic(object):
+    def __init__(self, events):
+        self.messages = self
+        self._events = events
+
+    async def create(self, **kwargs):
+        return self._stream()
+
+    async def _stream(self):
+        for _event in self._events:
+            yield _event
+
+
+class TestAsyncProviders(object):
+    @pytest.mark.asyncio
+    async def test_sagemaker_concurrent_requests_overlap(self):
+        client = SageMakerClient()
+        client.sagemaker_runtime_client = SlowSageMakerRuntime()
+        request = CreateEmbeddingDTO(provider='sagemaker', model='embeddings-endpoint', input=['hello'])
+
+        start = time.monotonic()
+        responses = await asyncio.gather(*[client.embeddings(request) for _ in range(CONCURRENT_REQUESTS)])
+        elapsed = time.monotonic() - start
+        await client.close()
+
+        assert len(responses) == CONCURRENT_REQUESTS
+        assert client.sagemaker_runtime_client.calls == CONCURRENT_REQUESTS
+        assert elapsed < UPSTREAM_LATENCY * CONCURRENT_REQUESTS / 2
+
+    @pytest.mark.asyncio
+    async def test_openai_concurrent_requests_overlap(self):
+        with patch.dict('os.environ', {'OPENAI_API_KEY': 'test'}):
+            client = OpenAIClient()
+        client.client = AsyncOpenAI(
+            api_key='test',
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(slow_openai_upstream))
+        )
+        request = CreateEmbeddingDTO(provider='openai', model='text-embedding-3-small', input='hello')
+
+        start = time.monotonic()
+        responses = await asyncio.gather(*[client.embeddings(request) for _ in range(CONCURRENT_REQUESTS)])
+        elapsed = time.monotonic() - start
+        await client.close()
+
+        assert len(responses) == CONCURRENT_REQUESTS
+        assert elapsed < UPSTREAM_LATENCY * CONCURRENT_REQUESTS / 2
+
+    @pytest.mark.asyncio
+    async def test_sagemaker_streams_tokens_split_across_payload_parts(self):
+        client = SageMakerClient()
+        client.sagemaker_runtime_client = StreamingSageMakerRuntime([
+            b'data:{"token": {"text": "Hel"}}\n\ndata:{"tok',
+            b'en": {"text": "lo"}}\n\n',
+            b'data:{"token": {"text": "</s>", "special": true}, "details": {"finish_reason": "eos_token"}}\n\n',
+        ])
+        request = CreateCompletionDTO(
+            provider='sagemaker',
+            model='chat-endpoint',
+            messages=[MessageItem(role='user', content='hi')],
+            max_tokens=10,
+            stream=True
+        )
+
+        chunks = [_chunk async for _chunk in client.completions_stream(request)]
+        await client.close()
+
+        assert client.sagemaker_runtime_client.body['stream'] is True
+        assert chunks[0].choices[0].delta.role == 'assistant'
+        assert ''.join(_chunk.choices[0].delta.content or '' for _chunk in chunks) == 'Hello'
+        assert chunks[-1].choices[0].finish_reason == 'stop'
+        assert len(set(_chunk.id for _chunk in chunks)) == 1
+
+    @pytest.mark.asyncio
+    async def test_anthropic_stream_without_message_start_has_an_id(self):
+        with patch.dict('os.environ', {'ANTHROPIC_API_KEY': 'test'}):
+            client = AnthropicClient()
+        await client.close()
+        client.client = StreamingAnthropic([
+            SimpleNamespace(type='content_block_delta', delta=SimpleNamespace(type='text_delta', text='Hello')),
+            SimpleNamespace(type='message_delta', delta=SimpleNamespace(stop_reason='end_turn')),
+        ])
+        request = CreateCompletionDTO(
+            provider='anthropic',
+            model='claude',
+            messages=[MessageItem(role='user', content='hi')],
+            max_tokens=10,
+            stream=True
+        )
+
+        chunks = [_chunk async for _chunk in client.completions_stream(request)]
+
+        assert [_chunk.choices[0].delta.content for _chunk in chunks] == ['Hello', None]
+        assert chunks[0].id.startswith('chatcmpl-')
+        assert len(set(_chunk.id for _chunk in chunks)) == 1
+
+    @pytest.mark.asyncio
+    async def test_sagemaker_images_are_uploaded_concurrently_without_reencoding(self):
+        jpeg_image, bmp_image = _encoded_image('JPEG'), _encoded_image('BMP')
+        client = SageMakerClient()
+        client.sagemaker_runtime_client = ImagesSageMakerRuntime([jpeg_image] * 3 + [bmp_image])
+        client.s3_client = SlowS3()
+        request = CreateImageDTO(
+            provider='sagemaker', model='images-endpoint', prompt='a cat', n=4, width=64, height=64, seed=None
+        )
+
+        start = time.monotonic()
+        response = await client.generations(request)
+        elapsed = time.monotonic() - start
+        await client.close()
+
+        assert elapsed < UPSTREAM_LATENCY * 4 / 2
+        keys = [_item.url[len('https://s3/'):] for _item in response.data]
+        assert [_key.split('.')[1] for _key in keys] == ['jpeg', 'jpeg', 'jpeg', 'png']
+        assert client.s3_client.objects[keys[0]] == (jpeg_image, 'image/jpeg')
+        assert client.s3_client.objects[keys[3]][0].startswith(b'\x89PNG')
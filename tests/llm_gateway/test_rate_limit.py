@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from sagify.llm_gateway.api.v1.exceptions import TooManyRequestsError
+from sagify.llm_gateway.core.rate_limit import (
+    RateLimit,
+    RateLimiter,
+    TokenBucket,
+    api_key,
+    create_rate_limiter,
+    estimate_tokens
+)
+from sagify.llm_gateway.main import app
+from tests.llm_gateway.conftest import FakeClock, FakeEmbeddingsClient
+
+
+class TestTokenBucket(object):
+    def test_bucket_refills_at_its_rate_up_to_its_capacity(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=4, clock=clock)
+
+        bucket.take(4)
+        assert bucket.wait_time(1) == pytest.approx(0.5)
+
+        clock.now += 10
+        assert bucket.wait_time(4) == 0
+        assert bucket.wait_time(5) == 0
+
+    def test_admitted_amounts_queue_behind_each_other(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=1, clock=clock)
+
+        bucket.take(1)
+        bucket.take(1)
+
+        assert bucket.wait_time(1) == pytest.approx(2)
+
+
+class TestRateLimiter(object):
+    @pytest.mark.asyncio
+    async def test_requests_within_the_limit_are_admitted_without_waiting(self):
+        limiter = RateLimiter([RateLimit(provider='sagemaker', requests_per_minute=120, burst_seconds=1)])
+
+        await asyncio.wait_for(limiter.admit('chat', 'sagemaker'), timeout=0.05)
+        await asyncio.wait_for(limiter.admit('chat', 'sagemaker'), timeout=0.05)
+        await asyncio.wait_for(limiter.admit('chat', 'openai'), timeout=0.05)
+
+    @pytest.mark.asyncio
+    async def test_requests_over_the_limit_wait_up_to_the_maximum_wait(self):
+        limiter = RateLimiter([RateLimit(requests_per_minute=60 * 20)], max_wait=1)
+
+        for _ in range(20):
+            await limiter.admit('chat', 'sagemaker')
+        started_at = asyncio.get_running_loop().time()
+        await limiter.admit('chat', 'sagemaker')
+
+        assert asyncio.get_running_loop().time() - started_at >= 0.04
+
+    @pytest.mark.asyncio
+    async def test_requests_that_would_wait_too_long_are_rejected(self):
+        clock = FakeClock()
+        limiter = RateLimiter([RateLimit(tokens_per_minute=600)], max_wait=0.5, clock=clock)
+
+        await limiter.admit('chat', 'sagemaker', tokens=10)
+        with pytest.raises(TooManyRequestsError) as exc_info:
+            await limiter.admit('chat', 'sagemaker', tokens=30)
+
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.headers == {'Retry-After': '1'}
+
+    @pytest.mark.asyncio
+    async def test_requests_are_rejected_when_the_queue_is_full(self):
+        limiter = RateLimiter([RateLimit(requests_per_minute=60)], max_wait=10, max_queue=1)
+
+        await limiter.admit('chat', 'sagemaker')
+        waiting = asyncio.ensure_future(limiter.admit('chat', 'sagemaker'))
+        await asyncio.sleep(0)
+
+        with pytest.raises(TooManyRequestsError):
+            await limiter.admit('chat', 'sagemaker')
+        waiting.cancel()
+
+    @pytest.mark.asyncio
+    async def test_limits_per_api_key_are_separate(self):
+        clock = FakeClock()
+        limiter = RateLimiter([RateLimit(per_api_key=True, requests_per_minute=60)], max_wait=0, clock=clock)
+
+        for _key in ('first', 'second'):
+            token = api_key.set(_key)
+            await limiter.admit('chat', 'sagemaker')
+            api_key.reset(token)
+
+        token = api_key.set('first')
+        with pytest.raises(TooManyRequestsError):
+            await limiter.admit('chat', 'sagemaker')
+        api_key.reset(token)
+
+    @pytest.mark.asyncio
+    async def test_limits_per_model_are_separate(self):
+        limiter = RateLimiter([RateLimit(provider='sagemaker', model='llama', requests_per_minute=60)], max_wait=0)
+
+        await limiter.admit('chat', 'sagemaker', model='llama')
+        await limiter.admit('chat', 'sagemaker', model='mistral')
+        await limiter.admit('chat', 'sagemaker', model='mistral')
+        with pytest.raises(TooManyRequestsError):
+            await limiter.admit('chat', 'sagemaker', model='llama')
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_buckets_are_dropped(self):
+        limiter = RateLimiter([RateLimit(per_api_key=True, requests_per_minute=60)], max_buckets=2)
+
+        for _key in ('first', 'second', 'first', 'third'):
+            token = api_key.set(_key)
+            await limiter.admit('chat', 'sagemaker')
+            api_key.reset(token)
+
+        assert list(limiter._buckets) == [(0, 'requests', 'first'), (0, 'requests', 'third')]
+
+    @pytest.mark.asyncio
+    async def test_buckets_with_waiting_requests_are_kept(self):
+        clock = FakeClock()
+        limiter = RateLimiter([RateLimit(per_api_key=True, tokens_per_minute=60)], max_wait=10, max_buckets=1, clock=clock)
+
+        token = api_key.set('first')
+        await limiter.admit('chat', 'sagemaker', tokens=1)
+        waiting = asyncio.ensure_future(limiter.admit('chat', 'sagemaker', tokens=1))
+        await asyncio.sleep(0)
+        api_key.set('second')
+        await limiter.admit('chat', 'sagemaker', tokens=1)
+        api_key.reset(token)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+        assert list(limiter._buckets) == [(0, 'tokens', 'first'), (0, 'tokens', 'second')]
+
+    @pytest.mark.asyncio
+    async def test_cancelled_requests_give_their_tokens_back(self):
+        clock = FakeClock()
+        limiter = RateLimiter([RateLimit(tokens_per_minute=60)], max_wait=10, clock=clock)
+
+        await limiter.admit('chat', 'sagemaker', tokens=1)
+        waiting = asyncio.ensure_future(limiter.admit('chat', 'sagemaker', tokens=1))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+
+        clock.now += 1
+        await asyncio.wait_for(limiter.admit('chat', 'sagemaker', tokens=1), timeout=0.05)
+
+    def test_limits_are_created_from_the_environment(self):
+        limits = json.dumps([{'provider': 'sagemaker', 'endpoint': 'chat', 'requests_per_minute': 600}])
+        with patch.dict('os.environ', {'RATE_LIMITS': limits, 'RATE_LIMIT_MAX_WAIT_MS': '250'}):
+            limiter = create_rate_limiter()
+
+        assert limiter.enabled
+        assert limiter._max_wait == 0.25
+        assert create_rate_limiter().enabled is False
+
+    def test_tokens_are_estimated_from_the_text_length_and_max_tokens(self):
+        assert estimate_tokens(['a' * 40, 'b' * 8], max_tokens=100) == 112
+
+
+class TestRateLimitedApi(object):
+    def test_rejected_requests_get_a_429_with_retry_after(self):
+        limiter = RateLimiter([RateLimit(per_api_key=True, requests_per_minute=1)], max_wait=0)
+        request = {'provider': 'sagemaker', 'model': None, 'input': ['hello']}
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=FakeEmbeddingsClient()), \
+                patch('sagify.llm_gateway.services.embeddings.rate_limiter', limiter):
+            client = TestClient(app)
+            first = client.post('/v1/embeddings', json=request, headers={'Authorization': 'Bearer first'})
+            second = client.post('/v1/embeddings', json=request, headers={'Authorization': 'Bearer first'})
+            other_key = client.post('/v1/embeddings', json=request, headers={'X-API-Key': 'second'})
+
+        assert first.status_code == 200
+        assert second.status_code == 429
+        assert second.headers['retry-after'] == '60'
+        assert second.json() == {'error': 'Too Many Requests'}
+        assert other_key.status_code == 200
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import pytest
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from sagify.llm_gateway.providers.registry import LLMClientRegistry
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class TestLLMClientRegistry(object):
+    @pytest.mark.asyncio
+    async def test_client_is_created_once_and_reused(self):
+        with patch(
+            'sagify.llm_gateway.providers.client_factory.LLMClientFactory.create_client'
+        ) as mocked_create_client:
+            mocked_create_client.return_value = FakeClient()
+            registry = LLMClientRegistry(providers=["openai"])
+            await registry.startup()
+
+            first = await registry.get("openai")
+            second = await registry.get("openai")
+
+            assert first is second
+            assert mocked_create_client.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_startup_skips_unconfigured_providers(self):
+        with patch(
+            'sagify.llm_gateway.providers.client_factory.LLMClientFactory.create_client'
+        ) as mocked_create_client:
+            mocked_create_client.side_effect = Exception("missing credentials")
+            registry = LLMClientRegistry(providers=["openai"])
+            await registry.startup()
+
+            with pytest.raises(Exception):
+                await registry.get("openai")
+
+    @pytest.mark.asyncio
+    async def test_shutdown_closes_clients(self):
+        client = FakeClient()
+        with patch(
+            'sagify.llm_gateway.providers.client_factory.LLMClientFactory.create_client'
+        ) as mocked_create_client:
+            mocked_create_client.return_value = client
+            registry = LLMClientRegistry(providers=["sagemaker"])
+            await registry.startup()
+            await registry.shutdown()
+
+            assert client.closed
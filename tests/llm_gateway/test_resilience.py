@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+import asyncio
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from botocore.exceptions import ClientError
+import pytest
+
+from sagify.llm_gateway.api.v1.exceptions import (
+    BadRequestError,
+    GatewayTimeoutError,
+    InternalServerError,
+    ServiceUnavailableError,
+    TooManyRequestsError
+)
+from sagify.llm_gateway.core.metrics import ModelLabels
+from sagify.llm_gateway.core.resilience import Resilience, ResiliencePolicy, classify
+from sagify.llm_gateway.providers.anthropic.client import AnthropicClient
+from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO
+from tests.llm_gateway.conftest import FakeClock
+
+
+def _wrapped(error):
+    # The providers re-raise every error as an InternalServerError
+    try:
+        raise error
+    except Exception as e:
+        try:
+            raise InternalServerError(str(e))
+        except InternalServerError as wrapped:
+            return wrapped
+
+
+def _throttling_error():
+    return _wrapped(ClientError(
+        {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}, 'ResponseMetadata': {'HTTPStatusCode': 400}},
+        'InvokeEndpoint'
+    ))
+
+
+class FlakyUpstream(object):
+    def __init__(self, errors, delay=0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'response'
+
+
+def _resilience(clock=None, **settings):
+    policy = ResiliencePolicy(retry_base_delay=0.001, retry_max_delay=0.001, **settings)
+    return Resilience(default_policy=policy, clock=clock or FakeClock())
+
+
+@pytest.fixture(autouse=True)
+def known_models():
+    with patch('sagify.llm_gateway.core.resilience.model_labels', ModelLabels(['llama', 'mistral', 'gpt-4o'])):
+        yield
+
+
+class TestClassify(object):
+    def test_errors_are_classified_by_their_original_exception(self):
+        assert classify(_throttling_error()) == 'throttled'
+        assert classify(_wrapped(BadRequestError('Invalid model'))) == 'client'
+        assert classify(_wrapped(RuntimeError('Connection reset'))) == 'upstream'
+        assert classify(InternalServerError('endpoint is down')) == 'upstream'
+
+
+class TestResilience(object):
+    @pytest.mark.asyncio
+    async def test_throttled_calls_are_retried(self):
+        resilience = _resilience(max_retries=2)
+        upstream = FlakyUpstream([_throttling_error(), _throttling_error()])
+
+        assert await resilience.call('sagemaker', 'llama', upstream) == 'response'
+        assert upstream.calls == 3
+
+        upstream = FlakyUpstream([_throttling_error()] * 3)
+        with pytest.raises(TooManyRequestsError):
+            await resilience.call('sagemaker', 'llama', upstream)
+        assert upstream.calls == 3
+
+        upstream = FlakyUpstream([_wrapped(BadRequestError('Invalid model'))])
+        with pytest.raises(InternalServerError):
+            await resilience.call('sagemaker', 'llama', upstream)
+        assert upstream.calls == 1
+        assert resilience.breaker('sagemaker', 'llama').failures == 0
+
+    @pytest.mark.asyncio
+    async def test_breaker_opens_after_consecutive_failures_and_recovers(self):
+        clock = FakeClock()
+        resilience = _resilience(clock, failure_threshold=2, recovery_time=30)
+        failing = FlakyUpstream([InternalServerError('endpoint is down')] * 3)
+
+        for _ in range(2):
+            with pytest.raises(InternalServerError):
+                await resilience.call('sagemaker', 'llama', failing)
+        with pytest.raises(ServiceUnavailableError) as e:
+            await resilience.call('sagemaker', 'llama', failing)
+        assert failing.calls == 2
+        assert e.value.headers['Retry-After'] == '30'
+        # Other models of the provider have their own breaker
+        assert await resilience.call('sagemaker', 'mistral', FlakyUpstream([])) == 'response'
+
+        clock.now = 30
+        with pytest.raises(InternalServerError):
+            await resilience.call('sagemaker', 'llama', failing)
+        assert resilience.breaker('sagemaker', 'llama').state == 'open'
+
+        clock.now = 60
+        assert await resilience.call('sagemaker', 'llama', failing) == 'response'
+        assert resilience.health()['providers']['sagemaker']['circuit_breakers']['llama'] == {
+            'state': 'closed', 'consecutive_failures': 0
+        }
+
+    @pytest.mark.asyncio
+    async def test_unknown_models_share_a_breaker(self):
+        resilience = _resilience(failure_threshold=2)
+
+        for _model in ('random-1', 'random-2'):
+            with pytest.raises(InternalServerError):
+                await resilience.call('sagemaker', _model, FlakyUpstream([InternalServerError('endpoint is down')]))
+
+        assert resilience.breaker('sagemaker', 'random-3').state == 'open'
+        assert resilience.breaker('sagemaker', 'llama').state == 'closed'
+        assert set(resilience.health()['providers']['sagemaker']['circuit_breakers']) == {'other', 'llama'}
+
+    @pytest.mark.asyncio
+    async def test_unsupported_operations_do_not_open_the_breaker(self):
+        resilience = _resilience(failure_threshold=1)
+        with patch.dict('os.environ', {'ANTHROPIC_API_KEY': 'test'}):
+            client = AnthropicClient()
+        request = CreateEmbeddingDTO(provider='anthropic', model='claude', input='hello')
+
+        for _ in range(2):
+            with pytest.raises(BadRequestError):
+                await resilience.call('anthropic', 'claude', lambda: client.embeddings(request))
+        await client.client.close()
+
+        assert resilience.breaker('anthropic', 'claude').state == 'closed'
+
+    @pytest.mark.asyncio
+    async def test_slow_calls_time_out_per_model(self):
+        resilience = Resilience(
+            policies={('openai', None): {'read_timeout_ms': 10}, ('openai', 'gpt-4o'): {'read_timeout_ms': 1000}},
+            clock=FakeClock()
+        )
+
+        with pytest.raises(GatewayTimeoutError):
+            await resilience.call('openai', 'gpt-4o-mini', FlakyUpstream([], delay=0.05))
+        assert await resilience.call('openai', 'gpt-4o', FlakyUpstream([], delay=0.05)) == 'response'
+        assert resilience.breaker('openai', 'gpt-4o-mini').failures == 1
+        assert resilience.max_read_timeout('openai') == 1
+
+    @pytest.mark.asyncio
+    async def test_bulkhead_rejects_calls_beyond_its_concurrency(self):
+        resilience = _resilience(max_concurrency=2, max_queue_wait=0.01)
+
+        results = await asyncio.gather(
+            *[resilience.call('sagemaker', 'llama', FlakyUpstream([], delay=0.05)) for _ in range(3)],
+            resilience.call('openai', 'gpt-4o', FlakyUpstream([], delay=0.05)),
+            return_exceptions=True
+        )
+
+        assert results[:2] == ['response', 'response']
+        assert isinstance(results[2], ServiceUnavailableError)
+        assert results[3] == 'response'
+
+    @pytest.mark.asyncio
+    async def test_streams_time_out_between_chunks(self):
+        resilience = _resilience(read_timeout=0.02)
+
+        async def _chunks(delays):
+            for _delay in delays:
+                await asyncio.sleep(_delay)
+                yield _delay
+
+        assert [_chunk async for _chunk in resilience.stream('openai', 'gpt-4o', _chunks([0.01] * 4))] == [0.01] * 4
+        with pytest.raises(GatewayTimeoutError):
+            [_chunk async for _chunk in resilience.stream('openai', 'gpt-4o', _chunks([0.01, 0.1]))]
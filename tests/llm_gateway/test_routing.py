@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import io
+import json
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+from botocore.exceptions import ClientError
+import pytest
+
+from sagify.llm_gateway.providers.aws.routing import LATENCY, Endpoint, EndpointPool, create_endpoint_pools
+from sagify.llm_gateway.providers.aws.sagemaker import SageMakerClient
+from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO
+from tests.llm_gateway.conftest import FakeClock
+
+
+class EndpointNameSageMakerRuntime(object):
+    def __init__(self, failing_endpoints=()):
+        self.endpoints = []
+        self._failing_endpoints = failing_endpoints
+
+    def invoke_endpoint(self, **kwargs):
+        self.endpoints.append(kwargs['EndpointName'])
+        if kwargs['EndpointName'] in self._failing_endpoints:
+            raise RuntimeError('endpoint is down')
+        return {'Body': io.BytesIO(json.dumps({'embedding': [[0.1]]}).encode('utf-8'))}
+
+    def close(self):
+        pass
+
+
+def _fail(pool):
+    with pytest.raises(RuntimeError):
+        with pool.route():
+            raise RuntimeError('endpoint is down')
+
+
+class TestEndpointPool(object):
+    def test_routes_to_the_endpoint_with_least_outstanding_requests(self):
+        pool = EndpointPool('llama', [Endpoint('a'), Endpoint('b')])
+
+        with pool.route() as first:
+            with pool.route() as second:
+                assert {first.name, second.name} == {'a', 'b'}
+            with pool.route() as third:
+                assert third is second
+
+        assert [_endpoint.outstanding for _endpoint in pool.endpoints] == [0, 0]
+
+    def test_latency_strategy_prefers_the_faster_endpoint(self):
+        clock = FakeClock()
+        fast, slow = Endpoint('fast'), Endpoint('slow')
+        pool = EndpointPool('llama', [fast, slow], strategy=LATENCY, clock=clock)
+        fast.latency_ewma, slow.latency_ewma = 0.1, 1.0
+
+        with pool.route() as endpoint:
+            clock.now += 0.1
+
+        assert endpoint is fast
+        assert fast.latency_ewma == pytest.approx(0.1)
+
+    def test_latency_strategy_spreads_load_when_the_faster_endpoint_is_busy(self):
+        fast, slow = Endpoint('fast'), Endpoint('slow')
+        pool = EndpointPool('llama', [fast, slow], strategy=LATENCY)
+        fast.latency_ewma, slow.latency_ewma = 0.1, 0.3
+        fast.outstanding = 3
+
+        assert pool.pick() is slow
+
+    def test_failing_endpoint_is_ejected_and_readmitted(self):
+        clock = FakeClock()
+        pool = EndpointPool('llama', [Endpoint('a'), Endpoint('b')], failure_threshold=2, ejection_seconds=30, clock=clock)
+        pool.endpoints[1].outstanding = 10
+
+        _fail(pool)
+        _fail(pool)
+
+        assert pool.pick().name == 'b'
+        clock.now += 31
+        assert pool.pick().name == 'a'
+
+    def test_client_errors_do_not_eject_the_endpoint(self):
+        pool = EndpointPool('llama', [Endpoint('a')], failure_threshold=1)
+        validation_error = ClientError(
+            {'Error': {'Code': 'ValidationError', 'Message': 'Input is too long'}, 'ResponseMetadata': {'HTTPStatusCode': 400}},
+            'InvokeEndpoint'
+        )
+
+        with pytest.raises(ClientError):
+            with pool.route():
+                raise validation_error
+        assert pool.endpoints[0].ejected_until == 0.0
+
+        throttling_error = ClientError(
+            {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}, 'ResponseMetadata': {'HTTPStatusCode': 400}},
+            'InvokeEndpoint'
+        )
+        with pytest.raises(ClientError):
+            with pool.route():
+                raise throttling_error
+        assert pool.endpoints[0].ejected_until > 0.0
+
+    def test_all_endpoints_ejected_falls_back_to_the_soonest_back(self):
+        clock = FakeClock()
+        first, second = Endpoint('a'), Endpoint('b')
+        pool = EndpointPool('llama', [first, second], clock=clock)
+        first.ejected_until, second.ejected_until = 20, 10
+
+        assert pool.pick() is second
+
+    def test_pools_are_created_from_the_environment(self):
+        pools_config = json.dumps({'llama': ['llama-a', {'name': 'llama-b', 'region': 'eu-west-1'}]})
+        with patch.dict('os.environ', {'SM_ENDPOINT_POOLS': pools_config, 'SM_ROUTING_STRATEGY': 'latency'}):
+            pools = create_endpoint_pools()
+
+        assert [(_endpoint.name, _endpoint.region) for _endpoint in pools['llama'].endpoints] == [
+            ('llama-a', None), ('llama-b', 'eu-west-1')
+        ]
+
+
+class TestSageMakerEndpointPools(object):
+    @pytest.mark.asyncio
+    async def test_alias_requests_are_routed_to_the_pool_endpoints(self):
+        with patch.dict('os.environ', {'SM_ENDPOINT_POOLS': json.dumps({'embedder': ['embedder-a', 'embedder-b']})}):
+            client = SageMakerClient()
+        client.sagemaker_runtime_client = EndpointNameSageMakerRuntime(failing_endpoints=['embedder-b'])
+        request = CreateEmbeddingDTO(provider='sagemaker', model='embedder', input=['hello'])
+
+        results = []
+        for _ in range(10):
+            try:
+                results.append(await client.embeddings(request))
+            except Exception as e:
+                results.append(e)
+        await client.close()
+
+        endpoints = client.sagemaker_runtime_client.endpoints
+        # embedder-b is ejected after its third consecutive failure
+        assert endpoints.count('embedder-b') == 3
+        assert endpoints.count('embedder-a') == 7
+        assert sum(1 for _result in results if isinstance(_result, Exception)) == 3
+        assert all(_result.model == 'embedder' for _result in results if not isinstance(_result, Exception))
+
+    @pytest.mark.asyncio
+    async def test_endpoints_in_other_regions_use_their_own_client(self):
+        pools_config = json.dumps({'embedder': [{'name': 'embedder-eu', 'region': 'eu-west-1'}]})
+        with patch.dict('os.environ', {'SM_ENDPOINT_POOLS': pools_config}):
+            client = SageMakerClient()
+        client._runtime_clients['eu-west-1'] = EndpointNameSageMakerRuntime()
+
+        await client.embeddings(CreateEmbeddingDTO(provider='sagemaker', model='embedder', input=['hello']))
+        await client.close()
+
+        assert client._runtime_clients['eu-west-1'].endpoints == ['embedder-eu']
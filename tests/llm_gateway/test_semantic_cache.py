@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import numpy as np
+import pytest
+
+from sagify.llm_gateway.core.rate_limit import RateLimit, RateLimiter
+from sagify.llm_gateway.schemas.chat import ChoiceItem, CreateCompletionDTO, MessageItem, ResponseCompletionDTO
+from sagify.llm_gateway.schemas.embeddings import ResponseEmbeddingDTO
+from sagify.llm_gateway.services import chat
+from sagify.llm_gateway.services.semantic_cache import SemanticCache, SemanticIndex
+
+_VECTORS = {
+    'user: What is the capital of France?': [1.0, 0.0, 0.0],
+    'user: Which city is the capital of France?': [0.99, 0.1, 0.0],
+    'user: How tall is the Eiffel Tower?': [0.0, 1.0, 0.0],
+}
+
+
+class FakeClient(object):
+    def __init__(self, embeddings_error=None):
+        self.completion_calls = 0
+        self.embedding_calls = 0
+        self.embeddings_error = embeddings_error
+
+    def default_model(self, endpoint):
+        return '{}-model'.format(endpoint)
+
+    async def embeddings(self, embedding_input):
+        self.embedding_calls += 1
+        if self.embeddings_error is not None:
+            raise self.embeddings_error
+        return ResponseEmbeddingDTO.from_embeddings(
+            embedding_input.provider, 'embeddings-model', [_VECTORS[_text] for _text in embedding_input.input]
+        )
+
+    async def completions(self, message):
+        self.completion_calls += 1
+        return ResponseCompletionDTO(
+            id='chatcmpl-{}'.format(self.completion_calls),
+            object='chat.completion',
+            created=1,
+            provider=message.provider,
+            model='chat-model',
+            choices=[ChoiceItem(index=0, message=MessageItem(role='assistant', content='answer'))]
+        )
+
+
+def _message(content, max_tokens=10):
+    return CreateCompletionDTO(
+        provider='openai', model=None, messages=[MessageItem(role='user', content=content)], max_tokens=max_tokens
+    )
+
+
+class TestSemanticIndex(object):
+    def test_search_returns_the_most_similar_vector_of_the_partition(self):
+        index = SemanticIndex(max_entries=10)
+        index.add(np.array([1.0, 0.0], dtype=np.float32), 'a', 'first')
+        index.add(np.array([0.0, 1.0], dtype=np.float32), 'a', 'second')
+        index.add(np.array([0.6, 0.8], dtype=np.float32), 'b', 'other partition')
+
+        slot, similarity = index.search(np.array([0.6, 0.8], dtype=np.float32), 'a')
+
+        assert index.get(slot) == 'second'
+        assert similarity == pytest.approx(0.8)
+        assert index.search(np.array([1.0, 0.0], dtype=np.float32), 'c') == (None, -1.0)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        index = SemanticIndex(max_entries=2, initial_capacity=1)
+        index.add(np.array([1.0, 0.0], dtype=np.float32), 'a', 'first')
+        index.add(np.array([0.0, 1.0], dtype=np.float32), 'a', 'second')
+        index.get(index.search(np.array([1.0, 0.0], dtype=np.float32), 'a')[0])
+        index.add(np.array([-1.0, 0.0], dtype=np.float32), 'a', 'third')
+
+        values = {index.get(index.search(_vector, 'a')[0]) for _vector in np.eye(2, dtype=np.float32)}
+
+        assert len(index) == 2
+        assert values == {'first'}
+        assert index.get(index.search(np.array([-1.0, 0.0], dtype=np.float32), 'a')[0]) == 'third'
+
+
+class TestSemanticCache(object):
+    @pytest.mark.asyncio
+    async def test_paraphrase_is_answered_from_the_cache(self):
+        fake_client = FakeClient()
+        cache = SemanticCache('openai', threshold=0.95)
+
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.chat.semantic_cache', cache):
+            first = await chat.completions(_message('What is the capital of France?'))
+            paraphrase = await chat.completions(_message('Which city is the capital of France?'))
+            other_prompt = await chat.completions(_message('How tall is the Eiffel Tower?'))
+            other_parameters = await chat.completions(_message('What is the capital of France?', max_tokens=20))
+
+        assert fake_client.completion_calls == 3
+        assert paraphrase.id == first.id
+        assert other_prompt.id != first.id
+        assert other_parameters.id != first.id
+
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['entries']) == (1, 3, 3)
+        assert stats['hit_rate'] == pytest.approx(0.25)
+        assert 'similarity' in stats
+
+    @pytest.mark.asyncio
+    async def test_embedding_failures_are_cache_misses(self):
+        fake_client = FakeClient(embeddings_error=RuntimeError('embeddings are down'))
+        cache = SemanticCache('openai', threshold=0.95)
+
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.chat.semantic_cache', cache):
+            first = await chat.completions(_message('What is the capital of Italy?'))
+            paraphrase = await chat.completions(_message('Which city is the capital of Italy?'))
+
+        assert fake_client.completion_calls == 2
+        assert paraphrase.id != first.id
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['entries']) == (0, 2, 0)
+
+    @pytest.mark.asyncio
+    async def test_lookups_are_not_admitted_by_the_embeddings_rate_limits(self):
+        fake_client = FakeClient()
+        cache = SemanticCache('openai', threshold=0.95)
+        limiter = RateLimiter([RateLimit(endpoint='embeddings', tokens_per_minute=1)], max_wait=0)
+
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.chat.semantic_cache', cache), \
+                patch('sagify.llm_gateway.services.embeddings.rate_limiter', limiter):
+            first = await chat.completions(_message('What is the capital of France?'))
+            paraphrase = await chat.completions(_message('Which city is the capital of France?'))
+
+        assert fake_client.completion_calls == 1
+        assert paraphrase.id == first.id
+
+    def test_cache_is_disabled_without_an_embeddings_provider(self):
+        assert not SemanticCache(None).enabled
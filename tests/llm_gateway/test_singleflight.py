@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import asyncio
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pytest
+
+from sagify.llm_gateway.core.singleflight import SingleFlight
+from sagify.llm_gateway.schemas.embeddings import CreateEmbeddingDTO, ResponseEmbeddingDTO
+from sagify.llm_gateway.services import embeddings
+from sagify.llm_gateway.services.cache import ResponseCache
+
+
+class FakeCall(object):
+    def __init__(self, error=None, delay=0.01):
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+        self.cancelled = False
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        if self.error is not None:
+            raise self.error
+        return {'call': self.calls}
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.calls = 0
+
+    def default_model(self, endpoint):
+        return '{}-model'.format(endpoint)
+
+    async def embeddings(self, embedding_input):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return ResponseEmbeddingDTO.from_embeddings(embedding_input.provider, 'embeddings-model', [[0.5]])
+
+
+class TestSingleFlight(object):
+    @pytest.mark.asyncio
+    async def test_identical_concurrent_calls_share_one_call(self):
+        singleflight = SingleFlight()
+        call = FakeCall()
+
+        results = await asyncio.gather(*[singleflight.do('chat', 'key', call) for _ in range(5)])
+        other = await singleflight.do('chat', 'other', call)
+
+        assert call.calls == 2
+        assert results == [{'call': 1}] * 5
+        assert other == {'call': 2}
+        assert singleflight.stats() == {'calls': 2, 'coalesced': 4, 'in_flight': 0}
+
+    @pytest.mark.asyncio
+    async def test_every_waiter_gets_the_error(self):
+        singleflight = SingleFlight()
+        call = FakeCall(error=ValueError('upstream is down'))
+
+        results = await asyncio.gather(*[singleflight.do('chat', 'key', call) for _ in range(3)], return_exceptions=True)
+
+        assert call.calls == 1
+        assert all(isinstance(_result, ValueError) for _result in results)
+
+    @pytest.mark.asyncio
+    async def test_call_is_only_cancelled_when_every_waiter_went_away(self):
+        singleflight = SingleFlight()
+        call = FakeCall(delay=0.05)
+
+        first = asyncio.ensure_future(singleflight.do('chat', 'key', call))
+        second = asyncio.ensure_future(singleflight.do('chat', 'key', call))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == {'call': 1}
+        assert not call.cancelled
+
+        third = asyncio.ensure_future(singleflight.do('chat', 'other', call))
+        await asyncio.sleep(0.01)
+        third.cancel()
+        await asyncio.sleep(0.01)
+        assert call.cancelled
+
+    @pytest.mark.asyncio
+    async def test_call_joining_a_cancelled_flight_runs_again(self):
+        singleflight = SingleFlight()
+        call = FakeCall()
+
+        first = asyncio.ensure_future(singleflight.do('chat', 'key', call))
+        await asyncio.sleep(0.005)
+        first.cancel()
+        second = asyncio.ensure_future(singleflight.do('chat', 'key', call))
+
+        assert await second == {'call': 2}
+        assert call.cancelled
+        assert first.cancelled()
+
+    @pytest.mark.asyncio
+    async def test_calls_of_disabled_endpoints_always_run(self):
+        singleflight = SingleFlight(disabled_endpoints=['chat'])
+        call = FakeCall()
+
+        await asyncio.gather(*[singleflight.do('chat', 'key', call) for _ in range(3)])
+
+        assert call.calls == 3
+
+    @pytest.mark.asyncio
+    async def test_identical_embedding_requests_are_coalesced_without_a_cache(self):
+        fake_client = FakeClient()
+        requests = [CreateEmbeddingDTO(provider='openai', input=['same text']) for _ in range(4)]
+
+        with patch('sagify.llm_gateway.providers.registry.LLMClientRegistry.get', return_value=fake_client), \
+                patch('sagify.llm_gateway.services.embeddings.response_cache', ResponseCache(None)), \
+                patch('sagify.llm_gateway.services.embeddings.singleflight', SingleFlight()):
+            responses = await asyncio.gather(*[embeddings.embeddings(_request) for _request in requests])
+
+        assert fake_client.calls == 1
+        assert all(_response.data[0].embedding == [0.5] for _response in responses)